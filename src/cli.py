@@ -1,32 +1,97 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import nullcontext, redirect_stdout
+from importlib import import_module
+from os import environ, pathsep
+from os.path import dirname, abspath
 from signal import SIGINT, signal
+from sys import argv, executable, stderr
+from typing import List
 from colorama import just_fix_windows_console
 
-from mimic.cmd.alias import alias
-from mimic.cmd.clone import clone
-from mimic.cmd.lint import lint
-from mimic.cmd.init import init
-from mimic.cmd.preview import preview
-from mimic.options import NewMimicCloneOptions, NewMimicInitOptions, NewMimicLintOptions, NewMimicOptions, NewMimicAliasOptions, NewMimicAliasAction, NewMimicPreviewOptions
+from mimic.options import NewMimicCloneOptions, NewMimicInitOptions, NewMimicLintOptions, NewMimicOptions, NewMimicAliasOptions, NewMimicAliasAction, NewMimicPreviewOptions, NewMimicIndexOptions, NewMimicPackOptions
+
+def _positive_int(raw_value : str) -> int :
+  try:
+    value = int(raw_value)
+  except ValueError:
+    value = 0
+  if value < 1:
+    raise ArgumentTypeError(f"{raw_value} is not a positive integer")
+  return value
+
+# Commands are registered by name, their module (mimic.cmd.<name>) is only imported when the command is dispatched
+mimic_commands = ["alias", "clone", "lint", "init", "preview", "index", "pack"]
+
+# Import time of the whole CLI above which --startup-profile reports a regression
+startup_import_budget_ms = 200
+
+def _startup_profile(command_args : List[str]) -> int :
+  """
+  Runs mimic with command_args under -X importtime, then reports its slowest imports and whether startup fits in the budget.
+  """
+
+  from subprocess import run, PIPE
+
+  env = environ.copy()
+  env["PYTHONPATH"] = pathsep.join(filter(None, [dirname(abspath(__file__)), env.get("PYTHONPATH")]))
+  profiled_cp = run([executable, "-X", "importtime", "-c", "from cli import main; main()", *command_args], env=env, stderr=PIPE, text=True)
+
+  import_timings = []
+  for line in profiled_cp.stderr.splitlines():
+    if not line.startswith("import time:") or line.endswith("imported package"):
+      print(line, file=stderr)
+      continue
+    self_us, cumulative_us, imported_package = line.removeprefix("import time:").split("|")
+    import_timings.append((int(cumulative_us), int(self_us), imported_package.rstrip()))
+
+  # Top level imports are not indented, their cumulative times add up to the whole import time
+  total_import_ms = sum(cumulative_us for cumulative_us, _, imported_package in import_timings if not imported_package.startswith("  ")) / 1000
+
+  print(f"{'cumulative [ms]':>16} | {'self [ms]':>10} | imported package", file=stderr)
+  for cumulative_us, self_us, imported_package in sorted(import_timings, reverse=True)[:20]:
+    print(f"{cumulative_us / 1000:>16.1f} | {self_us / 1000:>10.1f} |{imported_package}", file=stderr)
+  print(f"startup imports took {total_import_ms:.1f}ms ({len(import_timings)} modules), budget is {startup_import_budget_ms}ms", file=stderr)
+
+  if startup_import_budget_ms < total_import_ms:
+    print(f"startup imports exceed the budget by {total_import_ms - startup_import_budget_ms:.1f}ms", file=stderr)
+    return 1
+
+  return profiled_cp.returncode
 
 def main():
+  if argv[1:2] == ["--startup-profile"]:
+    exit(_startup_profile(argv[2:]))
+
   just_fix_windows_console()
   
   signal(SIGINT, lambda _a, _b: print() or exit(-1))
   arg_parser = ArgumentParser(prog="mimic")
+  arg_parser.add_argument("--startup-profile", action="store_true", help=f"run the command while profiling the time spent importing modules, fails if it exceeds {startup_import_budget_ms}ms (must be the first argument)")
 
   sub_parser = arg_parser.add_subparsers(dest="command", required=True)
   
   clone_parser = sub_parser.add_parser("clone", description="clone and generate a mimic from a mimic template")
-  clone_parser.add_argument("mimic_uri", type=str, help="URI to a mimic template (either a git repository or a path to a local mimic template)")
-  clone_parser.add_argument("out_dir", type=str, help="mimic output directory", nargs='?')
+  clone_parser.add_argument("mimic_uri", type=str, help="URI to a mimic template (either a git repository, a path to a local mimic template, a path to a mimic pack or a path or file:// URL to a tar or zip archive of a mimic template)")
+  clone_parser.add_argument("out_dir", type=str, help="mimic output directory, or tar file with --output-format tar (- writes the mimic to stdout as a tar stream)", nargs='?')
   clone_parser.add_argument("-u", "--unsafe", action="store_true", help="enable unsafe mode, hooks will run without user confirmation")
   clone_parser.add_argument("-f", "--file", help="mimic wallet to use to resolve alias")
+  clone_parser.add_argument("-j", "--jobs", type=_positive_int, help="maximum number of files processed (and hooks run) concurrently, defaults to the number of CPUs + 4 (up to 32)")
+  clone_parser.add_argument("--backend", help="render template files in threads or in separate processes (faster on large templates)", default="thread", choices=["thread", "process"])
+  clone_parser.add_argument("--answers", help="generate a mimic per line of a JSON lines file of variables values instead of prompting them (requires --out-pattern)")
+  clone_parser.add_argument("--out-pattern", help="output directory of each mimic generated with --answers, variables are injected in it (eg 'svc-{{ name }}')")
+  clone_parser.add_argument("--output-format", help="write the mimic as a directory, or as a tar stream to out_dir (stdout when omitted), hooks are not supported with tar", default="dir", choices=["dir", "tar"])
+  clone_cache_group = clone_parser.add_mutually_exclusive_group()
+  clone_cache_group.add_argument("--offline", action="store_true", help="clone git mimic templates from the local cache without reaching the remote")
+  clone_cache_group.add_argument("--no-cache", action="store_true", help="clone git mimic templates from the remote without using the local cache")
 
 
   lint_parser = sub_parser.add_parser("lint", description="detect errors in your mimic template")
   lint_parser.add_argument("mimic_template_dir", type=str, help="mimic template directory", nargs='?')
-  lint_parser.add_argument("--fix", help="automatically fix mimic template issues by either escaping or clearing undefined variables", default=None, const="escape", choices=["escape", "clear"], nargs="?")
+  lint_mode_group = lint_parser.add_mutually_exclusive_group()
+  lint_mode_group.add_argument("--fix", help="automatically fix mimic template issues by either escaping or clearing undefined variables", default=None, const="escape", choices=["escape", "clear"], nargs="?")
+  lint_mode_group.add_argument("-w", "--watch", help="lint the mimic template again each time it changes", action="store_true")
+  lint_parser.add_argument("-j", "--jobs", type=_positive_int, help="maximum number of files processed concurrently, defaults to the number of CPUs + 4 (up to 32)")
+  lint_parser.add_argument("--no-cache", help="scan every file again instead of reusing the results of the previous lint (.mimic-cache/lint.idx)", action="store_true")
 
   alias_parser = sub_parser.add_parser("alias", description="manage your aliases: shortnames pointing to mimic templates")
   alias_action_sub_parser = alias_parser.add_subparsers(dest="action", required=True)
@@ -51,22 +116,52 @@ def main():
 
   preview_parser = sub_parser.add_parser("preview", description="Preview your mimic template")
   preview_parser.add_argument("mimic_template_dir", type=str, help="mimic template directory", nargs='?')
+  preview_parser.add_argument("-j", "--jobs", type=_positive_int, help="maximum number of files processed concurrently, defaults to the number of CPUs + 4 (up to 32)")
+  preview_parser.add_argument("-w", "--watch", help="preview the mimic template again each time it changes, without asking variables values again", action="store_true")
+  preview_parser.add_argument("--format", help="output format: colored text, a unified diff, or one JSON object per changed path (diff and json write prompts and logs to stderr)", choices=["text", "diff", "json"], default="text")
+  preview_parser.add_argument("--max-changes", type=_positive_int, help="maximum number of changed lines shown per file, the other ones are only counted")
+
+  index_parser = sub_parser.add_parser("index", description="write the placeholders offsets of your mimic template to .mimic.index, so that mimics are rendered without searching placeholders")
+  index_parser.add_argument("mimic_template_dir", type=str, help="mimic template directory", nargs='?')
+  index_parser.add_argument("-j", "--jobs", type=_positive_int, help="maximum number of files processed concurrently, defaults to the number of CPUs + 4 (up to 32)")
+
+  pack_parser = sub_parser.add_parser("pack", description="pack your mimic template into a single file that can be cloned")
+  pack_parser.add_argument("mimic_template_dir", type=str, help="mimic template directory", nargs='?')
+  pack_parser.add_argument("-o", "--output", help="mimic pack file to write, defaults to <mimic_template_dir>.mimicpack")
+  pack_parser.add_argument("--compression", help="compression of the packed files (zstd requires python 3.14 or later)", default="zlib", choices=["zlib", "zstd", "none"])
+  pack_parser.add_argument("-j", "--jobs", type=_positive_int, help="maximum number of files processed concurrently, defaults to the number of CPUs + 4 (up to 32)")
 
   args = arg_parser.parse_args()
 
   command_options = None
   match args.command:
     case "clone":
+      if (args.answers is None) != (args.out_pattern is None):
+        clone_parser.error("--answers and --out-pattern must be used together")
+      if args.answers is not None and args.out_dir is not None:
+        clone_parser.error("out_dir cannot be used with --answers, use --out-pattern instead")
+      if args.answers is not None and (args.output_format == "tar" or args.out_dir == "-"):
+        clone_parser.error("mimics generated with --answers cannot be written as a tar stream")
       command_options = NewMimicCloneOptions({
         "out_dir": args.out_dir,
         "mimic_uri": args.mimic_uri,
         "unsafe_mode": args.unsafe,
-        "alias_wallet_file_path": args.file
+        "alias_wallet_file_path": args.file,
+        "jobs": args.jobs,
+        "backend": args.backend,
+        "offline": args.offline,
+        "no_cache": args.no_cache,
+        "answers_file_path": args.answers,
+        "out_pattern": args.out_pattern,
+        "output_format": args.output_format
       })
     case "lint":
       command_options = NewMimicLintOptions({
         "mimic_template_dir": args.mimic_template_dir,
-        "fix": args.fix
+        "fix": args.fix,
+        "jobs": args.jobs,
+        "use_cache": not args.no_cache,
+        "watch": args.watch
       })
     case "alias": 
       command_options = NewMimicAliasOptions({
@@ -79,7 +174,23 @@ def main():
       })
     case "preview":
       command_options = NewMimicPreviewOptions({
-        "mimic_template_dir": args.mimic_template_dir
+        "mimic_template_dir": args.mimic_template_dir,
+        "jobs": args.jobs,
+        "watch": args.watch,
+        "format": args.format,
+        "max_changes": args.max_changes
+      })
+    case "index":
+      command_options = NewMimicIndexOptions({
+        "mimic_template_dir": args.mimic_template_dir,
+        "jobs": args.jobs
+      })
+    case "pack":
+      command_options = NewMimicPackOptions({
+        "mimic_template_dir": args.mimic_template_dir,
+        "output": args.output,
+        "compression": args.compression,
+        "jobs": args.jobs
       })
     case _ as unknown:
       arg_parser.error(f'unknown command "{unknown}". Use -h,--help for usage information.')
@@ -88,23 +199,20 @@ def main():
     "command": command_options,
   })
 
+  # Mimics written to stdout as a tar stream keep stdout for the stream, logs and prompts go to stderr
+  is_stdout_stream = options["command"]["name"] == "clone" and options["command"]["output_format"] == "tar" and options["command"]["out_dir"] == None
+
   result = False
-  try:
-    match options["command"]["name"]:
-      case "alias":
-        result = alias(options)
-      case "clone":
-        result = clone(options)
-      case "lint":
-        result = lint(options)
-      case "init":
-        result = init(options)
-      case "preview":
-        result = preview(options)
-      case _ as unknown:
-        options["logger"].error(f'unknown command "{unknown}". Use -h,--help for usage information.')
-  except Exception as e:
-    options["logger"].error(e)
+  with redirect_stdout(stderr) if is_stdout_stream else nullcontext():
+    try:
+      command_name = options["command"]["name"]
+      if command_name in mimic_commands:
+        command = getattr(import_module(f"mimic.cmd.{command_name}"), command_name)
+        result = command(options)
+      else:
+        options["logger"].error(f'unknown command "{command_name}". Use -h,--help for usage information.')
+    except Exception as e:
+      options["logger"].error(e)
 
   exit(0 if result else 1)
 
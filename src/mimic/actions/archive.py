@@ -0,0 +1,101 @@
+from io import BytesIO, TextIOWrapper
+from os import makedirs, chmod
+from os.path import join, dirname
+from typing import Dict, Any, List, Set, Tuple, Union, Iterator
+
+from .template import MimicRenderBackend
+from ..utils.archive import MimicArchive, get_mimic_template_path
+from ..utils.config import MimicConfig, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.fs import GlobMatcher, is_relative_path_below, check_file_name
+from ..utils.render import MimicRenderer
+from ..utils.scheduler import schedule, schedule_batches
+
+# Set once per worker process by the process backend
+_worker_renderer : Union[MimicRenderer, None] = None
+
+# (content, parsed path, permissions, is raw)
+MimicArchiveFile = Tuple[bytes, str, int, bool]
+
+def _render_archive_file(content : bytes, parsed_file_path : str, permissions : int, is_raw_file : bool, renderer : MimicRenderer) -> bool :
+  try:
+    # Same sniffing as is_binary_file and file_contains
+    if is_raw_file or b"\x00" in content[:8192] or not b"{{" in content:
+      with open(parsed_file_path, "wb") as parsed_fd:
+        parsed_fd.write(content)
+    else:
+      with TextIOWrapper(BytesIO(content)) as source_fd, open(parsed_file_path, "w") as parsed_fd:
+        renderer.render_stream(source_fd, parsed_fd)
+    chmod(parsed_file_path, permissions)
+
+    return True
+  except Exception:
+    return False
+
+def _init_archive_file_worker(renderer : MimicRenderer) -> None :
+  global _worker_renderer
+  _worker_renderer = renderer
+
+def _render_archive_file_batch(archive_files : List[MimicArchiveFile]) -> List[bool] :
+  return [_render_archive_file(*archive_file, _worker_renderer) for archive_file in archive_files]
+
+def render_mimic_archive(mimic_archive : MimicArchive, mimic_template_root : str, out_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], excluded_paths : List[str] = [], jobs : Union[int, None] = None, backend : MimicRenderBackend = "thread") -> bool :
+  """
+  Renders the mimic template found under mimic_template_root in a tar or zip archive straight into out_dir, like render_mimic_template renders a mimic template.
+  The archive is read in order, from where MimicArchive.read_config stopped: entries read before the mimic config are rendered from their buffered content, then each file is rendered and written as soon as it is decoded, nothing is extracted beforehand.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  ignore_matcher = GlobMatcher(mimic_config.template.ignorePatterns)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  excluded_relative_paths = [mimic_cache_dir_name, mimic_index_file_name, *excluded_paths]
+  # Relative path -> (parsed path, is ignored, is the whole tree below it ignored)
+  resolved_paths : Dict[str, Tuple[str, bool, bool]] = {"": (out_dir, False, False)}
+  parsed_dir_paths : Set[str] = {out_dir}
+  parsed_dir_permissions : List[Tuple[str, int]] = []
+
+  makedirs(out_dir, exist_ok=True)
+
+  def _resolve_path(relative_path : str) -> Tuple[str, bool, bool] :
+    # Archives do not always list directories before their content, if at all
+    resolved_path = resolved_paths.get(relative_path)
+    if resolved_path == None:
+      relative_dir_path, _, source_name = relative_path.rpartition("/")
+      parsed_dir_path, _, is_dir_tree_ignored = _resolve_path(relative_dir_path)
+      is_ignored = is_dir_tree_ignored or ignore_matcher.match(relative_path)
+      resolved_path = (join(parsed_dir_path, source_name if is_ignored else check_file_name(renderer.render(source_name), relative_path)), is_ignored, is_dir_tree_ignored or ignore_matcher.match_tree(relative_path))
+      resolved_paths[relative_path] = resolved_path
+    return resolved_path
+
+  def _archive_files() -> Iterator[MimicArchiveFile] :
+    for entry_path, is_directory, permissions, fd in mimic_archive.entries():
+      relative_path = get_mimic_template_path(entry_path, mimic_template_root)
+      if not relative_path or is_relative_path_below(relative_path, excluded_relative_paths):
+        continue
+
+      parsed_path, is_ignored, _ = _resolve_path(relative_path)
+      if is_directory:
+        makedirs(parsed_path, exist_ok=True)
+        parsed_dir_permissions.append((parsed_path, permissions))
+        parsed_dir_paths.add(parsed_path)
+        continue
+
+      parsed_dir_path = dirname(parsed_path)
+      if not parsed_dir_path in parsed_dir_paths:
+        makedirs(parsed_dir_path, exist_ok=True)
+        parsed_dir_paths.add(parsed_dir_path)
+
+      # Entries can only be read until the next one is decoded, files are rendered from their content
+      yield (fd.read(), parsed_path, permissions, is_ignored or raw_file_matcher.match(relative_path))
+
+  weight = lambda archive_file: len(archive_file[0])
+
+  if backend == "process":
+    render_results = [render_result for _, render_result in schedule_batches(_render_archive_file_batch, _archive_files(), _init_archive_file_worker, (renderer,), jobs, weight=weight, lookahead=1)]
+  else:
+    render_results = [render_result for _, render_result in schedule(lambda archive_file: _render_archive_file(*archive_file, renderer), _archive_files(), jobs, weight=weight, lookahead=1)]
+
+  # Directories may be read only, their permissions are applied once their content is written, deepest first
+  for parsed_dir_path, permissions in sorted(parsed_dir_permissions, key=lambda parsed_dir: parsed_dir[0].count("/"), reverse=True):
+    chmod(parsed_dir_path, permissions)
+
+  return all(render_results)
@@ -1,31 +1,231 @@
-from os import name as os_name
-from subprocess import Popen, PIPE
-from threading import Thread
+from asyncio import AbstractEventLoop, StreamReader, create_subprocess_shell, gather, get_running_loop, run, wait_for
+from asyncio.subprocess import PIPE, Process
+from codecs import getincrementaldecoder
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from os import name as os_name, devnull
+from subprocess import list2cmdline
+from threading import Lock
 from shlex import split
-from typing import IO, Dict, Any
+from signal import SIGTERM
+from typing import IO, List, Dict, Callable, Union
 
-from .template import inject_variable
-from ..utils.config import MimicHookConfig, MimicVariable
+if os_name != "nt":
+  from os import killpg
+
+from ..utils.config import MimicHookConfig
+from ..utils.hook_cache import get_hook_cache_key, normalize_hook_output_path, restore_hook_outputs, save_hook_outputs
+from ..utils.render import MimicRenderer
 from ..utils.input import get_user_confirmation
 
-def _hook_print_command_stream(cp : Popen[str], stream : IO[str]) -> None :
-  for x in iter(stream.readline, ''):
-    if cp.poll() is not None:
-      break
-    print(x, end="")
-
-def hook_action(mimic_template_dir : str, hook_config : MimicHookConfig, variables : Dict[str, MimicVariable], variables_values: Dict[str, Any], unsafe_mode : bool = False) -> bool :
-  for command in hook_config.steps:
-    parsed_command = inject_variable(command, variables, variables_values)
-    if unsafe_mode or get_user_confirmation(f"{mimic_template_dir}: `{parsed_command}` will be executed. Continue Y/n ?").upper() == "Y":
-      command_cp = Popen(parsed_command if os_name != "nt" else split(parsed_command), cwd=mimic_template_dir, text=True, shell=True, stdout=PIPE, stderr=PIPE);
-      stream_threads = [Thread(target=_hook_print_command_stream, args=(command_cp, command_cp.stdout)), Thread(target=_hook_print_command_stream, args=(command_cp, command_cp.stderr))]
-      for t in stream_threads:
-        t.start()
-      for t in stream_threads:
-        t.join()
-      if command_cp.wait() != 0:
-        return False
+# Lines of a step output kept in memory and printed once the step is done, the whole output is written to the hook log file
+hook_output_tail_lines = 20
+hook_output_line_max_length = 1 << 12
+
+# Hooks may run concurrently, their confirmation prompts are asked one at a time
+_confirmation_lock = Lock()
+
+# Commands currently run by hooks, along with the event loop running them, so that they can be cancelled from any thread
+_running_commands : Dict[Process, AbstractEventLoop] = {}
+_running_commands_lock = Lock()
+
+class _CommandOutputTail:
+  lines : deque
+  line_count : int
+
+  def __init__(self, max_lines : int):
+    self.lines = deque(maxlen=max_lines)
+    self.line_count = 0
+
+  def extend(self, lines : List[str]) -> None :
+    self.lines.extend(line[:hook_output_line_max_length] for line in lines)
+    self.line_count += len(lines)
+
+def _confirm_command(mimic_template_dir : str, parsed_command : str) -> bool :
+  with _confirmation_lock:
+    return get_user_confirmation(f"{mimic_template_dir}: `{parsed_command}` will be executed. Continue Y/n ?").upper() == "Y"
+
+def _terminate_command(process : Process) -> None :
+  # Commands run in their own process group (except on Windows) so that the processes they spawned are terminated too
+  try:
+    if os_name != "nt":
+      killpg(process.pid, SIGTERM)
+    else:
+      process.terminate()
+  except ProcessLookupError:
+    pass
+
+def cancel_hook_commands() -> None :
+  """
+  Terminates every command currently run by a hook, their hook then fails.
+  """
+
+  with _running_commands_lock:
+    for process, loop in _running_commands.items():
+      loop.call_soon_threadsafe(_terminate_command, process)
+
+async def _pipe_command_stream(stream : StreamReader, log_fd : IO[str], output_tail : _CommandOutputTail) -> None :
+  decoder = getincrementaldecoder("utf-8")(errors="replace")
+  pending_line = ""
+
+  while chunk := await stream.read(1 << 16):
+    text = decoder.decode(chunk)
+    log_fd.write(text)
+    *lines, pending_line = (pending_line + text).split("\n")
+    output_tail.extend(lines)
+    pending_line = pending_line[-hook_output_line_max_length:]
+
+  if pending_line:
+    output_tail.extend([pending_line])
+
+async def _run_command(parsed_command : str, cwd : str, timeout : Union[float, None], log_fd : IO[str], output_tail : _CommandOutputTail) -> Union[int, None] :
+  """
+  Runs a command while multiplexing its stdout and stderr to log_fd and output_tail.
+  Returns its exit code, or None when it was terminated after timeout seconds.
+  """
+
+  process = await create_subprocess_shell(parsed_command if os_name != "nt" else list2cmdline(split(parsed_command)), cwd=cwd, stdout=PIPE, stderr=PIPE, start_new_session=os_name != "nt")
+  with _running_commands_lock:
+    _running_commands[process] = get_running_loop()
+
+  try:
+    await wait_for(gather(_pipe_command_stream(process.stdout, log_fd, output_tail), _pipe_command_stream(process.stderr, log_fd, output_tail), process.wait()), timeout)
+    return process.returncode
+  except TimeoutError:
+    _terminate_command(process)
+    await process.wait()
+    return None
+  finally:
+    with _running_commands_lock:
+      _running_commands.pop(process, None)
+
+def _print_command_output_tail(output_tail : _CommandOutputTail, output_prefix : str, log_file_path : Union[str, None]) -> None :
+  hidden_line_count = output_tail.line_count - len(output_tail.lines)
+  if 0 < hidden_line_count:
+    print(f"{output_prefix}... {hidden_line_count} line(s) hidden{f', see {log_file_path}' if log_file_path else ''}")
+  for line in output_tail.lines:
+    print(f"{output_prefix}{line}")
+
+def hook_action(mimic_template_dir : str, hook_config : MimicHookConfig, renderer : MimicRenderer, unsafe_mode : bool = False, output_prefix : str = "", log_file_path : Union[str, None] = None, hooks_cache_dir : Union[str, None] = None) -> bool :
+  cache_key = None
+  if hook_config.cache != None and hooks_cache_dir != None:
+    cache_output_paths = [normalize_hook_output_path(renderer.render(output_path)) for output_path in hook_config.cache.outputs]
+    # Cached outputs are removed before being restored, only outputs inside the mimic can be cached
+    if None in cache_output_paths:
+      print(f"{output_prefix}outputs must be paths inside the mimic, the hook is not cached")
     else:
-      raise Exception("user cancellation")
+      cache_key = get_hook_cache_key(mimic_template_dir, [renderer.render(command) for command in hook_config.steps], [renderer.render(input_pattern) for input_pattern in hook_config.cache.inputs], cache_output_paths)
+    if cache_key != None and restore_hook_outputs(hooks_cache_dir, cache_key, mimic_template_dir):
+      print(f"{output_prefix}{len(cache_output_paths)} output(s) restored from cache")
+      return True
+
+  with open(log_file_path or devnull, "a") as log_fd:
+    for command in hook_config.steps:
+      parsed_command = renderer.render(command)
+      if unsafe_mode or _confirm_command(mimic_template_dir, parsed_command):
+        log_fd.write(f"$ {parsed_command}\n")
+        output_tail = _CommandOutputTail(hook_output_tail_lines)
+        returncode = run(_run_command(parsed_command, mimic_template_dir, hook_config.timeout, log_fd, output_tail))
+        _print_command_output_tail(output_tail, output_prefix, log_file_path)
+
+        if returncode == None:
+          print(f"{output_prefix}`{parsed_command}` timed out after {hook_config.timeout}s")
+          return False
+        if returncode != 0:
+          return False
+      else:
+        raise Exception("user cancellation")
+
+  if cache_key != None:
+    save_hook_outputs(hooks_cache_dir, cache_key, mimic_template_dir, cache_output_paths)
+
   return True
+
+def get_hooks_dependencies(hooks : List[MimicHookConfig]) -> List[List[int]] :
+  """
+  Returns, for every hook, the indexes of the hooks it waits for.
+  A hook waits for the hooks listed in its needs or, without needs and unless it is parallel, for every hook declared since the previous such sequential hook (itself included) that does not need a later hook.
+  Raises when needs reference an unknown hook or form a cycle.
+  """
+
+  hook_indexes : Dict[str, int] = {}
+  for i in range(len(hooks)):
+    if hooks[i].id == None:
+      continue
+    if hooks[i].id in hook_indexes:
+      raise Exception(f"hook id '{hooks[i].id}' is used by several hooks")
+    hook_indexes[hooks[i].id] = i
+
+  hooks_dependencies : List[List[int]] = []
+  # Parallel hooks and hooks with needs run alongside each other, the next sequential hook waits for all of them
+  previous_sequential_hook = 0
+  for i in range(len(hooks)):
+    h = hooks[i]
+    if len(h.needs):
+      for need in h.needs:
+        if not need in hook_indexes:
+          raise Exception(f"hook '{h.id or h.name or i}' needs unknown hook '{need}' (hooks can only need hooks triggered at the same time)")
+      hooks_dependencies.append(sorted(set(hook_indexes[need] for need in h.needs)))
+    elif not h.parallel:
+      # Hooks needing a later hook cannot be waited for, they would wait for this one in turn
+      hooks_dependencies.append([j for j in range(previous_sequential_hook, i) if all(hook_indexes.get(need, i) < i for need in hooks[j].needs)])
+      previous_sequential_hook = i
+    else:
+      hooks_dependencies.append([])
+
+  # Topological sort, hooks left unsorted are part of a cycle
+  waiting_counts = [len(hook_dependencies) for hook_dependencies in hooks_dependencies]
+  sorted_hooks = [i for i in range(len(hooks)) if waiting_counts[i] == 0]
+  for i in sorted_hooks:
+    for j in range(len(hooks)):
+      if i in hooks_dependencies[j]:
+        waiting_counts[j] -= 1
+        if waiting_counts[j] == 0:
+          sorted_hooks.append(j)
+
+  if len(sorted_hooks) != len(hooks):
+    cyclic_hooks = [hooks[i].id or hooks[i].name or str(i) for i in range(len(hooks)) if not i in sorted_hooks]
+    raise Exception(f"hooks needs form a cycle, these hooks would never run: {', '.join(cyclic_hooks)}")
+
+  return hooks_dependencies
+
+def run_hooks_graph(hooks : List[MimicHookConfig], run_hook : Callable[[int], bool], jobs : int) -> bool :
+  """
+  Runs run_hook(i) for every hook as soon as the hooks it waits for are done, with at most jobs hooks running at once.
+  Once run_hook returns False (a fatal failure), no more hook is started and the running ones are waited for.
+  """
+
+  hooks_dependencies = get_hooks_dependencies(hooks)
+  hooks_dependents : List[List[int]] = [[] for _ in hooks]
+  for i in range(len(hooks)):
+    for j in hooks_dependencies[i]:
+      hooks_dependents[j].append(i)
+
+  waiting_counts = [len(hook_dependencies) for hook_dependencies in hooks_dependencies]
+  ready_hooks = [i for i in range(len(hooks)) if waiting_counts[i] == 0]
+  running_hooks : Dict[Future, int] = {}
+  failed = False
+
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    try:
+      while len(running_hooks) or (len(ready_hooks) and not failed):
+        while len(ready_hooks) and not failed and len(running_hooks) < jobs:
+          i = ready_hooks.pop(0)
+          running_hooks[executor.submit(run_hook, i)] = i
+
+        done, _ = wait(running_hooks.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+          i = running_hooks.pop(future)
+          if not future.result():
+            failed = True
+            continue
+          for j in hooks_dependents[i]:
+            waiting_counts[j] -= 1
+            if waiting_counts[j] == 0:
+              ready_hooks.append(j)
+    except BaseException:
+      # Interrupted (eg SIGINT), running hooks must stop before the executor can be shut down
+      cancel_hook_commands()
+      raise
+
+  return not failed
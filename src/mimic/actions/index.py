@@ -0,0 +1,32 @@
+from typing import Iterator, Tuple, Union, Dict, Any
+
+from ..utils.config import MimicConfig, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.fs import ignore_scandir, get_relative_path, get_file_size
+from ..utils.scheduler import schedule
+from ..utils.template_index import MimicTemplateIndex, index_file
+
+def _index_file(source_file_path : str) -> Union[Dict[str, Any], None] :
+  try:
+    return index_file(source_file_path)
+  except Exception:
+    return None
+
+def index_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, jobs : Union[int, None] = None) -> MimicTemplateIndex :
+  """
+  Finds the placeholders of every path of a mimic template that is not ignored, see MimicTemplateIndex.
+  """
+
+  mimic_index = MimicTemplateIndex()
+
+  def _source_files() -> Iterator[Tuple[str, str]] :
+    for source_entry in ignore_scandir(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name, ".git"}):
+      relative_path = get_relative_path(source_entry.path, mimic_template_dir)
+      if source_entry.is_dir():
+        mimic_index.add_path(relative_path)
+      else:
+        yield (source_entry.path, relative_path)
+
+  for (_, relative_path), file_entry in schedule(lambda source_file: _index_file(source_file[0]), _source_files(), jobs, weight=lambda source_file: get_file_size(source_file[0])):
+    mimic_index.add_path(relative_path, file_entry)
+
+  return mimic_index
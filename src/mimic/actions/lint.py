@@ -1,21 +1,38 @@
-from os.path import basename, isdir, exists
-from re import finditer, sub
-from threading import Lock, Thread
+from array import array
+from os import stat, sep
+from os.path import basename, dirname, exists, join
+from re import compile, finditer, sub
 from shutil import move
-from typing import Set, List, Dict, Literal, Tuple
+from typing import Set, List, Dict, Literal, Tuple, Union, Iterator, Iterable, Any
 
 from .template import extract_variable_name_regex
-from ..utils.config import MimicConfig, MimicVariable, overwrite_mimic_config
-from ..utils.fs import ignore_glob
+from ..utils.config import MimicConfig, MimicVariable, overwrite_mimic_config, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.fs import ignore_scandir, get_relative_path, get_file_size, is_binary_file, is_relative_path_below, hash_file, AtomicFileWriter, GlobMatcher
+from ..utils.lint_cache import MimicLintCache, MimicLintCacheReference
+from ..utils.scheduler import schedule
+
+_variable_name_pattern = compile(extract_variable_name_regex)
 
 class MimicIssueReference:
+  __slots__ = ("name", "source_path", "line", "is_directory", "is_file", "spans")
 
-  def __init__(self, name: str, source_path: str, line : int = 0, is_directory : bool = False, is_file = False):
+  def __init__(self, name: str, source_path: str, line : int = 0, is_directory : bool = False, is_file = False, spans : Union[List[Tuple[int, int]], None] = None):
     self.name = name
     self.source_path = source_path
     self.line = line
     self.is_directory = is_directory
     self.is_file = is_file
+    # (start, end) offsets, in the file content, of each placeholder of the variable found on this line
+    self.spans = spans or []
+
+  def _key(self) -> Tuple[str, str, int, bool, bool] :
+    return (self.name, self.source_path, self.line, self.is_directory, self.is_file)
+
+  def __eq__(self, other : object) -> bool :
+    return isinstance(other, MimicIssueReference) and self._key() == other._key()
+
+  def __hash__(self) -> int :
+    return hash(self._key())
 
 class MimicUnfixableIssue:
 
@@ -23,138 +40,286 @@ class MimicUnfixableIssue:
     self.issue = issue
     self.reason = reason
 
+_occurrence_kind_content = 0
+_occurrence_kind_file = 1
+_occurrence_kind_directory = 2
+
+class _MimicPathOccurrences:
+  __slots__ = ("source_path", "name_ids", "lines", "kinds", "starts", "ends")
+
+  def __init__(self, source_path : str):
+    self.source_path = source_path
+    self.name_ids = array("I")
+    self.lines = array("I")
+    self.kinds = array("B")
+    self.starts = array("I")
+    self.ends = array("I")
+
+class MimicOccurrenceIndex:
+  """
+  Columnar store of the placeholders found in a mimic template, one row per placeholder (or per variable in a file or directory name).
+  Variable names are interned, rows are stored in arrays per path and the number of rows of each variable is kept up to date,
+  so that whether a variable is referenced is known without going through the rows.
+  """
+
+  def __init__(self):
+    self.names : List[str] = []
+    self.name_ids : Dict[str, int] = {}
+    self.name_counts = array("I")
+    self.paths : Dict[str, _MimicPathOccurrences] = {}
+
+  def _intern_name(self, name : str) -> int :
+    name_id = self.name_ids.get(name)
+    if name_id == None:
+      name_id = len(self.names)
+      self.names.append(name)
+      self.name_ids[name] = name_id
+      self.name_counts.append(0)
+    return name_id
+
+  def set_path_occurrences(self, relative_path : str, source_path : str, references : Iterable[MimicLintCacheReference], is_directory : bool = False) -> None :
+    """
+    Replaces the rows of a path by references, as found by the lint scan.
+    """
+
+    self.discard_path(relative_path)
+
+    path_occurrences = _MimicPathOccurrences(source_path)
+    for name, line, is_file, spans in references:
+      name_id = self._intern_name(name)
+      kind = _occurrence_kind_directory if is_directory else _occurrence_kind_file if is_file else _occurrence_kind_content
+      for start, end in spans or [(0, 0)]:
+        path_occurrences.name_ids.append(name_id)
+        path_occurrences.lines.append(line)
+        path_occurrences.kinds.append(kind)
+        path_occurrences.starts.append(start)
+        path_occurrences.ends.append(end)
+        self.name_counts[name_id] += 1
+
+    if len(path_occurrences.name_ids):
+      self.paths[relative_path] = path_occurrences
+
+  def discard_path(self, relative_path : str) -> None :
+    path_occurrences = self.paths.pop(relative_path, None)
+    if path_occurrences != None:
+      for name_id in path_occurrences.name_ids:
+        self.name_counts[name_id] -= 1
+
+  def discard_paths_below(self, relative_paths : Iterable[str]) -> None :
+    relative_paths = list(relative_paths)
+    for relative_path in [p for p in self.paths.keys() if is_relative_path_below(p, relative_paths)]:
+      self.discard_path(relative_path)
+
+  def reference_count(self, name : str) -> int :
+    name_id = self.name_ids.get(name)
+    return 0 if name_id == None else self.name_counts[name_id]
+
+  def referenced_names(self) -> List[str] :
+    return [self.names[name_id] for name_id in range(len(self.names)) if 0 < self.name_counts[name_id]]
+
+  def get_references(self, names : Iterable[str]) -> List[MimicIssueReference] :
+    """
+    Builds a reference for each line, file name or directory name where one of names is used.
+    """
+
+    name_ids = {self.name_ids[name] for name in names if name in self.name_ids}
+    references : List[MimicIssueReference] = []
+
+    for path_occurrences in self.paths.values():
+      path_references : Dict[Tuple[int, int, int], MimicIssueReference] = {}
+      for i in range(len(path_occurrences.name_ids)):
+        name_id = path_occurrences.name_ids[i]
+        if not name_id in name_ids:
+          continue
+
+        kind = path_occurrences.kinds[i]
+        reference_key = (name_id, path_occurrences.lines[i], kind)
+        reference = path_references.get(reference_key)
+        if reference == None:
+          reference = MimicIssueReference(self.names[name_id], path_occurrences.source_path, path_occurrences.lines[i], is_directory=kind == _occurrence_kind_directory, is_file=kind == _occurrence_kind_file)
+          path_references[reference_key] = reference
+        if kind == _occurrence_kind_content:
+          reference.spans.append((path_occurrences.starts[i], path_occurrences.ends[i]))
+      references.extend(path_references.values())
+
+    return references
+
 def _get_variables_from(template : str) -> Set[str] :
   return {match.group("variable_name") for match in finditer(extract_variable_name_regex, template)}
 
-def _get_variables_from_file(source_file_path : str, variables : Set[MimicIssueReference], variables_lock : Lock) -> None :
+def _get_variables_from_file(source_file_path : str, is_raw_file : bool = False) -> List[MimicLintCacheReference] :
+  source_variables : List[MimicLintCacheReference] = []
   try:
-    source_variables : Set[MimicIssueReference] = set()
-    with open(source_file_path, "r") as fd:
-      lineno = 1
-      for line in fd:
-        striped_line = line.strip()
-        for v in _get_variables_from(striped_line):
-          source_variables.add(MimicIssueReference(v, source_file_path, lineno))
-        lineno += 1
+    if not is_raw_file and not is_binary_file(source_file_path):
+      # Newlines are kept as is so that spans are offsets in the file content
+      with open(source_file_path, "r", newline="") as fd:
+        lineno = 1
+        line_offset = 0
+        for line in fd:
+          line_spans : Dict[str, List[Tuple[int, int]]] = {}
+          for match in _variable_name_pattern.finditer(line):
+            line_spans.setdefault(match.group("variable_name"), []).append((line_offset + match.start(), line_offset + match.end()))
+          for v, spans in line_spans.items():
+            source_variables.append((v, lineno, False, spans))
+          lineno += 1
+          line_offset += len(line)
       
     for v in _get_variables_from(basename(source_file_path)):
-      source_variables.add(MimicIssueReference(v, source_file_path, is_file=True))
-    
-    with variables_lock:
-      for v in source_variables:
-        variables.add(v)
+      source_variables.append((v, 0, True, []))
   except Exception:
     pass
 
-def get_issues_from_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig) -> Tuple[List[MimicIssueReference], List[str]]:
-  variables : Set[MimicIssueReference] = set()
-  variables_lock = Lock()
-  get_variables_threads = []
+  return source_variables
 
-  for source_path in ignore_glob(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True):
-    if isdir(source_path):
-      for v in _get_variables_from(source_path):
-        variables.add(MimicIssueReference(v, source_path, is_directory=True))
-    else:
-      source_file_get_variables_thread = Thread(
-        target=_get_variables_from_file, args=(source_path, variables, variables_lock)
-      )
-      get_variables_threads.append(source_file_get_variables_thread)
-      source_file_get_variables_thread.start()
-
-  for t in get_variables_threads:
-    t.join()
-  
-  reference_table = {k : [] for k in mimic_config.template.variables.keys()}
+def _get_cached_variables_from_file(source_file_path : str, relative_path : str, is_raw_file : bool, lint_cache : Union[MimicLintCache, None]) -> Tuple[List[MimicLintCacheReference], Union[Dict[str, Any], None]] :
+  """
+  Returns the variables of a file, from lint_cache when the file did not change, along with its up to date cache entry.
+  """
+
+  if lint_cache == None:
+    return (_get_variables_from_file(source_file_path, is_raw_file), None)
+
+  try:
+    file_stat = stat(source_file_path)
+    cache_entry = lint_cache.lookup(relative_path, source_file_path, file_stat, is_raw_file)
+
+    if cache_entry != None:
+      return (cache_entry["references"], cache_entry)
+
+    file_hash = hash_file(source_file_path)
+    source_variables = _get_variables_from_file(source_file_path, is_raw_file)
+    return (source_variables, MimicLintCache.new_entry(file_stat, file_hash, is_raw_file, source_variables))
+  except OSError:
+    return (_get_variables_from_file(source_file_path, is_raw_file), None)
+
+def get_occurrences_from_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, jobs : Union[int, None] = None, use_cache : bool = True, relative_paths : Union[Iterable[str], None] = None, occurrence_index : Union[MimicOccurrenceIndex, None] = None) -> MimicOccurrenceIndex :
+  """
+  Returns the placeholders found in every path of a mimic template.
+  When relative_paths is given, only these paths and the content of directories among them are scanned again,
+  and occurrence_index (the result of a previous scan) is updated in place.
+  """
+
+  if occurrence_index == None:
+    occurrence_index = MimicOccurrenceIndex()
+  if relative_paths != None:
+    relative_paths = list(relative_paths)
+    occurrence_index.discard_paths_below(relative_paths)
+
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  # Files are only scanned again when they changed since the previous lint
+  lint_cache = MimicLintCache(mimic_template_dir) if use_cache else None
+
+  def _source_files() -> Iterator[Tuple[str, str, bool]] :
+    for source_entry in ignore_scandir(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name}, relative_paths=relative_paths):
+      relative_path = get_relative_path(source_entry.path, mimic_template_dir)
+      if source_entry.is_dir():
+        occurrence_index.set_path_occurrences(relative_path, source_entry.path, [(v, 0, False, []) for v in _get_variables_from(source_entry.path)], is_directory=True)
+      else:
+        yield (source_entry.path, relative_path, raw_file_matcher.match(relative_path))
+
+  for source_file, (source_variables, cache_entry) in schedule(lambda source_file: _get_cached_variables_from_file(*source_file, lint_cache), _source_files(), jobs, weight=lambda source_file: get_file_size(source_file[0])):
+    occurrence_index.set_path_occurrences(source_file[1], source_file[0], source_variables)
+    if cache_entry != None:
+      lint_cache.record(source_file[1], cache_entry)
+
+  if lint_cache != None:
+    lint_cache.save(relative_paths)
+
+  return occurrence_index
+
+def get_issues_from_occurrences(mimic_config : MimicConfig, occurrence_index : MimicOccurrenceIndex) -> Tuple[List[MimicIssueReference], List[str]]:
+  undeclared_variables = occurrence_index.get_references([name for name in occurrence_index.referenced_names() if not name in mimic_config.template.variables])
 
-  undeclared_variables : List[MimicIssueReference]= []
-  for v in variables:
-    if v.name in reference_table:
-      reference_table[v.name].append(v)
-    else:
-      undeclared_variables.append(v)
-  
   unreferenced_variables : List[str] = []
-  for k in reference_table.keys():
-    if len(reference_table[k]) == 0:
+  for k in mimic_config.template.variables.keys():
+    if occurrence_index.reference_count(k) == 0:
       unreferenced_variables.append(k)
 
   return (undeclared_variables, unreferenced_variables)
 
+def get_issues_from_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, jobs : Union[int, None] = None, use_cache : bool = True) -> Tuple[List[MimicIssueReference], List[str]]:
+  return get_issues_from_occurrences(mimic_config, get_occurrences_from_mimic_template(mimic_template_dir, mimic_config, jobs, use_cache))
+
+def _escape_undefined_variable(variable_name : str, fix_strategy : Literal["escape", "clear"]) -> str:
+  if fix_strategy == "escape":
+    return f"{{{{{{{{ {variable_name} }}}}}}}}" # So much mustaches
+  return ""
+
 def _escape_undefined_variables(template: str, variables : Dict[str, MimicVariable], fix_strategy : Literal["escape", "clear"]) -> str:
   def _escape_if_undefined(match):
     variable_name = match.group("variable_name")
 
     if variables.get(variable_name, None) != None:
-      return f"{{{{ {variable_name} }}}}"
-    
-    if fix_strategy == "escape":
-      return f"{{{{{{{{ {variable_name} }}}}}}}}" # So much mustaches
-    elif fix_strategy == "clear":
-      return ""
-    else:
-      return ""
+      return match.group(0)
+
+    return _escape_undefined_variable(variable_name, fix_strategy)
 
   return sub(extract_variable_name_regex, _escape_if_undefined, template)
 
-def _fix_issue_in_file(issue_file_path : str, variables : Dict[str, MimicVariable], fix_strategy : Literal["escape", "clear"]) -> None :
+def _fix_issues_in_file(issue_file_path : str, issues : List[MimicIssueReference], fix_strategy : Literal["escape", "clear"]) -> List[MimicUnfixableIssue] :
+  """
+  Replaces the placeholders of undefined variables at the spans found by the lint scan, the file is only written when it changes.
+  Nothing is written when a placeholder is no longer at its span, ie the file changed since it was scanned.
+  """
+
   try:
-    with open(issue_file_path, "r") as fd:
-      fixed_file_content = _escape_undefined_variables("".join(fd.readlines()), variables, fix_strategy)
-    
-    with open(issue_file_path, "w") as fd:
-      fd.write(fixed_file_content)
-  except:
-    pass
+    with open(issue_file_path, "r", newline="") as fd:
+      file_content = fd.read()
+
+    edits = sorted((start, end, issue.name) for issue in issues for start, end in issue.spans)
+    fixed_file_content_parts : List[str] = []
+    previous_end = 0
+    for start, end, variable_name in edits:
+      match = _variable_name_pattern.match(file_content, start)
+      if match == None or match.end() != end or match.group("variable_name") != variable_name:
+        return [MimicUnfixableIssue(issue, f"file changed since it was linted, run mimic lint again") for issue in issues]
+      fixed_file_content_parts.append(file_content[previous_end:start])
+      fixed_file_content_parts.append(_escape_undefined_variable(variable_name, fix_strategy))
+      previous_end = end
+    fixed_file_content_parts.append(file_content[previous_end:])
+
+    fixed_file_content = "".join(fixed_file_content_parts)
+    if fixed_file_content != file_content:
+      with AtomicFileWriter(issue_file_path, newline="") as fd:
+        fd.write(fixed_file_content)
+    return []
+  except Exception as e:
+    return [MimicUnfixableIssue(issue, f"could not fix file: {e}") for issue in issues]
 
-def fix_issues_in_mimic_template(undeclared_variables : List[MimicIssueReference], unreferenced_variables : List[str], mimic_config_file_path : str, mimic_config : MimicConfig, fix_strategy : Literal["escape", "clear"]) -> List[MimicUnfixableIssue]:
-  directory_issues : List[MimicIssueReference] = []
-  file_name_issues : List[MimicIssueReference] = []
-  content_issue_file_paths : Set[str] = set()
+def fix_issues_in_mimic_template(undeclared_variables : List[MimicIssueReference], unreferenced_variables : List[str], mimic_config_file_path : str, mimic_config : MimicConfig, fix_strategy : Literal["escape", "clear"], jobs : Union[int, None] = None) -> List[MimicUnfixableIssue]:
+  """
+  Fixes the issues found by get_issues_from_mimic_template in a single pass: file contents are fixed first, at the spans found by the scan,
+  then files and directories are renamed, deepest first so that no path is renamed before the paths it contains.
+  """
+
+  rename_issues : Dict[str, List[MimicIssueReference]] = {}
+  content_issues : Dict[str, List[MimicIssueReference]] = {}
   
   while 0 < len(undeclared_variables):
     issue = undeclared_variables.pop()
-    if issue.is_directory:
-      directory_issues.append(issue)
-    if issue.is_file:
-      file_name_issues.append(issue)
+    if issue.is_directory or issue.is_file:
+      rename_issues.setdefault(issue.source_path, []).append(issue)
     else:
-      content_issue_file_paths.add(issue.source_path)
-
-  file_content_fix_issue_threads : List[Thread] = []
-
-  for issue_file_path in content_issue_file_paths:
-    fix_issue_thread = Thread(
-      target=_fix_issue_in_file,
-      args=(issue_file_path, mimic_config.template.variables, fix_strategy)
-    )
-    file_content_fix_issue_threads.append(fix_issue_thread)
-    fix_issue_thread.start()
-
-  for t in file_content_fix_issue_threads:
-    t.join()
+      content_issues.setdefault(issue.source_path, []).append(issue)
 
   unfixable_issues : List[MimicUnfixableIssue] = []
 
-  for issue in directory_issues:
-    source_dir_path = issue.source_path
-    fixed_dir_path = _escape_undefined_variables(source_dir_path, mimic_config.template.variables, fix_strategy)
-    if exists(fixed_dir_path):
-      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed dir path {fixed_dir_path} already exist"))
-    elif len(fixed_dir_path.strip()) == 0:
-      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed dir path contains empty dir name"))
-    else:
-      move(source_dir_path, fixed_dir_path)
-  
-  for issue in file_name_issues:
-    source_file_path = issue.source_path
-    fixed_file_path = _escape_undefined_variables(source_file_path, mimic_config.template.variables, fix_strategy)
-    if exists(fixed_file_path):
-      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed file path {fixed_file_path} already exist"))
-    elif len(fixed_file_path.strip()) == 0:
-      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed file path contains empty file name"))
+  for _, file_unfixable_issues in schedule(lambda issue_file_path: _fix_issues_in_file(issue_file_path, content_issues[issue_file_path], fix_strategy), content_issues.keys(), jobs, weight=get_file_size):
+    unfixable_issues.extend(file_unfixable_issues)
+
+  for source_path in sorted(rename_issues.keys(), key=lambda p: p.count(sep), reverse=True):
+    issue = rename_issues[source_path][0]
+    fixed_name = _escape_undefined_variables(basename(source_path), mimic_config.template.variables, fix_strategy)
+    fixed_path = join(dirname(source_path), fixed_name)
+    path_kind = "dir" if issue.is_directory else "file"
+    if fixed_path == source_path:
+      continue
+    elif len(fixed_name.strip()) == 0:
+      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed {path_kind} path contains empty {path_kind} name"))
+    elif exists(fixed_path):
+      unfixable_issues.append(MimicUnfixableIssue(issue, f"fixed {path_kind} path {fixed_path} already exist"))
     else:
-      move(source_file_path, fixed_file_path)
+      move(source_path, fixed_path)
 
   mimic_config_issue_count = len(unreferenced_variables)
   for variable_name in unreferenced_variables:
@@ -0,0 +1,128 @@
+from hashlib import sha256
+from io import BytesIO, TextIOWrapper
+from os import makedirs, chmod
+from os.path import join, basename
+from stat import S_IMODE
+from typing import Dict, Any, List, Tuple, Union, Iterator
+
+from .template import MimicRenderBackend
+from ..utils.config import MimicConfig, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.fs import scandir_tree, get_file_size, GlobMatcher
+from ..utils.pack import MimicPack, MimicPackWriter, compress_blob
+from ..utils.render import MimicRenderer
+from ..utils.scheduler import schedule, schedule_batches
+from ..utils.template_index import index_content, splice_content
+
+# Set once per worker process by the process backend
+_worker_mimic_pack : Union[MimicPack, None] = None
+_worker_renderer : Union[MimicRenderer, None] = None
+
+def _read_pack_file(source_file_path : str, is_ignored : bool, compression : str, mimic_pack_writer : MimicPackWriter) -> Tuple[str, Union[bytes, None], int, str, Union[Dict[str, Any], None]] :
+  with open(source_file_path, "rb") as fd:
+    content = fd.read()
+
+  # Ignored files are copied as is, their placeholders are never needed
+  file_entry = index_content(content) if not is_ignored else None
+  content_hash = file_entry["hash"] if file_entry != None else sha256(content).hexdigest()
+  if mimic_pack_writer.has_blob(content_hash):
+    return (content_hash, None, len(content), compression, file_entry)
+
+  stored_content, stored_compression = compress_blob(content, compression)
+  return (content_hash, stored_content, len(content), stored_compression, file_entry)
+
+def pack_mimic_template(mimic_template_dir : str, mimic_config_file_path : str, mimic_config : MimicConfig, mimic_pack_file_path : str, compression : str = "zlib", jobs : Union[int, None] = None) -> Tuple[int, int] :
+  """
+  Packs mimic_template_dir into a single mimic pack file, see MimicPack. Returns the number of paths and distinct file contents packed.
+  Paths are packed like render_mimic_template renders them: ignored paths are kept as is, the .git folder, the mimic config file, the mimic cache folder and the template index are left out.
+  """
+
+  ignore_matcher = GlobMatcher(mimic_config.template.ignorePatterns)
+  excluded_relative_paths = {mimic_cache_dir_name, mimic_index_file_name, ".git", basename(mimic_config_file_path)}
+
+  with MimicPackWriter(mimic_pack_file_path, basename(mimic_config_file_path), mimic_config) as mimic_pack_writer:
+
+    def _source_paths() -> Iterator[Tuple[Any, str, bool]] :
+      for source_entry, relative_path, is_ignored in scandir_tree(ignore_matcher, mimic_template_dir, include_hidden=True, excluded_relative_paths=excluded_relative_paths):
+        yield (source_entry, relative_path, is_ignored)
+        # Directories whose whole content is ignored are not walked, they are packed along with all their content
+        if source_entry.is_dir() and ignore_matcher.match_tree(relative_path):
+          for ignored_entry, ignored_relative_path, _ in scandir_tree(GlobMatcher([]), mimic_template_dir, True, set(), [relative_path]):
+            if ignored_relative_path != relative_path:
+              yield (ignored_entry, ignored_relative_path, True)
+
+    def _source_files() -> Iterator[Tuple[str, str, int, bool]] :
+      for source_entry, relative_path, is_ignored in _source_paths():
+        permissions = S_IMODE(source_entry.stat().st_mode)
+        if source_entry.is_dir():
+          mimic_pack_writer.add_directory(relative_path, permissions, is_ignored)
+        else:
+          yield (source_entry.path, relative_path, permissions, is_ignored)
+
+    for (_, relative_path, permissions, is_ignored), packed_file in schedule(lambda source_file: _read_pack_file(source_file[0], source_file[3], compression, mimic_pack_writer), _source_files(), jobs, weight=lambda source_file: get_file_size(source_file[0])):
+      mimic_pack_writer.add_file(relative_path, permissions, is_ignored, *packed_file)
+
+  return (len(mimic_pack_writer.paths), len(mimic_pack_writer.blobs))
+
+def _render_pack_file(mimic_pack : MimicPack, blob_id : int, parsed_file_path : str, permissions : int, is_raw_file : bool, file_entry : Union[Dict[str, Any], None], renderer : MimicRenderer) -> bool :
+  try:
+    content = mimic_pack.read_blob(blob_id)
+
+    if not is_raw_file and file_entry == None:
+      # Contents that could not be indexed (see index_content) are rendered like template files
+      with TextIOWrapper(BytesIO(content)) as source_fd, open(parsed_file_path, "w") as parsed_fd:
+        renderer.render_stream(source_fd, parsed_fd)
+    else:
+      with open(parsed_file_path, "wb") as parsed_fd:
+        parsed_fd.write(content if is_raw_file or not len(file_entry["placeholders"]) else splice_content(content, file_entry["placeholders"], renderer))
+    chmod(parsed_file_path, permissions)
+
+    return True
+  except Exception:
+    return False
+
+def _init_pack_file_worker(mimic_pack_file_path : str, renderer : MimicRenderer) -> None :
+  global _worker_mimic_pack, _worker_renderer
+  _worker_mimic_pack = MimicPack(mimic_pack_file_path)
+  _worker_renderer = renderer
+
+def _render_pack_file_batch(pack_files : List[Tuple[int, str, int, bool, Union[Dict[str, Any], None]]]) -> List[bool] :
+  return [_render_pack_file(_worker_mimic_pack, *pack_file, _worker_renderer) for pack_file in pack_files]
+
+def render_mimic_pack(mimic_pack : MimicPack, out_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], jobs : Union[int, None] = None, backend : MimicRenderBackend = "thread") -> bool :
+  """
+  Renders a mimic pack straight into out_dir, like render_mimic_template renders a mimic template.
+  Directories are created first, then files are rendered in the order their contents are stored so that the pack is read sequentially.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  parsed_dir_paths : Dict[str, str] = {"": out_dir}
+  parsed_dir_permissions : List[Tuple[str, int]] = []
+  pack_files : List[Tuple[int, str, int, bool, Union[Dict[str, Any], None]]] = []
+
+  makedirs(out_dir, exist_ok=True)
+
+  for relative_path, is_directory, permissions, blob_id, is_ignored in mimic_pack.paths:
+    relative_dir_path, _, source_name = relative_path.rpartition("/")
+    parsed_path = join(parsed_dir_paths[relative_dir_path], source_name if is_ignored else mimic_pack.mimic_index.render_name(relative_path, source_name, renderer))
+
+    if is_directory:
+      makedirs(parsed_path, exist_ok=True)
+      parsed_dir_permissions.append((parsed_path, permissions))
+      parsed_dir_paths[relative_path] = parsed_path
+    else:
+      pack_files.append((blob_id, parsed_path, permissions, is_ignored or raw_file_matcher.match(relative_path), mimic_pack.mimic_index.get_file_entry(relative_path)))
+
+  pack_files.sort(key=lambda pack_file: mimic_pack.blob_offset(pack_file[0]))
+  weight = lambda pack_file: mimic_pack.blob_length(pack_file[0])
+
+  if backend == "process":
+    render_results = [render_result for _, render_result in schedule_batches(_render_pack_file_batch, pack_files, _init_pack_file_worker, (mimic_pack.file_path, renderer), jobs, weight=weight, lookahead=1)]
+  else:
+    render_results = [render_result for _, render_result in schedule(lambda pack_file: _render_pack_file(mimic_pack, *pack_file, renderer), pack_files, jobs, weight=weight, lookahead=1)]
+
+  # Directories may be read only, their permissions are applied once their content is written, deepest first
+  for parsed_dir_path, permissions in reversed(parsed_dir_permissions):
+    chmod(parsed_dir_path, permissions)
+
+  return all(render_results)
@@ -1,55 +1,149 @@
-from os.path import isdir
-from threading import Lock, Thread
-from typing import Dict, List, Any
+from hashlib import sha256
+from typing import Dict, List, Any, Tuple, Union, Iterator, Iterable
 
-from .template import inject_variable
-from ..utils.fs import ignore_glob
-from ..utils.config import MimicPreview, MimicFileContentPreview, MimicVariable, MimicConfig
+from ..utils.fs import ignore_scandir, get_relative_path, get_file_size, is_binary_file, is_relative_path_below, GlobMatcher
+from ..utils.config import MimicPreview, MimicPathPreview, MimicFileContentPreview, MimicConfig, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.render import MimicRenderer
+from ..utils.scheduler import schedule
+from ..utils.template_index import MimicTemplateIndex, splice_content
+
+def _preview_indexed_file(source_file_path : str, file_entry : Dict[str, Any], renderer : MimicRenderer, max_changes : Union[int, None]) -> Union[Tuple[List[MimicFileContentPreview], int], None] :
+  """
+  Same as _preview_file, from the placeholders offsets of the file index entry. Returns None when the file changed since it was indexed.
+  """
+
+  changes : List[MimicFileContentPreview] = []
+  hidden_change_count = 0
+  digest = sha256()
+  placeholders = file_entry["placeholders"]
+  placeholder_index = 0
+
+  with open(source_file_path, "rb") as fd:
+    line_offset = 0
+    for lineno, line in enumerate(fd, 1):
+      digest.update(line)
+      line_end = line_offset + len(line)
+
+      line_placeholders = []
+      while placeholder_index < len(placeholders) and placeholders[placeholder_index][0] < line_end:
+        # Lines are rendered one at a time, placeholders spanning several lines are left as is
+        if placeholders[placeholder_index][1] <= line_end:
+          line_placeholders.append(placeholders[placeholder_index])
+        placeholder_index += 1
+
+      if len(line_placeholders):
+        raw_line = line.removesuffix(b"\n")
+        parsed_line = splice_content(raw_line, line_placeholders, renderer, line_offset)
+        if raw_line != parsed_line:
+          if max_changes == None or len(changes) < max_changes:
+            changes.append(MimicFileContentPreview(raw_line.decode(), parsed_line.decode(), lineno, line.endswith(b"\n")))
+          else:
+            hidden_change_count += 1
+
+      line_offset = line_end
+
+  if digest.hexdigest() != file_entry["hash"]:
+    return None
+  return (changes, hidden_change_count)
+
+def _preview_file(source_file_path : str, renderer : MimicRenderer, is_raw_file : bool = False, max_changes : Union[int, None] = None, file_entry : Union[Dict[str, Any], None] = None) -> Union[Tuple[List[MimicFileContentPreview], int], None] :
+  """
+  Returns the lines of a file that rendering changes, up to max_changes of them, along with the number of changed lines left out.
+  """
 
-def _preview_file(source_file_path : str, variables : Dict[str, MimicVariable], variables_values : Dict[str, Any], mimic_template_preview : MimicPreview, mimic_template_preview_lock : Lock):
   try:
     changes : List[MimicFileContentPreview] = []
-    with open(source_file_path, "r") as fd:
+    hidden_change_count = 0
+    if is_raw_file or is_binary_file(source_file_path):
+      return (changes, hidden_change_count)
+
+    if file_entry != None and (file_preview := _preview_indexed_file(source_file_path, file_entry, renderer, max_changes)) != None:
+      return file_preview
+
+    # Newlines are kept as is so that carriage returns remain part of the raw and parsed lines (see --format diff)
+    with open(source_file_path, "r", newline="") as fd:
       lineno = 1
       for line in fd:
-        striped_line = line.strip()
-        parsed_line = inject_variable(striped_line, variables, variables_values).strip()
-        if striped_line != parsed_line:
-          changes.append(MimicFileContentPreview(striped_line, parsed_line, lineno))
+        raw_line = line.removesuffix("\n")
+        parsed_line = renderer.render(raw_line)
+        if raw_line != parsed_line:
+          if max_changes == None or len(changes) < max_changes:
+            changes.append(MimicFileContentPreview(raw_line, parsed_line, lineno, line.endswith("\n")))
+          else:
+            hidden_change_count += 1
         lineno += 1
-  
-    parsed_file_path = inject_variable(source_file_path, variables, variables_values)
 
-    with mimic_template_preview_lock:
-      mimic_template_preview.file_content_preview[source_file_path] = changes
-      if source_file_path != parsed_file_path:
-        mimic_template_preview.file_preview[source_file_path] = parsed_file_path
+    return (changes, hidden_change_count)
   except:
-    pass
+    return None
+
+def _preview_path(source_path : str, relative_path : str, is_directory : bool, renderer : MimicRenderer, is_raw_file : bool, max_changes : Union[int, None], file_entry : Union[Dict[str, Any], None] = None) -> Union[MimicPathPreview, None] :
+  path_preview = MimicPathPreview(source_path, renderer.render(source_path), relative_path, renderer.render(relative_path), is_directory)
+  if is_directory:
+    return path_preview
+
+  file_preview = _preview_file(source_path, renderer, is_raw_file, max_changes, file_entry)
+  if file_preview is None:
+    return None
+  path_preview.changes, path_preview.hidden_change_count = file_preview
+  return path_preview
 
-def preview_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any]) -> MimicPreview:
+def iter_mimic_template_preview(mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], jobs : Union[int, None] = None, relative_paths : Union[Iterable[str], None] = None, max_changes : Union[int, None] = None) -> Iterator[MimicPathPreview] :
+  """
+  Lazily previews the paths of a mimic template, each path preview is yielded as soon as it is ready (not in walk order).
+  Every file is yielded, directories only when rendering renames them. At most max_changes changed lines are kept per file, the other ones are only counted.
+  When relative_paths is given, only these paths and the content of directories among them are previewed.
+  Content of files found in the template index (.mimic.index) is previewed from the offsets of their placeholders.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  mimic_index = MimicTemplateIndex.load(mimic_template_dir) or MimicTemplateIndex()
+
+  def _source_paths() -> Iterator[Tuple[str, str, bool]] :
+    for source_entry in ignore_scandir(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name}, relative_paths=relative_paths):
+      yield (source_entry.path, get_relative_path(source_entry.path, mimic_template_dir), source_entry.is_dir())
+
+  for _, path_preview in schedule(lambda source_path: _preview_path(*source_path, renderer, raw_file_matcher.match(source_path[1]), max_changes, mimic_index.get_file_entry(source_path[1])), _source_paths(), jobs, weight=lambda source_path: 0 if source_path[2] else get_file_size(source_path[0])):
+    if path_preview is None or (path_preview.is_directory and not path_preview.is_renamed()):
+      continue
+    yield path_preview
+
+def preview_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], jobs : Union[int, None] = None, relative_paths : Union[Iterable[str], None] = None) -> MimicPreview:
+  """
+  Previews the changes rendering a mimic template would make, and renders its hooks steps.
+  When relative_paths is given, only these paths and the content of directories among them are previewed, hooks are left untouched.
+  Every change is kept in memory, see iter_mimic_template_preview to stream them instead.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
   mimic_template_preview = MimicPreview()
-  mimic_template_preview_lock = Lock()
-  preview_file_threads = []
-
-  for source_path in ignore_glob(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True):
-    if isdir(source_path):
-      parsed_dir = inject_variable(source_path, mimic_config.template.variables, variables_values)
-      if source_path != parsed_dir:
-        mimic_template_preview.directory_preview[source_path] = parsed_dir
-    else:
-      source_file_preview_file_thread = Thread(
-        target=_preview_file, 
-        args=(source_path, mimic_config.template.variables, variables_values, mimic_template_preview, mimic_template_preview_lock)
-      )
-      preview_file_threads.append(source_file_preview_file_thread)
-      source_file_preview_file_thread.start()
-
-  for t in preview_file_threads:
-    t.join()
+
+  for path_preview in iter_mimic_template_preview(mimic_template_dir, mimic_config, variables_values, jobs, relative_paths):
+    if path_preview.is_directory:
+      mimic_template_preview.directory_preview[path_preview.source_path] = path_preview.parsed_path
+      continue
+    mimic_template_preview.file_content_preview[path_preview.source_path] = path_preview.changes
+    if path_preview.is_renamed():
+      mimic_template_preview.file_preview[path_preview.source_path] = path_preview.parsed_path
+
+  if relative_paths != None:
+    return mimic_template_preview
 
   for h in mimic_config.hooks:
     for i in range(len(h.steps)):
-      h.steps[i] = inject_variable(h.steps[i], mimic_config.template.variables, variables_values)
-  
-  return mimic_template_preview
\ No newline at end of file
+      h.steps[i] = renderer.render(h.steps[i])
+
+  return mimic_template_preview
+
+def update_mimic_template_path_previews(path_previews : Dict[str, MimicPathPreview], mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], relative_paths : Iterable[str], jobs : Union[int, None] = None, max_changes : Union[int, None] = None) -> None :
+  """
+  Previews again the paths of relative_paths (and their content), path_previews maps relative paths to the previews of a previous run.
+  """
+
+  relative_paths = list(relative_paths)
+  for relative_path in [p for p in path_previews.keys() if is_relative_path_below(p, relative_paths)]:
+    del path_previews[relative_path]
+
+  for path_preview in iter_mimic_template_preview(mimic_template_dir, mimic_config, variables_values, jobs, relative_paths, max_changes):
+    path_previews[path_preview.relative_path] = path_preview
@@ -1,81 +1,300 @@
-from re import sub
-from os.path import join, isdir, split
-from shutil import move
-from threading import Thread, Lock
-from typing import Dict, Any
+from io import BytesIO, TextIOWrapper
+from os import makedirs
+from os.path import join, split
+from shutil import move, copymode, copytree
+from stat import S_IMODE
+from tarfile import TarInfo, DIRTYPE, open as open_tar
+from time import time
+from typing import Dict, Any, List, Union, Literal, Tuple, Iterator, Iterable, Callable, IO
 
-from ..utils.fs import remove_ignore, ignore_glob
-from ..utils.config import MimicVariable, MimicConfig
+from ..utils.fs import remove_ignore, ignore_scandir, scandir_tree, get_relative_path, get_file_size, file_contains, is_binary_file, copy_file, hash_file, AtomicFileWriter, GlobMatcher
+from ..utils.config import MimicVariable, MimicConfig, mimic_cache_dir_name, mimic_index_file_name
+from ..utils.render import MimicRenderer, extract_variable_name_regex, extract_escaped_variable_name_regex
+from ..utils.template_index import MimicTemplateIndex, render_indexed_file
+from ..utils.scheduler import schedule, schedule_batches
 
-extract_variable_name_regex = r"(?<!\{\{)\{\{\s*(?P<variable_name>\w+)\s*\}\}(?!\}\})"
-extract_escaped_variable_name_regex = r"\{\{\{\{\s*(?P<variable_name>\w+)\s*\}\}\}\}"
+MimicRenderBackend = Literal["thread", "process"]
+
+# Set once per worker process by the process backend
+_worker_renderer : Union[MimicRenderer, None] = None
 
 def inject_variable(template: str, variables : Dict[str, MimicVariable], variables_values : Dict[str, Any]) -> str:
-  def _replace_variable(match):
-    variable_name = match.group("variable_name")
-
-    if corresponding_variable := variables.get(variable_name, None):
-      user_value = variables_values.get(variable_name, "")
-      return corresponding_variable.format_variable_value(user_value) if not user_value is None else ""
-    
-    return ""
-  
-  def _escape_variable(match):
-      variable_name = match.group("variable_name")
-      return "{{ " + variable_name + " }}"
-
-  template_with_replaced_variables = sub(extract_variable_name_regex, _replace_variable, template)
-  return sub(extract_escaped_variable_name_regex, _escape_variable, template_with_replaced_variables)
-
-def _inject_file(source_file_path : str, variables : Dict[str, MimicVariable], variables_values : Dict[str, Any], inject_file_results : Dict[str, bool], inject_file_results_lock : Lock) -> None :
-  try:
-    with open(source_file_path, "r") as fd:
-      parsed_file_content = inject_variable("".join(fd.readlines()), variables, variables_values)
+  return MimicRenderer(variables, variables_values).render(template)
 
-    source_dir_path, source_file_name = split(source_file_path)
-    parsed_file_path = join(source_dir_path, inject_variable(source_file_name, variables, variables_values))
+def _inject_indexed_file(source_file_path : str, parsed_file_path : str, file_entry : Dict[str, Any], renderer : MimicRenderer) -> bool :
+  """
+  Injects a file from its index entry, returns False when the file changed since it was indexed.
+  """
 
-    with open(parsed_file_path, "w") as fd:
-      fd.write(parsed_file_content)
-    
+  if not len(file_entry["placeholders"]):
+    if hash_file(source_file_path) != file_entry["hash"]:
+      return False
     if source_file_path != parsed_file_path:
+      move(source_file_path, parsed_file_path)
+    return True
+
+  parsed_file_writer = AtomicFileWriter(parsed_file_path, mode_source_path=source_file_path, mode="wb")
+  with open(source_file_path, "rb") as source_fd, parsed_file_writer as parsed_fd:
+    if not render_indexed_file(source_fd, parsed_fd, file_entry, renderer):
+      parsed_file_writer.discard()
+
+  if parsed_file_writer.discarded:
+    return False
+  if source_file_path != parsed_file_path:
+    remove_ignore(source_file_path)
+  return True
+
+def _inject_file(source_file_path : str, parsed_file_name : str, is_raw_file : bool, file_entry : Union[Dict[str, Any], None], renderer : MimicRenderer) -> bool :
+  try:
+    parsed_file_path = join(split(source_file_path)[0], parsed_file_name)
+
+    if not is_raw_file and file_entry != None and _inject_indexed_file(source_file_path, parsed_file_path, file_entry, renderer):
+      return True
+
+    # Raw files and files without any placeholder keep their content, only their name is injected
+    if is_raw_file or is_binary_file(source_file_path) or not file_contains(source_file_path, b"{{"):
+      if source_file_path != parsed_file_path:
+        move(source_file_path, parsed_file_path)
+      return True
+
+    parsed_file_writer = AtomicFileWriter(parsed_file_path, mode_source_path=source_file_path)
+    with open(source_file_path, "r") as source_fd, parsed_file_writer as parsed_fd:
+      if renderer.render_stream(source_fd, parsed_fd) == 0:
+        parsed_file_writer.discard()
+
+    if parsed_file_writer.discarded:
+      if source_file_path != parsed_file_path:
+        move(source_file_path, parsed_file_path)
+    elif source_file_path != parsed_file_path:
       remove_ignore(source_file_path)
 
-    with inject_file_results_lock:
-      inject_file_results[source_file_path] = True
+    return True
+  except Exception:
+    return False
+
+def _render_indexed_file(source_file_path : str, parsed_file_path : str, file_entry : Dict[str, Any], renderer : MimicRenderer) -> bool :
+  """
+  Renders a file from its index entry, returns False when the file changed since it was indexed (parsed_file_path is then rendered again).
+  """
+
+  if not len(file_entry["placeholders"]):
+    if hash_file(source_file_path) != file_entry["hash"]:
+      return False
+    copy_file(source_file_path, parsed_file_path)
+    return True
+
+  with open(source_file_path, "rb") as source_fd, open(parsed_file_path, "wb") as parsed_fd:
+    if not render_indexed_file(source_fd, parsed_fd, file_entry, renderer):
+      return False
+  copymode(source_file_path, parsed_file_path)
+
+  return True
+
+def _render_file(source_file_path : str, parsed_file_path : str, is_raw_file : bool, file_entry : Union[Dict[str, Any], None], renderer : MimicRenderer) -> bool :
+  try:
+    if not is_raw_file and file_entry != None and _render_indexed_file(source_file_path, parsed_file_path, file_entry, renderer):
+      return True
+
+    if is_raw_file or is_binary_file(source_file_path) or not file_contains(source_file_path, b"{{"):
+      copy_file(source_file_path, parsed_file_path)
+      return True
+
+    with open(source_file_path, "r") as source_fd, open(parsed_file_path, "w") as parsed_fd:
+      renderer.render_stream(source_fd, parsed_fd)
+    copymode(source_file_path, parsed_file_path)
+
+    return True
+  except Exception:
+    return False
+
+def _read_rendered_file(source_file_path : str, is_raw_file : bool, file_entry : Union[Dict[str, Any], None], renderer : MimicRenderer) -> Union[bytes, None] :
+  """
+  Returns the content _render_file would write for a file, None when it could not be rendered.
+  """
+
+  try:
+    with open(source_file_path, "rb") as source_fd:
+      if not is_raw_file and file_entry != None:
+        parsed_buffer = BytesIO()
+        if render_indexed_file(source_fd, parsed_buffer, file_entry, renderer):
+          return parsed_buffer.getvalue()
+        source_fd.seek(0)
+      content = source_fd.read()
+
+    # Same sniffing as is_binary_file and file_contains
+    if is_raw_file or b"\x00" in content[:8192] or not b"{{" in content:
+      return content
+
+    parsed_buffer = BytesIO()
+    parsed_fd = TextIOWrapper(parsed_buffer)
+    with TextIOWrapper(BytesIO(content)) as source_fd:
+      renderer.render_stream(source_fd, parsed_fd)
+    parsed_fd.flush()
+    parsed_fd.detach()
+
+    return parsed_buffer.getvalue()
   except Exception:
-    with inject_file_results_lock:
-      inject_file_results[source_file_path] = False
+    return None
+
+def _init_file_task_worker(renderer : MimicRenderer) -> None :
+  global _worker_renderer
+  _worker_renderer = renderer
+
+def _inject_file_batch(source_files : List[Tuple[str, str, bool, Union[Dict[str, Any], None]]]) -> List[bool] :
+  return [_inject_file(*source_file, _worker_renderer) for source_file in source_files]
+
+def _render_file_batch(source_files : List[Tuple[str, str, bool, Union[Dict[str, Any], None]]]) -> List[bool] :
+  return [_render_file(*source_file, _worker_renderer) for source_file in source_files]
+
+def _read_rendered_file_batch(source_files : List[Tuple[str, bool, Union[Dict[str, Any], None]]]) -> List[Union[bytes, None]] :
+  return [_read_rendered_file(*source_file, _worker_renderer) for source_file in source_files]
+
+def _iter_file_tasks(file_task : Callable[..., Any], file_task_batch : Callable[[List[Tuple]], List[Any]], source_files : Iterable[Tuple], renderer : MimicRenderer, jobs : Union[int, None], backend : MimicRenderBackend, lookahead : int = 4096) -> Iterator[Tuple[Tuple, Any]] :
+  """
+  Runs file_task(*source_file, renderer) for every source file, whose first item must be its path, on the given backend and yields (source_file, result) pairs as they complete.
+  """
+
+  weight = lambda source_file: get_file_size(source_file[0])
+
+  if backend == "process":
+    return schedule_batches(file_task_batch, source_files, _init_file_task_worker, (renderer,), jobs, weight=weight, lookahead=lookahead)
+
+  return schedule(lambda source_file: file_task(*source_file, renderer), source_files, jobs, weight=weight, lookahead=lookahead)
 
-def _inject_dir(source_dir : str, variables : Dict[str, MimicVariable], variables_values : Dict[str, Any]) -> bool:
+def _schedule_file_tasks(file_task : Callable[..., bool], file_task_batch : Callable[[List[Tuple]], List[bool]], source_files : Iterable[Tuple], renderer : MimicRenderer, jobs : Union[int, None], backend : MimicRenderBackend) -> List[bool] :
+  """
+  Runs file_task(*source_file, renderer) for every source file, whose first item must be its path, on the given backend.
+  """
+
+  return [file_task_result for _, file_task_result in _iter_file_tasks(file_task, file_task_batch, source_files, renderer, jobs, backend)]
+
+def _inject_dir(source_dir : str, parsed_dir_name : str) -> bool:
   try:
-    move(source_dir, inject_variable(source_dir, variables, variables_values))
+    source_parent_dir_path, source_dir_name = split(source_dir)
+    if source_dir_name != parsed_dir_name:
+      move(source_dir, join(source_parent_dir_path, parsed_dir_name))
     return True
   except:
     return False
 
-def inject_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any]) -> bool :
-  inject_file_results = {}
-  inject_file_results_lock = Lock()
-  inject_file_threads = []
-
-  for source_path in ignore_glob(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True):
-    if isdir(source_path):
-      _inject_dir(source_path, mimic_config.template.variables, variables_values)
-    else:
-      # Directories are always returned first in a glob match
-      # We need to update the source_dir_path as we injected dir before
-      source_dir_path, source_file_name = split(source_path)
-      source_file_path = join(inject_variable(source_dir_path, mimic_config.template.variables, variables_values), source_file_name)
-
-      source_file_path_inject_file_thread = Thread(
-        target=_inject_file,
-        args=(source_file_path, mimic_config.template.variables, variables_values, inject_file_results, inject_file_results_lock)
-      )
-      inject_file_threads.append(source_file_path_inject_file_thread)
-      source_file_path_inject_file_thread.start()
-
-  for t in inject_file_threads:
-    t.join()
-  
-  return all([inject_file_results[k] for k in inject_file_results.keys()])
+def inject_mimic_template(mimic_template_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], jobs : Union[int, None] = None, backend : MimicRenderBackend = "thread") -> bool :
+  """
+  Injects variables values in the paths and content of mimic_template_dir in place.
+  The template index (.mimic.index), if any, is used to render indexed paths and is removed afterwards.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  mimic_index = MimicTemplateIndex.load(mimic_template_dir) or MimicTemplateIndex()
+  source_dirs : List[Tuple[str, str]] = []
+
+  def _source_files() -> Iterator[Tuple[str, str, bool, Union[Dict[str, Any], None]]] :
+    for source_entry in ignore_scandir(mimic_config.template.ignorePatterns, root_dir=mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name}):
+      relative_path = get_relative_path(source_entry.path, mimic_template_dir)
+      parsed_name = mimic_index.render_name(relative_path, source_entry.name, renderer)
+      if source_entry.is_dir():
+        source_dirs.append((source_entry.path, parsed_name))
+      else:
+        yield (source_entry.path, parsed_name, raw_file_matcher.match(relative_path), mimic_index.get_file_entry(relative_path))
+
+  inject_file_results = _schedule_file_tasks(_inject_file, _inject_file_batch, _source_files(), renderer, jobs, backend)
+
+  # Files are injected while the template is still being walked, so directories are only renamed afterwards
+  # Walk order lists a directory before its content, reversing it renames the deepest directories first
+  for source_dir_path, parsed_dir_name in reversed(source_dirs):
+    _inject_dir(source_dir_path, parsed_dir_name)
+
+  remove_ignore(join(mimic_template_dir, mimic_index_file_name))
+
+  return all(inject_file_results)
+
+def render_mimic_template(mimic_template_dir : str, out_dir : str, mimic_config : MimicConfig, variables_values : Dict[str, Any], excluded_paths : List[str] = [], jobs : Union[int, None] = None, backend : MimicRenderBackend = "thread") -> bool :
+  """
+  Renders mimic_template_dir straight into out_dir: every template file is read once and written once, at its injected path.
+  Ignored paths are copied as is, excluded_paths (relative to mimic_template_dir), the mimic cache folder and the template index are not copied at all.
+  Paths found in the template index (.mimic.index) are rendered from the offsets of their placeholders.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  mimic_index = MimicTemplateIndex.load(mimic_template_dir) or MimicTemplateIndex()
+  ignore_matcher = GlobMatcher(mimic_config.template.ignorePatterns)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  parsed_dir_paths : Dict[str, str] = {"": out_dir}
+
+  makedirs(out_dir, exist_ok=True)
+
+  def _source_files() -> Iterator[Tuple[str, str, bool, Union[Dict[str, Any], None]]] :
+    for source_entry, relative_path, is_ignored in scandir_tree(ignore_matcher, mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name, *excluded_paths}):
+      relative_dir_path, _, source_name = relative_path.rpartition("/")
+      parsed_path = join(parsed_dir_paths[relative_dir_path], source_name if is_ignored else mimic_index.render_name(relative_path, source_name, renderer))
+
+      if not source_entry.is_dir():
+        yield (source_entry.path, parsed_path, is_ignored or raw_file_matcher.match(relative_path), mimic_index.get_file_entry(relative_path))
+      elif ignore_matcher.match_tree(relative_path):
+        copytree(source_entry.path, parsed_path, copy_function=copy_file)
+      else:
+        makedirs(parsed_path, exist_ok=True)
+        copymode(source_entry.path, parsed_path)
+        parsed_dir_paths[relative_path] = parsed_path
+
+  return all(_schedule_file_tasks(_render_file, _render_file_batch, _source_files(), renderer, jobs, backend))
+
+def render_mimic_template_tar(mimic_template_dir : str, tar_fd : IO[bytes], mimic_config : MimicConfig, variables_values : Dict[str, Any], excluded_paths : List[str] = [], jobs : Union[int, None] = None, backend : MimicRenderBackend = "thread") -> bool :
+  """
+  Renders mimic_template_dir like render_mimic_template, as an uncompressed tar stream written to tar_fd instead of a directory: nothing is written to disk.
+  Entries are named after their injected path relative to the mimic root, files are added as soon as they are rendered.
+  """
+
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+  mimic_index = MimicTemplateIndex.load(mimic_template_dir) or MimicTemplateIndex()
+  ignore_matcher = GlobMatcher(mimic_config.template.ignorePatterns)
+  raw_file_matcher = GlobMatcher(mimic_config.template.rawPatterns)
+  parsed_dir_paths : Dict[str, str] = {"": ""}
+  parsed_paths : Dict[str, Tuple[str, int]] = {}
+  mtime = int(time())
+  render_results : List[bool] = []
+
+  with open_tar(fileobj=tar_fd, mode="w|") as tar:
+
+    def _add_directory(parsed_path : str, permissions : int) -> None :
+      tar_info = TarInfo(parsed_path)
+      tar_info.type = DIRTYPE
+      tar_info.mode = permissions
+      tar_info.mtime = mtime
+      tar.addfile(tar_info)
+
+    def _source_paths() -> Iterator[Tuple[Any, str, bool]] :
+      for source_entry, relative_path, is_ignored in scandir_tree(ignore_matcher, mimic_template_dir, include_hidden=True, excluded_relative_paths={mimic_cache_dir_name, mimic_index_file_name, *excluded_paths}):
+        yield (source_entry, relative_path, is_ignored)
+        # Directories whose whole content is ignored are not walked, their content is added as is
+        if source_entry.is_dir() and ignore_matcher.match_tree(relative_path):
+          for ignored_entry, ignored_relative_path, _ in scandir_tree(GlobMatcher([]), mimic_template_dir, True, set(), [relative_path]):
+            if ignored_relative_path != relative_path:
+              yield (ignored_entry, ignored_relative_path, True)
+
+    def _source_files() -> Iterator[Tuple[str, bool, Union[Dict[str, Any], None]]] :
+      for source_entry, relative_path, is_ignored in _source_paths():
+        relative_dir_path, _, source_name = relative_path.rpartition("/")
+        parsed_path = f"{parsed_dir_paths[relative_dir_path]}{source_name if is_ignored else mimic_index.render_name(relative_path, source_name, renderer)}"
+        permissions = S_IMODE(source_entry.stat().st_mode)
+
+        if source_entry.is_dir():
+          _add_directory(parsed_path, permissions)
+          parsed_dir_paths[relative_path] = f"{parsed_path}/"
+        else:
+          parsed_paths[source_entry.path] = (parsed_path, permissions)
+          yield (source_entry.path, is_ignored or raw_file_matcher.match(relative_path), mimic_index.get_file_entry(relative_path))
+
+    for (source_file_path, _, _), content in _iter_file_tasks(_read_rendered_file, _read_rendered_file_batch, _source_files(), renderer, jobs, backend, lookahead=1):
+      parsed_path, permissions = parsed_paths.pop(source_file_path)
+      render_results.append(content != None)
+      if content == None:
+        continue
+
+      tar_info = TarInfo(parsed_path)
+      tar_info.size = len(content)
+      tar_info.mode = permissions
+      tar_info.mtime = mtime
+      tar.addfile(tar_info, BytesIO(content))
+
+  return all(render_results)
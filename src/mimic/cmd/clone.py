@@ -1,18 +1,36 @@
-from os import sep
-from os.path import abspath, exists
-from typing import Dict, Any
+import sys
+from contextlib import nullcontext
+from json import loads
+from os import sep, makedirs
+from os.path import abspath, exists, isdir, basename, join
+from shutil import copytree, rmtree
+from re import sub
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import Union, List, Dict, Any, Tuple
 
 from ..actions.git import git_action
-from ..actions.template import inject_mimic_template
-from ..actions.hook import hook_action
-from ..utils import git, cloning, fs, config, input, alias_wallet
+from ..actions.template import inject_mimic_template, render_mimic_template, render_mimic_template_tar
+from ..actions.pack import render_mimic_pack
+from ..actions.archive import render_mimic_archive
+from ..actions.hook import hook_action, run_hooks_graph, get_hooks_dependencies
+from ..utils import git, cloning, fs, config, input, alias_wallet, pack, archive
+from ..utils.render import MimicRenderer
+from ..utils.scheduler import schedule, default_jobs
 from ..options import MimicOptions
 
-def _run_hooks(mimic_template_dir : str, when : config.MimicHookWhenType, variables : Dict[str, config.MimicVariable], variables_values: Dict[str, Any], mimic_config : config.MimicConfig, options : MimicOptions) -> bool :
+def _run_hooks(mimic_template_dir : str, when : config.MimicHookWhenType, renderer : MimicRenderer, mimic_config : config.MimicConfig, options : MimicOptions) -> bool :
   hooks = mimic_config.get_hooks_when(when)
   options["logger"].info(f"running '{when}' hooks ({len(hooks)})")
 
-  for i in range(len(hooks)):
+  # Output is only prefixed by hook names when hooks may run at the same time
+  is_sequential = all(not h.parallel and not len(h.needs) for h in hooks)
+  hooks_log_dir = mkdtemp(prefix=f"mimic-{when}-") if len(hooks) else None
+  hooks_cache_dir = join(options["command"]["cache_dir"], "hooks") if options["command"]["cache_dir"] != None else None
+  # Log files are only kept once a failure message points to one of them
+  is_hooks_log_dir_referenced = False
+
+  def _run_hook(i : int) -> bool :
+    nonlocal is_hooks_log_dir_referenced
     h = hooks[i]
     hook_properties = []
     if h.ignore_user_skip:
@@ -21,12 +39,14 @@ def _run_hooks(mimic_template_dir : str, when : config.MimicHookWhenType, variab
       hook_properties.append("error non fatal")
     hook_properties_log = f"({','.join(hook_properties)})" if len(hook_properties) else ''
 
-    h_name = h.name or f"<unnamed hook {i}>"
+    h_name = h.name or h.id or f"<unnamed hook {i}>"
     options["logger"].info(f"hook '{h_name}'{hook_properties_log}")
 
+    hook_log_file_path = join(hooks_log_dir, f"{i}-{sub(r'[^0-9A-Za-z_.-]', '_', h_name)}.log")
+
     hook_result = True
     try:
-      hook_result = hook_action(mimic_template_dir, h, variables, variables_values, options["command"]["unsafe_mode"])
+      hook_result = hook_action(mimic_template_dir, h, renderer, options["command"]["unsafe_mode"], "" if is_sequential else f"{h_name} | ", hook_log_file_path, hooks_cache_dir)
     except Exception:
       if h.ignore_user_skip:
         options["logger"].warn(f"hook '{h_name}' skipped")
@@ -34,50 +54,262 @@ def _run_hooks(mimic_template_dir : str, when : config.MimicHookWhenType, variab
         return False
 
     if not hook_result:
+      is_hooks_log_dir_referenced = True
       if h.ignore_error:
-        options["logger"].warn(f"hook '{h_name}' failed but non fatal")
+        options["logger"].warn(f"hook '{h_name}' failed but non fatal (see {hook_log_file_path})")
       else:
+        options["logger"].error(f"hook '{h_name}' failed (see {hook_log_file_path})")
         return False
-  return True
+    return True
 
-def clone(options : MimicOptions) -> bool :
-  if options['command']["name"] != "clone":
-    raise Exception("clone: invalid options")
-  
-  alias = options["command"]["mimic_uri"]
-  mimic_uri = alias_wallet.resolve_alias_mimic_uri_from(options["command"]["alias_wallet_file_path"], alias)
+  try:
+    return run_hooks_graph(hooks, _run_hook, options["command"]["jobs"] or default_jobs())
+  finally:
+    if hooks_log_dir != None and not is_hooks_log_dir_referenced:
+      rmtree(hooks_log_dir, ignore_errors=True)
 
-  if alias != mimic_uri:
-    options["logger"].info(f"{alias} has been resolved to {mimic_uri}")
+def _find_mimic_config_file(mimic_template_dir : str) -> Union[str, None] :
+  return fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
 
-  options["logger"].info(f"checking access to mimic {mimic_uri}")
-  if not cloning.check_access_to_mimic_template(mimic_uri):
-    raise Exception(f'could not resolve mimic {mimic_uri}. Are you sure that you have access to the mimic ?')
+def _check_hooks(mimic_config : config.MimicConfig) -> None :
+  # Fails on broken hooks needs before anything is generated
+  for when in config.MimicHookWhen:
+    get_hooks_dependencies(mimic_config.get_hooks_when(when))
 
-  mimic_template_dir = options["command"].get("out_dir") or abspath(git.repository_name(mimic_uri))
+def _fetch_mimic_template(mimic_uri : str, mimic_template_dir : str, cache_dir : Union[str, None], is_cached : bool, options : MimicOptions) -> None :
+  if cache_dir != None:
+    if options["command"]["offline"]:
+      options["logger"].info(f"using cached mimic {mimic_uri}")
+    else:
+      options["logger"].info(f"fetching {mimic_uri} in cache {cache_dir}")
+      if not cloning.update_cached_mimic_template(mimic_uri, cache_dir):
+        if not is_cached:
+          raise Exception(f'could not fetch mimic {mimic_uri} in cache "{cache_dir}"')
+        options["logger"].warn(f"could not fetch {mimic_uri}, falling back to its cached copy")
 
-  if exists(mimic_template_dir):
-    raise Exception(f"out_dir {mimic_template_dir} already exist and cloning into it will fail. cancelling")
-
-  options["logger"].info(f"cloning {mimic_uri} in {mimic_template_dir}")
-  if not cloning.clone_mimic_template(mimic_uri, mimic_template_dir):
-    raise Exception(f'could not clone mimic at "{mimic_template_dir}"')
+    options["logger"].info(f"cloning {mimic_uri} in {mimic_template_dir}")
+    if not cloning.clone_cached_mimic_template(mimic_uri, cache_dir, mimic_template_dir):
+      raise Exception(f'could not clone mimic at "{mimic_template_dir}"')
+  else:
+    options["logger"].info(f"cloning {mimic_uri} in {mimic_template_dir}")
+    if not cloning.clone_mimic_template(mimic_uri, mimic_template_dir):
+      raise Exception(f'could not clone mimic at "{mimic_template_dir}"')
 
   options["logger"].success(f"{mimic_uri} cloned")
 
+def _read_answers(answers_file_path : str, mimic_config : config.MimicConfig) -> List[Dict[str, Any]] :
+  """
+  Reads one set of variables values per line of a JSON lines answers file.
+  """
+
+  answers_variables_values = []
+  with open(answers_file_path, "r") as fd:
+    for line_number, line in enumerate(fd, 1):
+      if not line.strip():
+        continue
+      try:
+        answers = loads(line)
+        if not isinstance(answers, dict):
+          raise Exception("answers must be a JSON object")
+        answers_variables_values.append({ v: input.get_variable_answer(mimic_variable, answers.get(v)) for v, mimic_variable in mimic_config.template.variables.items() })
+      except Exception as e:
+        raise Exception(f"{answers_file_path} line {line_number}: {e}")
+
+  return answers_variables_values
 
-  mimic_config_file_path = fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
+def _clone_answers_from(mimic_template_dir : str, options : MimicOptions) -> bool :
+  mimic_config_file_path = _find_mimic_config_file(mimic_template_dir)
 
   if mimic_config_file_path == None:
-    options["logger"].warn(f"no .mimic(.json)? file has been found: no more work to do. exiting")
-    return True
+    raise Exception(f"no .mimic(.json)? file has been found in {mimic_template_dir}: cannot clone from answers")
 
-  mimic_config = config.load_mimic_config(mimic_config_file_path)
+  mimic_config = config.load_mimic_config(mimic_config_file_path, validate_schema=False)
 
   if mimic_config == None:
     raise Exception("cloud not apply post clone instruction because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
-  
-  fs.remove_ignore(mimic_config_file_path)
+
+  if len(mimic_config.hooks) and not options["command"]["unsafe_mode"]:
+    raise Exception("mimic template has hooks, cloning from answers requires unsafe mode (-u,--unsafe)")
+
+  _check_hooks(mimic_config)
+
+  answers_file_path = options["command"]["answers_file_path"]
+  options["logger"].info(f"reading answers from {answers_file_path}")
+
+  mimics : List[Tuple[str, Dict[str, Any], MimicRenderer]] = []
+  for variables_values in _read_answers(answers_file_path, mimic_config):
+    renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+    mimic_dir = abspath(renderer.render(options["command"]["out_pattern"]))
+
+    if exists(mimic_dir) or any(mimic_dir == m[0] for m in mimics):
+      raise Exception(f"out_dir {mimic_dir} already exist and cloning into it will fail. cancelling")
+
+    mimics.append((mimic_dir, variables_values, renderer))
+
+  # Templates with "pre_template_injection" hooks are copied and injected in place, since hooks may change them before injection
+  has_pre_hooks = len(mimic_config.get_hooks_when("pre_template_injection")) != 0
+  pre_hooks_successes : Dict[str, bool] = {}
+
+  for mimic_dir, _, renderer in mimics:
+    if has_pre_hooks:
+      copytree(mimic_template_dir, mimic_dir)
+      fs.remove_ignore(join(mimic_dir, basename(mimic_config_file_path)))
+      rmtree(join(mimic_dir, config.mimic_cache_dir_name), ignore_errors=True)
+    else:
+      makedirs(mimic_dir)
+
+    git_action(mimic_dir, mimic_config.git, interactive=False)
+
+    pre_hooks_successes[mimic_dir] = not has_pre_hooks or _run_hooks(mimic_dir, "pre_template_injection", renderer, mimic_config, options)
+    if not pre_hooks_successes[mimic_dir]:
+      options["logger"].warn(f'{mimic_dir}: "pre_template_injection" hooks failed, mimic will still generate your mimic_template but "post_template_injection" hooks will be skipped')
+
+  def _generate_mimic(mimic : Tuple[str, Dict[str, Any], MimicRenderer]) -> bool :
+    mimic_dir, variables_values, _ = mimic
+    # Mimics are generated concurrently, each of them by a single worker
+    if has_pre_hooks:
+      return inject_mimic_template(mimic_dir, mimic_config, variables_values, 1)
+    return render_mimic_template(mimic_template_dir, mimic_dir, mimic_config, variables_values, [".git", basename(mimic_config_file_path)], 1)
+
+  options["logger"].info(f"generating {len(mimics)} mimic_template(s)")
+  generate_successes : Dict[str, bool] = {}
+  for (mimic_dir, _, _), generate_success in schedule(_generate_mimic, mimics, options["command"]["jobs"]):
+    generate_successes[mimic_dir] = generate_success
+    if generate_success:
+      options["logger"].success(f"{mimic_dir} generated")
+    else:
+      options["logger"].error(f'{mimic_dir}: some files could not be generated, "post_template_injection" hooks will be skipped')
+
+  result = all(generate_successes.values())
+  if len(mimic_config.get_hooks_when("post_template_injection")):
+    for mimic_dir, _, renderer in mimics:
+      if pre_hooks_successes[mimic_dir] and generate_successes[mimic_dir] and not _run_hooks(mimic_dir, "post_template_injection", renderer, mimic_config, options):
+        options["logger"].error(f'{mimic_dir}: "post_template_injection" hooks failed')
+        result = False
+
+  if not result:
+    options["logger"].error(f"some of the {len(mimics)} mimic(s) from {answers_file_path} could not be generated or failed their hooks")
+    return False
+
+  options["logger"].success(f"successfully cloned {len(mimics)} mimic(s) from {answers_file_path}")
+  return True
+
+def _clone_answers(mimic_uri : str, cache_dir : Union[str, None], is_cached : bool, options : MimicOptions) -> bool :
+  """
+  Generates a mimic per answers set of the answers file, the mimic template is only fetched and parsed once.
+  """
+
+  if isdir(mimic_uri):
+    return _clone_answers_from(abspath(mimic_uri), options)
+
+  with TemporaryDirectory(prefix=".mimic-") as fetch_dir:
+    mimic_template_dir = join(fetch_dir, git.repository_name(mimic_uri))
+    _fetch_mimic_template(mimic_uri, mimic_template_dir, cache_dir, is_cached, options)
+    return _clone_answers_from(mimic_template_dir, options)
+
+def _clone_tar(mimic_uri : str, cache_dir : Union[str, None], is_cached : bool, options : MimicOptions) -> bool :
+  """
+  Renders the mimic as a tar stream written to out_dir, or to stdout when out_dir is None, the mimic itself is never written to disk.
+  Templates that are not local folders are fetched in a temporary folder first.
+  """
+
+  with TemporaryDirectory(prefix=".mimic-") as fetch_dir:
+    if isdir(mimic_uri):
+      mimic_template_dir = abspath(mimic_uri)
+    else:
+      mimic_template_dir = join(fetch_dir, "mimic")
+      _fetch_mimic_template(mimic_uri, mimic_template_dir, cache_dir, is_cached, options)
+
+    mimic_config_file_path = _find_mimic_config_file(mimic_template_dir)
+
+    if mimic_config_file_path == None:
+      raise Exception(f"no .mimic(.json)? file has been found in {mimic_uri}: cannot clone it as a tar stream")
+
+    mimic_config = config.load_mimic_config(mimic_config_file_path, validate_schema=False)
+
+    if mimic_config == None:
+      raise Exception("cloud not apply post clone instruction because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
+
+    # Hooks run in the mimic folder, there is none to run them in
+    if len(mimic_config.hooks):
+      raise Exception("mimic template has hooks, it cannot be cloned as a tar stream")
+
+    if mimic_config.git.enabled:
+      options["logger"].warn(f"no git repository is initialized in mimics cloned as a tar stream")
+
+    options["logger"].info(f"collecting user input(s)")
+    variables_values = {}
+    for v in mimic_config.template.variables.keys():
+      mimic_variable = mimic_config.template.variables[v]
+      variables_values[mimic_variable.name] = input.get_user_variable_input(mimic_variable)
+
+    out_file_path = options["command"]["out_dir"]
+    options["logger"].info(f"generating mimic_template as a tar stream to {out_file_path or 'stdout'}")
+
+    # stdout is redirected to stderr while cloning to stdout (see cli), the stream is written to the original stdout
+    with open(out_file_path, "wb") if out_file_path != None else nullcontext(sys.__stdout__.buffer) as tar_fd:
+      result = render_mimic_template_tar(mimic_template_dir, tar_fd, mimic_config, variables_values, [".git", basename(mimic_config_file_path)], options["command"]["jobs"], options["command"]["backend"])
+      tar_fd.flush()
+
+  if not result:
+    options["logger"].error(f"some files of {mimic_uri} could not be rendered")
+    return False
+
+  options["logger"].success(f"successfully cloned mimic template as a tar stream to {out_file_path or 'stdout'}")
+  return True
+
+def _clone_mimic(mimic_uri : str, mimic_pack : Union[pack.MimicPack, None], mimic_archive : Union[archive.MimicArchive, None], cache_dir : Union[str, None], is_cached : bool, options : MimicOptions) -> bool :
+  """
+  Clones a mimic in out_dir, mimic_pack and mimic_archive being the opened mimic pack or mimic archive when mimic_uri is one.
+  """
+
+  if mimic_pack != None:
+    mimic_name = basename(mimic_uri).removesuffix(pack.mimic_pack_extension)
+  elif mimic_archive != None:
+    mimic_name = archive.get_mimic_archive_name(mimic_archive.archive_path)
+  else:
+    mimic_name = git.repository_name(mimic_uri)
+  mimic_template_dir = options["command"].get("out_dir") or abspath(mimic_name)
+
+  if exists(mimic_template_dir):
+    raise Exception(f"out_dir {mimic_template_dir} already exist and cloning into it will fail. cancelling")
+
+  mimic_archive_config = mimic_archive.read_config() if mimic_archive != None else None
+
+  if mimic_pack != None:
+    source_mimic_config = mimic_pack.mimic_config
+  elif mimic_archive_config != None:
+    source_mimic_config = mimic_archive_config[2]
+  else:
+    source_mimic_config_file_path = _find_mimic_config_file(mimic_uri) if isdir(mimic_uri) else None
+    source_mimic_config = config.load_mimic_config(source_mimic_config_file_path, validate_schema=False) if source_mimic_config_file_path != None else None
+
+  # Local templates, mimic packs and archives are rendered straight into out_dir, unless hooks have to run on the template before its injection
+  render_from_source = source_mimic_config != None and len(source_mimic_config.get_hooks_when("pre_template_injection")) == 0
+
+  if render_from_source:
+    _check_hooks(source_mimic_config)
+    options["logger"].info(f"rendering {mimic_uri} in {mimic_template_dir}")
+    makedirs(mimic_template_dir)
+    mimic_config = source_mimic_config
+  else:
+    _fetch_mimic_template(mimic_uri, mimic_template_dir, cache_dir, is_cached, options)
+
+  if not render_from_source:
+    mimic_config_file_path = _find_mimic_config_file(mimic_template_dir)
+
+    if mimic_config_file_path == None:
+      options["logger"].warn(f"no .mimic(.json)? file has been found: no more work to do. exiting")
+      return True
+
+    mimic_config = config.load_mimic_config(mimic_config_file_path, validate_schema=False)
+
+    if mimic_config == None:
+      raise Exception("cloud not apply post clone instruction because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
+    
+    fs.remove_ignore(mimic_config_file_path)
+    rmtree(join(mimic_template_dir, config.mimic_cache_dir_name), ignore_errors=True)
+    _check_hooks(mimic_config)
 
   if mimic_config.git.enabled:
     options["logger"].info(f"initializing new git repository in {mimic_template_dir} with main_branch={mimic_config.git.main_branch}")
@@ -90,21 +322,69 @@ def clone(options : MimicOptions) -> bool :
     mimic_variable = mimic_config.template.variables[v]
     variables_values[mimic_variable.name] = input.get_user_variable_input(mimic_variable)
 
-  pre_hooks_success = _run_hooks(mimic_template_dir, "pre_template_injection", mimic_config.template.variables, variables_values, mimic_config, options)
+  renderer = MimicRenderer(mimic_config.template.variables, variables_values)
+
+  pre_hooks_success = _run_hooks(mimic_template_dir, "pre_template_injection", renderer, mimic_config, options)
   
   if pre_hooks_success:
     options["logger"].info(f"generating mimic_template")
   else:
     options["logger"].warn(f'"pre_template_injection" hooks failed, mimic will still generate your mimic_template but "post_template_injection" hooks will be skipped')
 
-  inject_mimic_template(mimic_template_dir, mimic_config, variables_values)
+  if render_from_source and mimic_pack != None:
+    generate_success = render_mimic_pack(mimic_pack, mimic_template_dir, mimic_config, variables_values, options["command"]["jobs"], options["command"]["backend"])
+  elif render_from_source and mimic_archive_config != None:
+    mimic_template_root, mimic_config_file_name, _ = mimic_archive_config
+    generate_success = render_mimic_archive(mimic_archive, mimic_template_root, mimic_template_dir, mimic_config, variables_values, [".git", mimic_config_file_name], options["command"]["jobs"], options["command"]["backend"])
+  elif render_from_source:
+    generate_success = render_mimic_template(mimic_uri, mimic_template_dir, mimic_config, variables_values, [".git", basename(source_mimic_config_file_path)], options["command"]["jobs"], options["command"]["backend"])
+  else:
+    generate_success = inject_mimic_template(mimic_template_dir, mimic_config, variables_values, options["command"]["jobs"], options["command"]["backend"])
+
+  if not generate_success:
+    options["logger"].error(f'some files of {mimic_template_dir} could not be generated, "post_template_injection" hooks are skipped')
+    return False
 
   options["logger"].success(f"{mimic_template_dir} generated")
 
   if pre_hooks_success:
-    if not _run_hooks(mimic_template_dir, "post_template_injection", mimic_config.template.variables, variables_values, mimic_config, options):
+    if not _run_hooks(mimic_template_dir, "post_template_injection", renderer, mimic_config, options):
       options["logger"].error(f'"post_template_injection" hooks failed')
       return False
 
   options["logger"].success(f"successfully cloned mimic template in {options["command"]["out_dir"]}")
-  return True
\ No newline at end of file
+  return True
+
+def clone(options : MimicOptions) -> bool :
+  if options['command']["name"] != "clone":
+    raise Exception("clone: invalid options")
+  
+  alias = options["command"]["mimic_uri"]
+  mimic_uri = alias_wallet.resolve_alias_mimic_uri_from(options["command"]["alias_wallet_file_path"], alias)
+
+  if alias != mimic_uri:
+    options["logger"].info(f"{alias} has been resolved to {mimic_uri}")
+
+  mimic_archive_path = archive.get_mimic_archive_path(mimic_uri)
+  is_local_mimic = exists(mimic_uri) or mimic_archive_path != None
+  cache_dir = options["command"]["cache_dir"] if not is_local_mimic else None
+  is_cached = cache_dir != None and cloning.is_mimic_template_cached(mimic_uri, cache_dir)
+
+  if options["command"]["offline"] and not is_local_mimic and not is_cached:
+    raise Exception(f"mimic {mimic_uri} is not cached and cannot be cloned offline")
+
+  # A cached mimic is known to exist, fetching it tells whether it can still be reached
+  if not is_cached:
+    options["logger"].info(f"checking access to mimic {mimic_uri}")
+    if not cloning.check_access_to_mimic_template(mimic_uri):
+      raise Exception(f'could not resolve mimic {mimic_uri}. Are you sure that you have access to the mimic ?')
+
+  if options["command"]["answers_file_path"] != None:
+    return _clone_answers(mimic_uri, cache_dir, is_cached, options)
+
+  if options["command"]["output_format"] == "tar":
+    return _clone_tar(mimic_uri, cache_dir, is_cached, options)
+
+  # The mimic pack is unmapped and the mimic archive closed once cloning is done, whether it succeeds or not
+  with pack.MimicPack(mimic_uri) if pack.is_mimic_pack(mimic_uri) else nullcontext() as mimic_pack, archive.MimicArchive(mimic_archive_path) if mimic_archive_path != None else nullcontext() as mimic_archive:
+    return _clone_mimic(mimic_uri, mimic_pack, mimic_archive, cache_dir, is_cached, options)
@@ -0,0 +1,32 @@
+from os import sep
+from os.path import join
+
+from ..utils import fs, config
+from ..actions.index import index_mimic_template
+from ..options import MimicOptions
+
+def index(options : MimicOptions) -> bool:
+  if options['command']['name'] != "index":
+    raise Exception("index: invalid options")
+
+  mimic_template_dir = options["command"]["mimic_template_dir"]
+  mimic_config_file_path = fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
+
+  if mimic_config_file_path == None:
+    options["logger"].warn(f"no .mimic(.json)? file has been found in {mimic_template_dir}: no more work to do. exiting")
+    return True
+
+  mimic_config = config.load_mimic_config(mimic_config_file_path)
+
+  if mimic_config == None:
+    raise Exception(f"cloud not index mimic template because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
+
+  options["logger"].info(f"indexing mimic_template {mimic_template_dir}")
+  mimic_index = index_mimic_template(mimic_template_dir, mimic_config, options["command"]["jobs"])
+
+  mimic_index_file_path = join(mimic_template_dir, config.mimic_index_file_name)
+  if not mimic_index.save(mimic_template_dir):
+    raise Exception(f"could not write mimic template index {mimic_index_file_path}")
+
+  options["logger"].success(f"{mimic_index_file_path}: {len(mimic_index.names)} path(s) and {mimic_index.placeholder_count()} placeholder(s) indexed")
+  return True
@@ -1,15 +1,79 @@
+from contextlib import closing
 from os import sep
+from os.path import basename
 from shutil import move
-from typing import List
+from typing import List, Union
 
-from ..utils import config, fs
+from ..utils import config, fs, watch
 from ..utils.logger import ColorTable, ColorReset
-from ..actions.lint import get_issues_from_mimic_template, MimicIssueReference, fix_issues_in_mimic_template
+from ..actions.lint import get_issues_from_mimic_template, get_issues_from_occurrences, get_occurrences_from_mimic_template, MimicIssueReference, fix_issues_in_mimic_template
 from ..options import MimicOptions
 
 def _print_lint_error(message : str) -> None :
   print(f"{ColorTable["YELLOW"]}{message}{ColorReset}")
 
+def _load_mimic_config(options : MimicOptions, mimic_config_file_path : str) -> Union[config.MimicConfig, None] :
+  mimic_config_file_issues = config.is_mimic_config_file_data_valid(mimic_config_file_path)
+
+  if len(mimic_config_file_issues):
+    options["logger"].error(f"{mimic_config_file_path}: {len(mimic_config_file_issues)} error(s) found")
+    for issue in mimic_config_file_issues:
+      options["logger"].error(f"{issue.property} {issue.reason}")
+    return None
+
+  # The config has just been validated against the schema
+  return config.load_mimic_config(mimic_config_file_path, validate_schema=False)
+
+def _print_lint_issues(options : MimicOptions, mimic_template_dir : str, mimic_config_file_path : str, undeclared_variables : List[MimicIssueReference], unreferenced_variables : List[str]) -> None :
+  if 0 < len(undeclared_variables):
+    options["logger"].info(f"there {'are' if 1 < len(undeclared_variables) else 'is'} {len(undeclared_variables)} variables in mimic template {mimic_template_dir} that {'are' if 1 < len(undeclared_variables) else 'is'} not defined in {mimic_config_file_path}")
+    for uv in undeclared_variables:
+      if uv.is_file:
+        _print_lint_error(f"{uv.source_path}: {{{{ {uv.name} }}}} in file name but missing from .mimic.json")
+      elif uv.is_directory:
+        _print_lint_error(f"{uv.source_path}: {{{{ {uv.name} }}}} in directory name but missing from .mimic.json")
+      else:
+        _print_lint_error(f"{uv.source_path} line {uv.line}: {{{{ {uv.name} }}}} is missing from .mimic.json")
+
+  if 0 < len(unreferenced_variables):
+    options["logger"].info(f"{mimic_config_file_path}: {len(unreferenced_variables)} variable{'s are' if 1 < len(unreferenced_variables) else ' is'} declared but not used")
+    for uv in unreferenced_variables:
+      _print_lint_error(f"- {uv}")
+
+  if 0 == len(undeclared_variables) + len(unreferenced_variables):
+    options["logger"].success(f"{mimic_config_file_path}: no errors found")
+  else:
+    options["logger"].info("you can fix these issues with mimic lint --fix")
+
+def _watch_lint(options : MimicOptions, mimic_template_dir : str, mimic_config_file_path : str) -> bool :
+  """
+  Lints the mimic template again each time it changes, only the changed paths are scanned again unless the mimic config changed.
+  """
+
+  mimic_config_relative_path = basename(mimic_config_file_path)
+
+  try:
+    while True:
+      mimic_config = _load_mimic_config(options, mimic_config_file_path)
+      if mimic_config != None:
+        occurrence_index = get_occurrences_from_mimic_template(mimic_template_dir, mimic_config, options["command"]["jobs"], options["command"]["use_cache"])
+        _print_lint_issues(options, mimic_template_dir, mimic_config_file_path, *get_issues_from_occurrences(mimic_config, occurrence_index))
+
+      options["logger"].info(f"watching {mimic_template_dir} for changes, press Ctrl+C to stop")
+      with closing(watch.watch_tree(mimic_template_dir, mimic_config.template.ignorePatterns if mimic_config != None else [], {config.mimic_cache_dir_name, config.mimic_index_file_name})) as changes:
+        for changed_paths in changes:
+          # Ignore and raw patterns may have changed, everything is linted again
+          if mimic_config == None or changed_paths == None or mimic_config_relative_path in changed_paths:
+            break
+
+          options["logger"].info(f"{len(changed_paths)} path(s) changed")
+          get_occurrences_from_mimic_template(mimic_template_dir, mimic_config, options["command"]["jobs"], options["command"]["use_cache"], changed_paths, occurrence_index)
+          _print_lint_issues(options, mimic_template_dir, mimic_config_file_path, *get_issues_from_occurrences(mimic_config, occurrence_index))
+  except KeyboardInterrupt:
+    # Ends the "^C" line
+    print()
+    return True
+
 def lint(options : MimicOptions) -> bool:
   if options['command']['name'] != "lint":
     raise Exception("lint: invalid options")
@@ -21,24 +85,23 @@ def lint(options : MimicOptions) -> bool:
     options["logger"].warn(f"no .mimic(.json)? file has been found in {mimic_template_dir}: no more work to do. exiting")
     return True
 
-  mimic_config_file_issues = config.is_mimic_config_file_data_valid(mimic_config_file_path)
+  if options["command"]["watch"]:
+    with watch.interruptible():
+      return _watch_lint(options, mimic_template_dir, mimic_config_file_path)
 
-  if len(mimic_config_file_issues):
-    options["logger"].error(f"{mimic_config_file_path}: {len(mimic_config_file_issues)} error(s) found")
-    for issue in mimic_config_file_issues:
-      options["logger"].error(f"{issue.property} {issue.reason}")
-    return False
+  mimic_config = _load_mimic_config(options, mimic_config_file_path)
 
-  mimic_config = config.load_mimic_config(mimic_config_file_path)
+  if mimic_config == None:
+    return False
 
-  undeclared_variables, unreferenced_variables = get_issues_from_mimic_template(mimic_template_dir, mimic_config)
+  undeclared_variables, unreferenced_variables = get_issues_from_mimic_template(mimic_template_dir, mimic_config, options["command"]["jobs"], options["command"]["use_cache"])
 
   if options["command"]["fix"] != None:
     initial_issue_count = len(undeclared_variables) + len(unreferenced_variables)
     if initial_issue_count == 0:
       options["logger"].success(f"no issue to fix in mimic template {mimic_template_dir}")
     else:
-      unfixable_issue = fix_issues_in_mimic_template(undeclared_variables, unreferenced_variables, mimic_config_file_path, mimic_config, options["command"]["fix"])
+      unfixable_issue = fix_issues_in_mimic_template(undeclared_variables, unreferenced_variables, mimic_config_file_path, mimic_config, options["command"]["fix"], options["command"]["jobs"])
       fixed_issue_count = initial_issue_count - len(unfixable_issue)
       options["logger"].success(f"fixed {fixed_issue_count}/{initial_issue_count} issue(s)")
       if len(unfixable_issue):
@@ -46,25 +109,11 @@ def lint(options : MimicOptions) -> bool:
         for unfixable in unfixable_issue:
           _print_lint_error(f"{unfixable.issue.source_path}: {unfixable.reason}")
         return False
+    if 0 == len(undeclared_variables) + len(unreferenced_variables):
+      options["logger"].success(f"{mimic_config_file_path}: no errors found")
+    else:
+      options["logger"].info("you can fix these issues with mimic lint --fix")
   else:
-    if 0 < len(undeclared_variables):
-      options["logger"].info(f"there {'are' if 1 < len(undeclared_variables) else 'is'} {len(undeclared_variables)} variables in mimic template {mimic_template_dir} that {'are' if 1 < len(undeclared_variables) else 'is'} not defined in {mimic_config_file_path}")
-      for uv in undeclared_variables:
-        if uv.is_file:
-          _print_lint_error(f"{uv.source_path}: {{{{ {uv.name} }}}} in file name but missing from .mimic.json")
-        elif uv.is_directory:
-          _print_lint_error(f"{uv.source_path}: {{{{ {uv.name} }}}} in directory name but missing from .mimic.json")
-        else:
-          _print_lint_error(f"{uv.source_path} line {uv.line}: {{{{ {uv.name} }}}} is missing from .mimic.json")
-
-    if 0 < len(unreferenced_variables):
-      options["logger"].info(f"{mimic_config_file_path}: {len(unreferenced_variables)} variable{'s are' if 1 < len(unreferenced_variables) else ' is'} declared but not used")
-      for uv in unreferenced_variables:
-        _print_lint_error(f"- {uv}")
+    _print_lint_issues(options, mimic_template_dir, mimic_config_file_path, undeclared_variables, unreferenced_variables)
 
-  if 0 == len(undeclared_variables) + len(unreferenced_variables):
-    options["logger"].success(f"{mimic_config_file_path}: no errors found")
-  else:
-    options["logger"].info("you can fix these issues with mimic lint --fix")
   return True
-  
\ No newline at end of file
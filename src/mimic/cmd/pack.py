@@ -0,0 +1,31 @@
+from os import sep
+from os.path import getsize
+
+from ..utils import fs, config, pack as mimic_pack
+from ..actions.pack import pack_mimic_template
+from ..options import MimicOptions
+
+def pack(options : MimicOptions) -> bool:
+  if options['command']['name'] != "pack":
+    raise Exception("pack: invalid options")
+
+  mimic_template_dir = options["command"]["mimic_template_dir"]
+  mimic_pack_file_path = options["command"]["output"] or f"{mimic_template_dir}{mimic_pack.mimic_pack_extension}"
+  mimic_config_file_path = fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
+
+  if mimic_config_file_path == None:
+    raise Exception(f"no .mimic(.json)? file has been found in {mimic_template_dir}: cannot pack it")
+
+  mimic_config = config.load_mimic_config(mimic_config_file_path)
+
+  if mimic_config == None:
+    raise Exception(f"cloud not pack mimic template because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
+
+  if options["command"]["compression"] == "zstd" and mimic_pack.zstd is None:
+    raise Exception("zstd compression requires python 3.14 or later")
+
+  options["logger"].info(f"packing mimic_template {mimic_template_dir} in {mimic_pack_file_path}")
+  path_count, blob_count = pack_mimic_template(mimic_template_dir, mimic_config_file_path, mimic_config, mimic_pack_file_path, options["command"]["compression"], options["command"]["jobs"])
+
+  options["logger"].success(f"{mimic_pack_file_path}: {path_count} path(s) packed, {blob_count} distinct file content(s), {getsize(mimic_pack_file_path)} bytes")
+  return True
@@ -1,62 +1,237 @@
+from contextlib import closing, redirect_stdout
+from json import dumps
 from os import sep
+from os.path import basename
+from sys import stderr, stdout
+from time import monotonic
+from typing import Dict, Any, IO, Iterable, List, Union
 
-from ..utils import fs, config, input
+from ..utils import fs, config, input, watch
 from ..utils.logger import ColorTable, ColorReset
-from ..actions.preview import preview_mimic_template
+from ..utils.render import MimicRenderer
+from ..actions.preview import iter_mimic_template_preview, update_mimic_template_path_previews
 from ..options import MimicOptions
 
-def preview(options : MimicOptions) -> bool:
-  if options['command']['name'] != "preview":
-    raise Exception("preview: invalid options")
-  
-  mimic_template_dir = options["command"]["mimic_template_dir"]
-  mimic_config_file_path = fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
+# Preview output is written by chunks of preview_output_buffer_size characters, at least every preview_output_flush_interval seconds
+preview_output_buffer_size = 1 << 16
+preview_output_flush_interval = 0.1
 
-  if mimic_config_file_path == None:
-    options["logger"].warn(f"no .mimic(.json)? file has been found: no more work to do. exiting")
-    return True
+class _PreviewWriter:
+
+  def __init__(self, output : IO[str]):
+    self.output = output
+    self.parts : List[str] = []
+    self.size = 0
+    self.last_flush_time = monotonic()
+
+  def write(self, text : str) -> None :
+    self.parts.append(text)
+    self.size += len(text)
+    if preview_output_buffer_size <= self.size or preview_output_flush_interval <= monotonic() - self.last_flush_time:
+      self.flush()
 
+  def flush(self) -> None :
+    self.output.write("".join(self.parts))
+    self.output.flush()
+    self.parts = []
+    self.size = 0
+    self.last_flush_time = monotonic()
+
+def _load_mimic_config(mimic_config_file_path : str) -> config.MimicConfig :
   mimic_config = config.load_mimic_config(mimic_config_file_path)
 
   if mimic_config == None:
     raise Exception(f"cloud not preview mimic template because of broken mimic config (see https://raw.githubusercontent.com/LasramR/mimic/refs/heads/main/.mimic.0.5.1.schema.json)")
-  
-  options["logger"].info(f"previewing mimic_template {mimic_template_dir}")
+
+  return mimic_config
+
+def _get_variables_values(mimic_config : config.MimicConfig, previous_mimic_config : Union[config.MimicConfig, None] = None, previous_variables_values : Dict[str, Any] = {}) -> Dict[str, Any] :
+  """
+  Asks the value of every variable, values given for a previous config are reused for variables that kept the same type.
+  """
+
   variables = {}
   for v in mimic_config.template.variables.keys():
     mimic_variable = mimic_config.template.variables[v]
-    variables[mimic_variable.name] = input.get_user_variable_input(mimic_variable)
-
-  mimic_template_preview = preview_mimic_template(mimic_template_dir, mimic_config, variables)
+    previous_mimic_variable = previous_mimic_config.template.variables.get(v) if previous_mimic_config != None else None
+    if previous_mimic_variable != None and previous_mimic_variable.type == mimic_variable.type and previous_mimic_variable.item == mimic_variable.item:
+      variables[mimic_variable.name] = previous_variables_values[mimic_variable.name]
+    else:
+      variables[mimic_variable.name] = input.get_user_variable_input(mimic_variable)
+  return variables
 
-  options["logger"].success(f"mimic_template preview generated")
+def _format_path_preview_text(path_preview : config.MimicPathPreview) -> str :
+  text = ""
+  if path_preview.is_renamed():
+    text += f"{ColorTable['RED']}{path_preview.source_path}{ColorReset} -> {ColorTable['GREEN']}{path_preview.parsed_path}{ColorReset}\n"
+  for c in path_preview.changes:
+    text += f"{ColorTable['BLUE']}{path_preview.source_path} line {c.line}{ColorReset}\n"
+    text += f"{ColorTable["RED"]}- {c.raw.strip()}{ColorReset}\n"
+    text += f"{ColorTable["GREEN"]}- {c.parsed.strip()}{ColorReset}\n"
+  if 0 < path_preview.hidden_change_count:
+    text += f"{ColorTable['YELLOW']}{path_preview.source_path}: {path_preview.hidden_change_count} more line(s) changed (see --max-changes){ColorReset}\n"
+  return text
 
-  options["logger"].info(f"directory change(s) ({len(mimic_template_preview.directory_preview.keys())})")
-  for k in mimic_template_preview.directory_preview.keys():
-    print(f"{ColorTable['RED']}{k}{ColorReset} -> {ColorTable['GREEN']}{mimic_template_preview.directory_preview[k]}")
+def _format_path_preview_diff(path_preview : config.MimicPathPreview) -> str :
+  # Unified diff without context lines (git apply --unidiff-zero), directories are only renamed along with the files they contain
+  if path_preview.is_directory or not (path_preview.is_renamed() or len(path_preview.changes)):
+    return ""
 
-  options["logger"].info(f"file change(s) ({len(mimic_template_preview.file_preview.keys())})")
-  for k in mimic_template_preview.file_preview.keys():
-    print(f"{ColorTable['RED']}{k}{ColorReset} -> {ColorTable['GREEN']}{mimic_template_preview.file_preview[k]}")
+  text = f"diff --git a/{path_preview.relative_path} b/{path_preview.parsed_relative_path}\n"
+  if path_preview.is_renamed():
+    text += f"rename from {path_preview.relative_path}\nrename to {path_preview.parsed_relative_path}\n"
+  if len(path_preview.changes):
+    text += f"--- a/{path_preview.relative_path}\n+++ b/{path_preview.parsed_relative_path}\n"
+  # Rendered lines may span several lines, which shifts the following lines
+  line_offset = 0
+  for c in path_preview.changes:
+    parsed_lines = c.parsed.split("\n")
+    missing_line_break = "" if c.has_line_break else "\\ No newline at end of file\n"
+    text += f"@@ -{c.line},1 +{c.line + line_offset},{len(parsed_lines)} @@\n-{c.raw}\n{missing_line_break}"
+    text += "".join(f"+{parsed_line}\n" for parsed_line in parsed_lines) + missing_line_break
+    line_offset += len(parsed_lines) - 1
+  return text
 
-  options["logger"].info(f"content change(s) ({sum([len(mimic_template_preview.file_content_preview[k]) for k in mimic_template_preview.file_content_preview.keys()])})")
+def _format_path_preview_json(path_preview : config.MimicPathPreview) -> str :
+  if not path_preview.is_directory and not (path_preview.is_renamed() or len(path_preview.changes) or path_preview.hidden_change_count):
+    return ""
 
-  for k in mimic_template_preview.file_content_preview.keys():
-    for c in mimic_template_preview.file_content_preview[k]:
-      options["logger"].info(f"{k} line {c.line}")
-      print(f"{ColorTable["RED"]}- {c.raw}{ColorReset}")
-      print(f"{ColorTable["GREEN"]}- {c.parsed}{ColorReset}")
+  json_path_preview = {
+    "type": "directory" if path_preview.is_directory else "file",
+    "path": path_preview.relative_path,
+    "parsed_path": path_preview.parsed_relative_path
+  }
+  if not path_preview.is_directory:
+    json_path_preview["changes"] = [{ "line": c.line, "raw": c.raw, "parsed": c.parsed } for c in path_preview.changes]
+    json_path_preview["hidden_changes"] = path_preview.hidden_change_count
+  return f"{dumps(json_path_preview)}\n"
 
+def _format_hooks_text(mimic_config : config.MimicConfig, renderer : MimicRenderer) -> str :
+  text = ""
   for when in config.MimicHookWhen:
     hooks = mimic_config.get_hooks_when(when)
-    options["logger"].info(f"\"{when}\" hook(s) that will trigger ({len(hooks)})")
+    text += f"{ColorTable['BLUE']}\"{when}\" hook(s) that will trigger ({len(hooks)}){ColorReset}\n"
     for i in range(len(hooks)):
       h = hooks[i]
-      print(f"{ColorTable['GREEN']}{h.name or f'<unnamed hook {i}>'}:{ColorReset}")
-      print(f"{ColorTable['GREEN']}{len(h.steps)} step(s){ColorReset}")
+      text += f"{ColorTable['GREEN']}{h.name or f'<unnamed hook {i}>'}:{ColorReset}\n"
+      text += f"{ColorTable['GREEN']}{len(h.steps)} step(s){ColorReset}\n"
       for s in h.steps:
-        print(f"{ColorTable["MAGENTA"]}\t- {s}{ColorReset}")
+        text += f"{ColorTable["MAGENTA"]}\t- {renderer.render(s)}{ColorReset}\n"
       if not h.ignore_error:
-        print(f"{ColorTable['RED']}will fail if an error occurs{ColorReset}")
+        text += f"{ColorTable['RED']}will fail if an error occurs{ColorReset}\n"
       if not h.ignore_user_skip:
-        print(f"{ColorTable['RED']}will fail if user skip{ColorReset}")
+        text += f"{ColorTable['RED']}will fail if user skip{ColorReset}\n"
+  return text
+
+def _format_hooks_json(mimic_config : config.MimicConfig, renderer : MimicRenderer) -> str :
+  return "".join(f"{dumps({ "type": "hook", "when": h.when, "name": h.name, "steps": [renderer.render(s) for s in h.steps], "ignore_error": h.ignore_error, "ignore_user_skip": h.ignore_user_skip })}\n" for h in mimic_config.hooks)
+
+_path_preview_formatters = {
+  "text": _format_path_preview_text,
+  "diff": _format_path_preview_diff,
+  "json": _format_path_preview_json
+}
+
+_hooks_formatters = {
+  "text": _format_hooks_text,
+  "diff": lambda mimic_config, renderer: "",
+  "json": _format_hooks_json
+}
+
+def _write_mimic_template_preview(options : MimicOptions, writer : _PreviewWriter, mimic_config : config.MimicConfig, variables : Dict[str, Any], path_previews : Iterable[config.MimicPathPreview]) -> None :
+  preview_format = options["command"]["format"]
+  format_path_preview = _path_preview_formatters[preview_format]
+  directory_change_count = 0
+  file_change_count = 0
+  content_change_count = 0
+  hidden_change_count = 0
+
+  for path_preview in path_previews:
+    writer.write(format_path_preview(path_preview))
+    if path_preview.is_directory:
+      directory_change_count += 1
+    elif path_preview.is_renamed():
+      file_change_count += 1
+    content_change_count += len(path_preview.changes) + path_preview.hidden_change_count
+    hidden_change_count += path_preview.hidden_change_count
+
+  writer.write(_hooks_formatters[preview_format](mimic_config, MimicRenderer(mimic_config.template.variables, variables)))
+  writer.flush()
+
+  options["logger"].success(f"mimic_template preview generated: {directory_change_count} directory change(s), {file_change_count} file change(s), {content_change_count} content change(s)")
+  if 0 < hidden_change_count:
+    options["logger"].warn(f"{hidden_change_count} content change(s) not shown, above --max-changes {options['command']['max_changes']} per file")
+
+def _watch_preview(options : MimicOptions, writer : _PreviewWriter, mimic_template_dir : str, mimic_config_file_path : str, mimic_config : config.MimicConfig, variables : Dict[str, Any]) -> bool :
+  """
+  Previews the mimic template again each time it changes, only the changed paths are previewed again unless the mimic config changed.
+  Variables values are only asked again for variables added to the mimic config (or whose type changed).
+  """
+
+  mimic_config_relative_path = basename(mimic_config_file_path)
+
+  try:
+    while True:
+      path_previews : Dict[str, config.MimicPathPreview] = {}
+      def _record_path_previews():
+        for path_preview in iter_mimic_template_preview(mimic_template_dir, mimic_config, variables, options["command"]["jobs"], max_changes=options["command"]["max_changes"]):
+          path_previews[path_preview.relative_path] = path_preview
+          yield path_preview
+      _write_mimic_template_preview(options, writer, mimic_config, variables, _record_path_previews())
+
+      options["logger"].info(f"watching {mimic_template_dir} for changes, press Ctrl+C to stop")
+      with closing(watch.watch_tree(mimic_template_dir, mimic_config.template.ignorePatterns, {config.mimic_cache_dir_name, config.mimic_index_file_name})) as changes:
+        for changed_paths in changes:
+          # Variables, ignore and raw patterns may have changed, everything is previewed again
+          if changed_paths == None or mimic_config_relative_path in changed_paths:
+            break
+
+          options["logger"].info(f"{len(changed_paths)} path(s) changed")
+          update_mimic_template_path_previews(path_previews, mimic_template_dir, mimic_config, variables, changed_paths, options["command"]["jobs"], options["command"]["max_changes"])
+          _write_mimic_template_preview(options, writer, mimic_config, variables, path_previews.values())
+
+      try:
+        updated_mimic_config = _load_mimic_config(mimic_config_file_path)
+      except Exception as e:
+        options["logger"].error(e)
+        continue
+      variables = _get_variables_values(updated_mimic_config, mimic_config, variables)
+      mimic_config = updated_mimic_config
+  except KeyboardInterrupt:
+    # Ends the "^C" line
+    print()
+    return True
+
+def _preview(options : MimicOptions, writer : _PreviewWriter) -> bool:
+  mimic_template_dir = options["command"]["mimic_template_dir"]
+  mimic_config_file_path = fs.resolve_existing_path(fs.get_file_with_extensions(f"{mimic_template_dir}{sep}.mimic", ["", ".json", ".jsonc"]))
+
+  if mimic_config_file_path == None:
+    options["logger"].warn(f"no .mimic(.json)? file has been found: no more work to do. exiting")
+    return True
+
+  mimic_config = _load_mimic_config(mimic_config_file_path)
+
+  options["logger"].info(f"previewing mimic_template {mimic_template_dir}")
+  variables = _get_variables_values(mimic_config)
+
+  if options["command"]["watch"]:
+    with watch.interruptible():
+      return _watch_preview(options, writer, mimic_template_dir, mimic_config_file_path, mimic_config, variables)
+
+  _write_mimic_template_preview(options, writer, mimic_config, variables, iter_mimic_template_preview(mimic_template_dir, mimic_config, variables, options["command"]["jobs"], max_changes=options["command"]["max_changes"]))
+
+  return True
+
+def preview(options : MimicOptions) -> bool:
+  if options['command']['name'] != "preview":
+    raise Exception("preview: invalid options")
+
+  writer = _PreviewWriter(stdout)
+
+  if options["command"]["format"] == "text":
+    return _preview(options, writer)
+
+  # Only the preview goes to stdout, prompts and logs go to stderr
+  with redirect_stdout(stderr):
+    return _preview(options, writer)
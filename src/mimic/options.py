@@ -13,27 +13,47 @@ class MimicCloneOptions (MimicCommandOptions) :
   out_dir: str
   unsafe_mode: bool
   alias_wallet_file_path: str
+  jobs: Union[int, None]
+  backend: Literal["thread", "process"]
+  cache_dir: Union[str, None]
+  offline: bool
+  answers_file_path: Union[str, None]
+  out_pattern: Union[str, None]
+  output_format: Literal["dir", "tar"]
 
 def NewMimicCloneOptions(base_clone_options : MimicCloneOptions) -> MimicCloneOptions :
   return {
     "name": "clone",
     "mimic_uri": base_clone_options["mimic_uri"],
-    "out_dir": abspath(base_clone_options["out_dir"]) if not base_clone_options.get("out_dir") is None else None,
+    # "-" writes the mimic to stdout as a tar stream
+    "out_dir": abspath(base_clone_options["out_dir"]) if not base_clone_options.get("out_dir") in (None, "-") else None,
     "unsafe_mode": base_clone_options.get("unsafe_mode", False),
-    "alias_wallet_file_path": abspath(base_clone_options["alias_wallet_file_path"]) if not base_clone_options.get("alias_wallet_file_path") is None else abspath(join(dirname(__file__), "..", "..", "wallet.mimic"))
-
+    "alias_wallet_file_path": abspath(base_clone_options["alias_wallet_file_path"]) if not base_clone_options.get("alias_wallet_file_path") is None else abspath(join(dirname(__file__), "..", "..", "wallet.mimic")),
+    "jobs": base_clone_options.get("jobs", None),
+    "backend": base_clone_options.get("backend", None) or "thread",
+    "cache_dir": None if base_clone_options.get("no_cache", False) else abspath(base_clone_options["cache_dir"]) if not base_clone_options.get("cache_dir") is None else abspath(join(dirname(__file__), "..", "..", "cache")),
+    "offline": base_clone_options.get("offline", False),
+    "answers_file_path": abspath(base_clone_options["answers_file_path"]) if not base_clone_options.get("answers_file_path") is None else None,
+    "out_pattern": base_clone_options.get("out_pattern", None),
+    "output_format": "tar" if base_clone_options.get("out_dir") == "-" else base_clone_options.get("output_format", None) or "dir"
    }
 
 class MimicLintOptions (MimicCommandOptions) :
   name: Literal["lint"]
   mimic_template_dir: str
   fix: Union[None, Literal["escape", "clear"]]
+  jobs: Union[int, None]
+  use_cache: bool
+  watch: bool
 
 def NewMimicLintOptions(base_lint_options : MimicLintOptions) -> MimicLintOptions :
   return {
     "name": "lint",
     "mimic_template_dir": abspath(base_lint_options["mimic_template_dir"]) if not base_lint_options.get("mimic_template_dir") is None else getcwd(),
-    "fix": base_lint_options.get("fix", None)
+    "fix": base_lint_options.get("fix", None),
+    "jobs": base_lint_options.get("jobs", None),
+    "use_cache": base_lint_options.get("use_cache", True),
+    "watch": base_lint_options.get("watch", False)
    }
 
 class MimicAliasAction (TypedDict) :
@@ -104,15 +124,51 @@ def NewMimicInitOptions(base_init_options : MimicInitOptions) -> MimicInitOption
 class MimicPreviewOptions (MimicCommandOptions):
   name: Literal["preview"]
   mimic_template_dir : str
+  jobs: Union[int, None]
+  watch: bool
+  format: Literal["text", "diff", "json"]
+  max_changes: Union[int, None]
 
 def NewMimicPreviewOptions(base_preview_options : MimicPreviewOptions) -> MimicPreviewOptions :
   return {
     "name": "preview",
-    "mimic_template_dir": abspath(base_preview_options["mimic_template_dir"]) if not base_preview_options.get("mimic_template_dir") is None else getcwd()
+    "mimic_template_dir": abspath(base_preview_options["mimic_template_dir"]) if not base_preview_options.get("mimic_template_dir") is None else getcwd(),
+    "jobs": base_preview_options.get("jobs", None),
+    "watch": base_preview_options.get("watch", False),
+    "format": base_preview_options.get("format", None) or "text",
+    "max_changes": base_preview_options.get("max_changes", None)
+   }
+
+class MimicIndexOptions (MimicCommandOptions):
+  name: Literal["index"]
+  mimic_template_dir : str
+  jobs: Union[int, None]
+
+def NewMimicIndexOptions(base_index_options : MimicIndexOptions) -> MimicIndexOptions :
+  return {
+    "name": "index",
+    "mimic_template_dir": abspath(base_index_options["mimic_template_dir"]) if not base_index_options.get("mimic_template_dir") is None else getcwd(),
+    "jobs": base_index_options.get("jobs", None)
+   }
+
+class MimicPackOptions (MimicCommandOptions):
+  name: Literal["pack"]
+  mimic_template_dir : str
+  output: Union[str, None]
+  compression: Literal["zlib", "zstd", "none"]
+  jobs: Union[int, None]
+
+def NewMimicPackOptions(base_pack_options : MimicPackOptions) -> MimicPackOptions :
+  return {
+    "name": "pack",
+    "mimic_template_dir": abspath(base_pack_options["mimic_template_dir"]) if not base_pack_options.get("mimic_template_dir") is None else getcwd(),
+    "output": abspath(base_pack_options["output"]) if not base_pack_options.get("output") is None else None,
+    "compression": base_pack_options.get("compression", None) or "zlib",
+    "jobs": base_pack_options.get("jobs", None)
    }
 
 class MimicOptions (TypedDict):
-  command: Union[MimicCloneOptions, MimicLintOptions, MimicAliasOptions, MimicInitOptions, MimicPreviewOptions]
+  command: Union[MimicCloneOptions, MimicLintOptions, MimicAliasOptions, MimicInitOptions, MimicPreviewOptions, MimicIndexOptions, MimicPackOptions]
   working_dir: str
   logger: Logger
 
@@ -0,0 +1,178 @@
+from io import BytesIO
+from json import loads
+from os import makedirs, chmod
+from os.path import isfile, join, basename
+from shutil import copyfileobj
+from tarfile import open as open_tar
+from typing import IO, Iterator, List, Tuple, Union
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from zipfile import ZipFile
+
+from .config import MimicConfig, is_mimic_config_data_well_formed
+from .fs import normalize_relative_path
+
+# Longest extensions first, so that the name of "x.tar.gz" is "x"
+mimic_archive_extensions = [".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tar", ".zip"]
+_mimic_config_file_names = [".mimic", ".mimic.json", ".mimic.jsonc"]
+
+# Content of the entries read before the mimic config that is kept to render them, the archive is read again beyond it
+mimic_archive_buffer_size = 1 << 25
+
+# (path in the archive, is directory, permissions, content of a file, only readable until the next entry)
+MimicArchiveEntry = Tuple[str, bool, int, Union[IO[bytes], None]]
+
+def get_mimic_archive_path(mimic_uri : str) -> Union[str, None] :
+  """
+  Returns the local path of a tar or zip mimic template URI (a path or a file:// URL), None for other URIs.
+  """
+
+  archive_path = url2pathname(urlparse(mimic_uri).path) if mimic_uri.startswith("file://") else mimic_uri
+  if not any(archive_path.endswith(ext) for ext in mimic_archive_extensions) or not isfile(archive_path):
+    return None
+  return archive_path
+
+def get_mimic_archive_name(archive_path : str) -> str :
+  archive_name = basename(archive_path)
+  for ext in mimic_archive_extensions:
+    if archive_name.endswith(ext):
+      return archive_name.removesuffix(ext)
+  return archive_name
+
+def iter_mimic_archive(archive_path : str) -> Iterator[MimicArchiveEntry] :
+  """
+  Yields the directories and regular files of a tar or zip archive in the order they are stored, tar archives are read as a stream.
+  """
+
+  if archive_path.endswith(".zip"):
+    with ZipFile(archive_path) as archive:
+      for info in archive.infolist():
+        entry_path = normalize_relative_path(info.filename, archive_path)
+        # Permissions are only stored by zip tools of unix systems
+        permissions = (info.external_attr >> 16) & 0o7777 or (0o755 if info.is_dir() else 0o644)
+        if info.is_dir():
+          yield (entry_path, True, permissions, None)
+          continue
+        with archive.open(info) as fd:
+          yield (entry_path, False, permissions, fd)
+    return
+
+  with open_tar(archive_path, "r|*") as archive:
+    for member in archive:
+      if member.isdir():
+        yield (normalize_relative_path(member.name, archive_path), True, member.mode & 0o7777, None)
+      elif member.isfile():
+        yield (normalize_relative_path(member.name, archive_path), False, member.mode & 0o7777, archive.extractfile(member))
+
+class MimicArchive:
+  """
+  A mimic archive opened for reading, read once: the entries read while looking for its mimic config are buffered and yielded again by entries(), before the rest of the archive.
+  When they hold more than mimic_archive_buffer_size bytes, entries() reads the archive again from its start instead.
+  """
+
+  archive_path : str
+
+  def __init__(self, archive_path : str):
+    self.archive_path = archive_path
+    self._entries = iter_mimic_archive(archive_path)
+    self._buffered_entries : Union[List[MimicArchiveEntry], None] = []
+    self._buffered_size = 0
+
+  def __enter__(self) -> "MimicArchive" :
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None :
+    self._entries.close()
+
+  def _buffer_entry(self, entry_path : str, is_directory : bool, permissions : int, content : Union[bytes, None]) -> None :
+    if self._buffered_entries == None:
+      return
+    self._buffered_size += len(content or b"")
+    if mimic_archive_buffer_size < self._buffered_size:
+      self._buffered_entries = None
+    else:
+      self._buffered_entries.append((entry_path, is_directory, permissions, BytesIO(content) if content != None else None))
+
+  def read_config(self) -> Union[Tuple[str, str, MimicConfig], None] :
+    """
+    Finds the mimic config of the archive, at its root or in its top level directory, reading the archive up to it.
+    Returns the directory holding the mimic config (the root of the mimic template, "" for the archive root), the mimic config file name and the mimic config.
+    """
+
+    for entry_path, is_directory, permissions, fd in self._entries:
+      mimic_template_root, _, entry_name = entry_path.rpartition("/")
+      if is_directory or not entry_name in _mimic_config_file_names or "/" in mimic_template_root:
+        # Contents beyond the buffer are not needed, they are read again from the archive
+        self._buffer_entry(entry_path, is_directory, permissions, fd.read() if fd != None and self._buffered_entries != None else None)
+        continue
+
+      content = fd.read()
+      self._buffer_entry(entry_path, is_directory, permissions, content)
+      mimic_config_data = loads(content)
+      if not is_mimic_config_data_well_formed(mimic_config_data):
+        return None
+      return (mimic_template_root, entry_name, MimicConfig(mimic_config_data))
+
+    return None
+
+  def entries(self) -> Iterator[MimicArchiveEntry] :
+    """
+    Yields every entry of the archive like iter_mimic_archive, once read_config was called.
+    """
+
+    if self._buffered_entries == None:
+      self._entries.close()
+      yield from iter_mimic_archive(self.archive_path)
+      return
+
+    yield from self._buffered_entries
+    self._buffered_entries = []
+    yield from self._entries
+
+def get_mimic_template_path(entry_path : str, mimic_template_root : str) -> Union[str, None] :
+  """
+  Returns the path of an archive entry relative to the mimic template root, None for entries outside of it.
+  """
+
+  if not mimic_template_root:
+    return entry_path
+  if entry_path == mimic_template_root:
+    return ""
+  if entry_path.startswith(f"{mimic_template_root}/"):
+    return entry_path[len(mimic_template_root) + 1:]
+  return None
+
+def extract_mimic_archive(archive_path : str, out_dir : str) -> bool :
+  """
+  Extracts the mimic template of a mimic archive in out_dir, its top level directory is stripped when it holds the mimic config.
+  """
+
+  try:
+    with MimicArchive(archive_path) as mimic_archive:
+      mimic_archive_config = mimic_archive.read_config()
+      mimic_template_root = mimic_archive_config[0] if mimic_archive_config != None else ""
+
+      makedirs(out_dir)
+      dir_permissions : List[Tuple[str, int]] = []
+      for entry_path, is_directory, permissions, fd in mimic_archive.entries():
+        relative_path = get_mimic_template_path(entry_path, mimic_template_root)
+        if not relative_path:
+          continue
+
+        path = join(out_dir, relative_path)
+        if is_directory:
+          makedirs(path, exist_ok=True)
+          dir_permissions.append((path, permissions))
+        else:
+          makedirs(join(out_dir, relative_path.rpartition("/")[0]), exist_ok=True)
+          with open(path, "wb") as out_fd:
+            copyfileobj(fd, out_fd)
+          chmod(path, permissions)
+
+    # Directories may be read only, their permissions are applied once their content is written, deepest first
+    for dir_path, permissions in sorted(dir_permissions, key=lambda directory: directory[0].count("/"), reverse=True):
+      chmod(dir_path, permissions)
+
+    return True
+  except Exception:
+    return False
@@ -1,14 +1,26 @@
-from os.path import exists
-from shutil import copytree
+from hashlib import sha256
+from os import makedirs, replace
+from os.path import exists, join
+from shutil import copytree, rmtree
+from tempfile import mkdtemp
 
 from . import git
+from .archive import get_mimic_archive_path, extract_mimic_archive
+from .pack import is_mimic_pack, extract_mimic_pack
 
 def check_access_to_mimic_template(mimic_uri : str) -> bool :
-  if exists(mimic_uri):
+  if exists(mimic_uri) or get_mimic_archive_path(mimic_uri) != None:
     return True
   return git.repository_exists(mimic_uri)
 
 def clone_mimic_template(mimic_uri : str, mimic_template_dir : str) -> bool :
+  if is_mimic_pack(mimic_uri):
+    return extract_mimic_pack(mimic_uri, mimic_template_dir)
+
+  mimic_archive_path = get_mimic_archive_path(mimic_uri)
+  if mimic_archive_path != None:
+    return extract_mimic_archive(mimic_archive_path, mimic_template_dir)
+
   if exists(mimic_uri):
     try:
       return copytree(mimic_uri, mimic_template_dir, dirs_exist_ok=False)
@@ -19,4 +31,43 @@ def clone_mimic_template(mimic_uri : str, mimic_template_dir : str) -> bool :
     git.remove_git_folder(mimic_template_dir)
     return True
   
-  return False
\ No newline at end of file
+  return False
+
+def get_cached_mimic_template_path(mimic_uri : str, cache_dir : str) -> str :
+  # Templates of the same repository share its mirror
+  repository, _ = git.split_repository_uri(mimic_uri)
+  return join(cache_dir, f"{git.repository_name(repository)}-{sha256(repository.encode()).hexdigest()[:16]}.git")
+
+def is_mimic_template_cached(mimic_uri : str, cache_dir : str) -> bool :
+  return exists(get_cached_mimic_template_path(mimic_uri, cache_dir))
+
+def update_cached_mimic_template(mimic_uri : str, cache_dir : str) -> bool :
+  """
+  Fetches the latest changes of a git mimic template into its cached mirror, the mirror is created on first use.
+  """
+
+  cached_mimic_template_path = get_cached_mimic_template_path(mimic_uri, cache_dir)
+  if exists(cached_mimic_template_path):
+    return git.fetch_mirror(cached_mimic_template_path)
+
+  # The mirror is built aside and moved in place once complete so that concurrent clones never see a partial mirror
+  makedirs(cache_dir, exist_ok=True)
+  pending_mirror_dir = mkdtemp(prefix=".mimic-", suffix=".tmp", dir=cache_dir)
+  try:
+    if not git.mirror_repository(mimic_uri, pending_mirror_dir):
+      return False
+    try:
+      replace(pending_mirror_dir, cached_mimic_template_path)
+    except OSError:
+      # Another clone cached the same template first
+      pass
+    return exists(cached_mimic_template_path)
+  finally:
+    rmtree(pending_mirror_dir, ignore_errors=True)
+
+def clone_cached_mimic_template(mimic_uri : str, cache_dir : str, mimic_template_dir : str) -> bool :
+  if git.clone_mirror(get_cached_mimic_template_path(mimic_uri, cache_dir), mimic_template_dir, git.split_repository_uri(mimic_uri)[1]):
+    git.remove_git_folder(mimic_template_dir)
+    return True
+
+  return False
@@ -1,8 +1,12 @@
-from jsonschema import validate, Draft202012Validator
 from json import load, dump
 from os.path import join, dirname
 from typing import Union, Literal, List, Dict, Any
 
+# Folder of a mimic template where mimic keeps its caches, it is never part of a mimic
+mimic_cache_dir_name = ".mimic-cache"
+# File of a mimic template holding its placeholders offsets (see mimic index), it is never part of a mimic either
+mimic_index_file_name = ".mimic.index"
+
 class MimicGitConfig:
   enabled: bool = False
   main_branch: str = "main"
@@ -14,6 +18,7 @@ class MimicGitConfig:
     self.enabled = validated_raw.get("enabled", False)
     self.main_branch = validated_raw.get("main_branch", "main")
 
+MimicVariableType = ["string", "number", "boolean", "regex", "choice"]
 MimicVariableTypeType = Literal["string", "number", "boolean", "regex", "choice"]
 
 class MimicVariable:
@@ -64,6 +69,7 @@ class MimicVariable:
   
 class MimicTemplateConfig:
   ignorePatterns: List[str] = []
+  rawPatterns: List[str] = []
   variables: Dict[str, MimicVariable] = {}
 
   def __init__(self, validated_raw : Union[Dict[str, Any], None]):
@@ -71,6 +77,8 @@ class MimicTemplateConfig:
       return
     
     self.ignorePatterns = validated_raw.get("ignorePatterns", [])
+    self.rawPatterns = validated_raw.get("rawPatterns", [])
+    self.variables = {}
 
     if raw_variables := validated_raw.get("variables", {}):
       for v in raw_variables.keys():
@@ -79,19 +87,37 @@ class MimicTemplateConfig:
 MimicHookWhen = ["pre_template_injection", "post_template_injection"] 
 MimicHookWhenType = Literal["pre_template_injection", "post_template_injection"]
 
+class MimicHookCacheConfig:
+  inputs: List[str]
+  outputs: List[str]
+
+  def __init__(self, validated_raw : Dict[str, Any]):
+    self.inputs = validated_raw.get("inputs", [])
+    self.outputs = validated_raw["outputs"]
+
 class MimicHookConfig:
+  id: Union[str, None]
   name: Union[str, None]
   when: MimicHookWhenType
   steps: List[str] = []
   ignore_error: bool
   ignore_user_skip: bool
+  needs: List[str]
+  parallel: bool
+  timeout: Union[float, None]
+  cache: Union[MimicHookCacheConfig, None]
 
   def __init__(self, validated_raw : Dict[str, Any]):
+    self.id = validated_raw.get("id")
     self.name = validated_raw.get("name")
     self.when = validated_raw["when"]
     self.steps = validated_raw["steps"]
     self.ignore_error = validated_raw.get("ignore_error", False)
     self.ignore_user_skip = validated_raw.get("ignore_user_skip", False)
+    self.needs = validated_raw.get("needs", [])
+    self.parallel = validated_raw.get("parallel", False)
+    self.timeout = validated_raw.get("timeout")
+    self.cache = MimicHookCacheConfig(validated_raw["cache"]) if "cache" in validated_raw else None
   
 class MimicConfig:
   validated_raw: Dict[str, Any]
@@ -120,15 +146,76 @@ class MimicConfigIssue:
     self.property = property
     self.reason = reason
 
-def is_mimic_config_file_data_valid(mimic_config_file_path : str) -> List[MimicConfigIssue]:
-  with open(join(dirname(__file__), "..", "..", "..", ".mimic.0.5.1.schema.json"), "r") as fd:
-    schema = load(fd)
+mimic_config_schema_file_path = join(dirname(__file__), "..", "..", "..", ".mimic.0.5.1.schema.json")
+
+# Built on first use, jsonschema is slow to import and only needed when a config is fully validated
+_mimic_config_validator = None
+
+def _get_mimic_config_validator():
+  global _mimic_config_validator
+
+  if _mimic_config_validator == None:
+    from jsonschema import Draft202012Validator
+
+    with open(mimic_config_schema_file_path, "r") as fd:
+      _mimic_config_validator = Draft202012Validator(load(fd))
+
+  return _mimic_config_validator
+
+def _is_str_list(value : Any) -> bool:
+  return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+def is_mimic_config_data_well_formed(mimic_config_file_data : Any) -> bool:
+  """
+  Checks the parts of a mimic config that MimicConfig relies on, without loading the schema.
+  Unlike the schema, unknown properties and some constraints on defaults are not checked (see mimic lint).
+  """
+
+  if not isinstance(mimic_config_file_data, dict):
+    return False
+
+  raw_git = mimic_config_file_data.get("git", {})
+  if not isinstance(raw_git, dict) or not isinstance(raw_git.get("enabled", False), bool) or not isinstance(raw_git.get("main_branch", ""), str):
+    return False
+
+  raw_template = mimic_config_file_data.get("template", {})
+  if not isinstance(raw_template, dict) or not _is_str_list(raw_template.get("ignorePatterns", [])) or not _is_str_list(raw_template.get("rawPatterns", [])):
+    return False
+
+  raw_variables = raw_template.get("variables", {})
+  if not isinstance(raw_variables, dict):
+    return False
+
+  for raw_variable in raw_variables.values():
+    if not isinstance(raw_variable, dict) or not raw_variable.get("type") in MimicVariableType:
+      return False
+    if raw_variable["type"] == "regex" and not isinstance(raw_variable.get("item"), str):
+      return False
+    if raw_variable["type"] == "choice" and (not _is_str_list(raw_variable.get("item")) or len(raw_variable["item"]) < 1):
+      return False
+
+  raw_hooks = mimic_config_file_data.get("hooks", [])
+  if not isinstance(raw_hooks, list):
+    return False
 
+  for raw_hook in raw_hooks:
+    if not isinstance(raw_hook, dict) or not raw_hook.get("when") in MimicHookWhen or not _is_str_list(raw_hook.get("steps")) or len(raw_hook["steps"]) < 1:
+      return False
+    if not isinstance(raw_hook.get("id", ""), str) or not _is_str_list(raw_hook.get("needs", [])) or not isinstance(raw_hook.get("parallel", False), bool):
+      return False
+    if not raw_hook.get("timeout") is None and (not isinstance(raw_hook["timeout"], (int, float)) or isinstance(raw_hook["timeout"], bool) or raw_hook["timeout"] <= 0):
+      return False
+    if "cache" in raw_hook and (not isinstance(raw_hook["cache"], dict) or not _is_str_list(raw_hook["cache"].get("inputs", [])) or not _is_str_list(raw_hook["cache"].get("outputs"))):
+      return False
+
+  return True
+
+def is_mimic_config_file_data_valid(mimic_config_file_path : str) -> List[MimicConfigIssue]:
   try:
     with open(mimic_config_file_path, "r") as fd:
       mimic_config_file_data = load(fd)
 
-      validator = Draft202012Validator(schema)
+      validator = _get_mimic_config_validator()
       validator_errors = sorted(validator.iter_errors(mimic_config_file_data), key=lambda e: e.path)
       format_issues = []
 
@@ -139,15 +226,21 @@ def is_mimic_config_file_data_valid(mimic_config_file_path : str) -> List[MimicC
   except Exception as e:
     return [MimicConfigIssue(mimic_config_file_path, e)]
 
-def load_mimic_config(mimic_config_file_path : str) -> Union[MimicConfig, None]:
-  try:
-    with open(join(dirname(__file__), "..", "..", "..", ".mimic.0.5.1.schema.json"), "r") as fd:
-      schema = load(fd)
+def load_mimic_config(mimic_config_file_path : str, validate_schema : bool = True) -> Union[MimicConfig, None]:
+  """
+  Loads a mimic config, validated against the mimic schema or, when validate_schema is False, only checked to be well formed.
+  """
 
+  try:
     with open(mimic_config_file_path, "r") as fd:
       mimic_config_file_data = load(fd)
-      validate(mimic_config_file_data, schema)
-      return MimicConfig(mimic_config_file_data)
+
+    if validate_schema:
+      _get_mimic_config_validator().validate(mimic_config_file_data)
+    elif not is_mimic_config_data_well_formed(mimic_config_file_data):
+      return None
+
+    return MimicConfig(mimic_config_file_data)
   except Exception:
     return None
 
@@ -164,11 +257,39 @@ class MimicFileContentPreview:
   raw : str
   parsed: str
   line: int
+  # False for the last line of a file that does not end with a line break
+  has_line_break: bool
 
-  def __init__(self, raw : str, parsed: str, line: int):
+  def __init__(self, raw : str, parsed: str, line: int, has_line_break : bool = True):
     self.raw = raw
     self.parsed = parsed
     self.line = line
+    self.has_line_break = has_line_break
+
+class MimicPathPreview:
+  """
+  Preview of a single path of a mimic template: its rendered path and, for files, the lines rendering changes.
+  """
+
+  source_path: str
+  parsed_path: str
+  relative_path: str
+  parsed_relative_path: str
+  is_directory: bool
+  changes: List[MimicFileContentPreview]
+  hidden_change_count: int
+
+  def __init__(self, source_path : str, parsed_path : str, relative_path : str, parsed_relative_path : str, is_directory : bool = False, changes : Union[List[MimicFileContentPreview], None] = None, hidden_change_count : int = 0):
+    self.source_path = source_path
+    self.parsed_path = parsed_path
+    self.relative_path = relative_path
+    self.parsed_relative_path = parsed_relative_path
+    self.is_directory = is_directory
+    self.changes = changes or []
+    self.hidden_change_count = hidden_change_count
+
+  def is_renamed(self) -> bool :
+    return self.source_path != self.parsed_path
 
 class MimicPreview:
 
@@ -1,7 +1,15 @@
-from os import remove, getcwd
-from os.path import exists, abspath, join
-from glob import glob
-from typing import List, Union
+from hashlib import sha256
+from os import remove, getcwd, replace, sep, scandir, chmod, umask, DirEntry
+from os.path import exists, abspath, join, getsize, dirname
+from re import compile, escape
+from shutil import copymode, copystat, copy2, copyfileobj
+from tempfile import NamedTemporaryFile
+from typing import List, Union, Iterator, Iterable, IO, Tuple, Set, Dict
+
+try:
+  from os import copy_file_range
+except ImportError:
+  copy_file_range = None
 
 def resolve_existing_path(possible_paths : List[str]) -> Union[str, None]:
   for path in possible_paths:
@@ -36,17 +44,308 @@ def remove_ignore(file_path : str) -> None :
   except OSError:
     pass
 
-def ignore_glob(ignorePatterns : List[str], root_dir : str = getcwd(), include_hidden : bool = False) -> List[str]:
-  ignoreMatchs = {}
-  for pattern in ignorePatterns:
-    for file_path in glob(pattern, root_dir=root_dir, include_hidden=include_hidden, recursive=True):
-      ignoreMatchs[file_path] = True
+def _read_umask() -> int :
+  current_umask = umask(0)
+  umask(current_umask)
+  return current_umask
+
+# The umask can only be read by setting it, which affects the whole process: it is read once at import, before any thread or subprocess is started
+_default_file_permissions = 0o666 & ~_read_umask()
+
+class AtomicFileWriter:
+  """
+  Context manager yielding a temporary file, created next to file_path, that replaces file_path once the block exits without error.
+  The temporary file takes the permissions of mode_source_path (defaults to file_path when it exists), or the permissions of a new file.
+  Calling discard() inside the block leaves file_path untouched.
+  """
+
+  def __init__(self, file_path : str, mode_source_path : Union[str, None] = None, mode : str = "w", newline : Union[str, None] = None):
+    self.file_path = file_path
+    self.mode_source_path = mode_source_path or file_path
+    self.mode = mode
+    self.newline = newline
+    self.discarded = False
+
+  def discard(self) -> None :
+    self.discarded = True
+
+  def __enter__(self) -> IO :
+    self._temporary_fd = NamedTemporaryFile(self.mode, dir=dirname(self.file_path) or getcwd(), prefix=".mimic-", suffix=".tmp", delete=False, newline=self.newline)
+    return self._temporary_fd
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None :
+    self._temporary_fd.close()
+
+    if exc_type is not None or self.discarded:
+      remove_ignore(self._temporary_fd.name)
+      return
+
+    try:
+      if exists(self.mode_source_path):
+        copymode(self.mode_source_path, self._temporary_fd.name)
+      else:
+        # Temporary files are only readable by their owner
+        chmod(self._temporary_fd.name, _default_file_permissions)
+      replace(self._temporary_fd.name, self.file_path)
+    except BaseException:
+      remove_ignore(self._temporary_fd.name)
+      raise
+
+def copy_file(source_file_path : str, destination_file_path : str) -> None :
+  """
+  Copies a file and its metadata like shutil.copy2.
+  Where available, data is copied by the kernel with copy_file_range, which reflinks the file on filesystems that support it.
+  """
+
+  if copy_file_range is None:
+    copy2(source_file_path, destination_file_path)
+    return
+
+  with open(source_file_path, "rb") as source_fd, open(destination_file_path, "wb") as destination_fd:
+    try:
+      while 0 < copy_file_range(source_fd.fileno(), destination_fd.fileno(), 1 << 30):
+        pass
+    except OSError:
+      source_fd.seek(0)
+      destination_fd.seek(0)
+      destination_fd.truncate()
+      copyfileobj(source_fd, destination_fd)
+
+  copystat(source_file_path, destination_file_path)
+
+def is_binary_file(file_path : str, block_size : int = 8192) -> bool :
+  """
+  Sniffs the first block of a file: text files never contain NUL bytes.
+  """
+
+  with open(file_path, "rb") as fd:
+    return b"\x00" in fd.read(block_size)
+
+def file_contains(file_path : str, needle : bytes, block_size : int = 1 << 16) -> bool :
+  """
+  Searches needle in the raw bytes of a file without decoding it, reading one block at a time.
+  """
+
+  with open(file_path, "rb") as fd:
+    previous_block_tail = b""
+    while block := fd.read(block_size):
+      if needle in previous_block_tail + block[:len(needle) - 1] or needle in block:
+        return True
+      previous_block_tail = block[1 - len(needle):] if 1 < len(needle) else b""
+  return False
+
+def hash_file(file_path : str, block_size : int = 1 << 16) -> str :
+  """
+  Returns the sha256 hex digest of a file content, read one block at a time.
+  """
+
+  digest = sha256()
+  with open(file_path, "rb") as fd:
+    while block := fd.read(block_size):
+      digest.update(block)
+  return digest.hexdigest()
+
+def _translate_glob_component(component : str) -> str :
+  regex = ""
+  i = 0
+  while i < len(component):
+    c = component[i]
+    if c == "*":
+      regex += "[^/]*"
+    elif c == "?":
+      regex += "[^/]"
+    elif c == "[" and (class_end := component.find("]", i + 2)) != -1:
+      class_content = component[i + 1:class_end].replace("\\", "\\\\")
+      if class_content.startswith("!"):
+        class_content = "^" + class_content[1:]
+      regex += f"[{class_content}]"
+      i = class_end
+    else:
+      regex += escape(c)
+    i += 1
+  return regex
+
+def translate_glob(pattern : str) -> str :
+  """
+  Translates a recursive glob pattern into a regex matching paths relative to the glob root, using "/" as separator.
+  """
+
+  if sep != "/":
+    pattern = pattern.replace(sep, "/")
+
+  components = [c for c in pattern.split("/") if c not in ("", ".")]
+  regex = ""
+  for i in range(len(components)):
+    is_last_component = i == len(components) - 1
+    if components[i] == "**":
+      regex += ".*" if is_last_component else "(?:.*/)?"
+    else:
+      regex += _translate_glob_component(components[i]) + ("" if is_last_component else "/")
+  return regex
+
+class GlobMatcher:
+  """
+  Matches relative paths against a list of recursive glob patterns with a single compiled regex.
+  """
+
+  def __init__(self, patterns : List[str]):
+    self.patterns = patterns
+    self._regex = compile("|".join(f"(?:{translate_glob(p)})" for p in patterns)) if len(patterns) else None
+
+    # "dir/**" matches everything below dir, so dir does not need to be walked
+    tree_patterns = []
+    for p in patterns:
+      components = [c for c in p.replace(sep, "/").split("/") if c not in ("", ".")]
+      if len(components) and components[-1] == "**":
+        tree_patterns.append(translate_glob("/".join(components[:-1])) if 1 < len(components) else ".*")
+    self._tree_regex = compile("|".join(f"(?:{p})" for p in tree_patterns)) if len(tree_patterns) else None
+
+  def match(self, relative_path : str) -> bool :
+    if self._regex is None:
+      return False
+    if sep != "/":
+      relative_path = relative_path.replace(sep, "/")
+    return self._regex.fullmatch(relative_path) is not None
+
+  def match_tree(self, relative_dir_path : str) -> bool :
+    """
+    Whether every path below relative_dir_path is matched.
+    """
+
+    if self._tree_regex is None:
+      return False
+    if sep != "/":
+      relative_dir_path = relative_dir_path.replace(sep, "/")
+    return self._tree_regex.fullmatch(relative_dir_path) is not None
+
+def get_file_size(file_path : str) -> int :
+  try:
+    return getsize(file_path)
+  except OSError:
+    return 0
+
+def normalize_relative_path(relative_path : str, source : str) -> str :
+  """
+  Normalizes a "/" separated relative path read from source (eg a mimic pack or an archive), "" being its root.
+  Raises on absolute paths and on paths going up, which would be written outside of the directory they are extracted to.
+  """
+
+  slashed_path = relative_path.replace("\\", "/")
+  normalized_path = slashed_path.strip("/")
+  while normalized_path.startswith("./"):
+    normalized_path = normalized_path[2:]
+  # Drive letters make paths absolute on Windows
+  if slashed_path.startswith("/") or normalized_path[1:2] == ":" or ".." in normalized_path.split("/"):
+    raise Exception(f"unsafe path {relative_path} in {source}")
+  return "" if normalized_path == "." else normalized_path
+
+def check_file_name(name : str, source : str) -> str :
+  """
+  Returns name, rendered from source, when it names a single file or directory.
+  Raises on "", ".", ".." and names with separators, which would be written elsewhere than in their parent directory.
+  """
+
+  if name in ("", ".", "..") or "/" in name or sep in name:
+    raise Exception(f"unsafe name {name} rendered from {source}")
+  return name
+
+def get_relative_path(path : str, root_dir : str) -> str :
+  """
+  Cheap relpath for paths yielded by ignore_scandir(root_dir=root_dir).
+  """
+
+  return path[len(join(root_dir, "")):]
+
+def _scandir_tree(dir_path : str, relative_dir_path : str, ignore_matcher : GlobMatcher, include_hidden : bool, excluded_relative_paths : Set[str]) -> Iterator[Tuple[DirEntry, str, bool]]:
+  try:
+    with scandir(dir_path) as it:
+      entries = list(it)
+  except OSError:
+    return
+
+  for entry in entries:
+    if not include_hidden and entry.name.startswith("."):
+      continue
+
+    relative_path = f"{relative_dir_path}{entry.name}"
+    if relative_path in excluded_relative_paths:
+      continue
 
-  notIgnoredMatchs = []
-  for file_path in glob("**", root_dir=root_dir, recursive=True, include_hidden=include_hidden):
-    if file_path in ignoreMatchs:
+    yield (entry, relative_path, ignore_matcher.match(relative_path))
+
+    try:
+      is_dir = entry.is_dir()
+    except OSError:
+      is_dir = False
+
+    if is_dir and not ignore_matcher.match_tree(relative_path):
+      yield from _scandir_tree(entry.path, f"{relative_path}/", ignore_matcher, include_hidden, excluded_relative_paths)
+
+def is_relative_path_below(relative_path : str, relative_dir_paths : Iterable[str]) -> bool :
+  """
+  Whether relative_path is one of relative_dir_paths or is inside one of them ("/" separated paths).
+  """
+
+  return any(relative_path == p or relative_path.startswith(f"{p}/") for p in relative_dir_paths)
+
+def _scandir_paths(root_dir : str, relative_paths : Iterable[str], ignore_matcher : GlobMatcher, include_hidden : bool, excluded_relative_paths : Set[str]) -> Iterator[Tuple[DirEntry, str, bool]]:
+  # Paths inside another given path are walked along with it
+  walked_paths : List[str] = []
+  for relative_path in sorted(set(relative_paths)):
+    if not is_relative_path_below(relative_path, walked_paths[-1:]):
+      walked_paths.append(relative_path)
+
+  # Entries are listed once per parent directory, the walk skips paths a full walk would skip
+  walked_paths_by_parent : Dict[str, Set[str]] = {}
+  for relative_path in walked_paths:
+    components = relative_path.split("/")
+    if not include_hidden and any(c.startswith(".") for c in components):
       continue
-    file_path = join(root_dir, file_path)
-    notIgnoredMatchs.append(file_path)
+    ancestor_paths = ["/".join(components[:i]) for i in range(1, len(components))]
+    if relative_path in excluded_relative_paths or any(p in excluded_relative_paths or ignore_matcher.match_tree(p) for p in ancestor_paths):
+      continue
+    parent_path, _, name = relative_path.rpartition("/")
+    walked_paths_by_parent.setdefault(parent_path, set()).add(name)
+
+  for parent_path, names in walked_paths_by_parent.items():
+    try:
+      with scandir(join(root_dir, parent_path) if parent_path else root_dir) as it:
+        entries = [entry for entry in it if entry.name in names]
+    except OSError:
+      continue
+
+    for entry in entries:
+      relative_path = f"{parent_path}/{entry.name}" if parent_path else entry.name
+      yield (entry, relative_path, ignore_matcher.match(relative_path))
+
+      try:
+        is_dir = entry.is_dir()
+      except OSError:
+        is_dir = False
+
+      if is_dir and not ignore_matcher.match_tree(relative_path):
+        yield from _scandir_tree(entry.path, f"{relative_path}/", ignore_matcher, include_hidden, excluded_relative_paths)
+
+def scandir_tree(ignore_matcher : GlobMatcher, root_dir : Union[str, None] = None, include_hidden : bool = False, excluded_relative_paths : Set[str] = set(), relative_paths : Union[Iterable[str], None] = None) -> Iterator[Tuple[DirEntry, str, bool]]:
+  """
+  Walks root_dir once and lazily yields (entry, relative path, is ignored) for every path, directories before their content.
+  Directories whose whole content is ignored (eg "node_modules/**") are yielded but not walked.
+  Excluded paths (relative to root_dir, "/" separated) are neither yielded nor walked.
+  When relative_paths is given, only these paths (those that still exist) and the content of directories among them are walked.
+  """
+
+  if relative_paths is None:
+    yield from _scandir_tree(root_dir or getcwd(), "", ignore_matcher, include_hidden, excluded_relative_paths)
+  else:
+    yield from _scandir_paths(root_dir or getcwd(), relative_paths, ignore_matcher, include_hidden, excluded_relative_paths)
+
+def ignore_scandir(ignorePatterns : List[str], root_dir : Union[str, None] = None, include_hidden : bool = False, excluded_relative_paths : Set[str] = set(), relative_paths : Union[Iterable[str], None] = None) -> Iterator[DirEntry]:
+  """
+  Walks root_dir once and lazily yields an entry for every path that does not match ignorePatterns, directories before their content.
+  Directories whose whole content is ignored (eg "node_modules/**") and excluded paths are not walked at all.
+  When relative_paths is given, only these paths and their content are walked (see scandir_tree).
+  """
 
-  return notIgnoredMatchs
+  for entry, _, is_ignored in scandir_tree(GlobMatcher(ignorePatterns), root_dir, include_hidden, excluded_relative_paths, relative_paths):
+    if not is_ignored:
+      yield entry
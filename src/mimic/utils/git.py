@@ -1,34 +1,110 @@
-from shutil import rmtree
+from shutil import rmtree, move
 from os import sep, environ
-from os.path import basename
+from os.path import basename, dirname, join, isdir
 from subprocess import run, PIPE
-from typing import Union  
+from tempfile import mkdtemp
+from typing import Union, Tuple, List
+
+def split_repository_uri(repository_uri : str) -> Tuple[str, Union[str, None]] :
+  """
+  Splits a "<repository>#<path/to/template>" URI, used for repositories holding several templates, into the repository and the template path.
+  """
+
+  repository, _, template_path = repository_uri.partition("#")
+  return (repository, template_path.strip("/") or None)
 
 def repository_exists(repository_uri : str) -> bool :
   env = environ.copy()
   env["GIT_ASKPASS"] = "echo"
 
   return run(
-    ["git", "ls-remote", repository_uri],
+    ["git", "ls-remote", split_repository_uri(repository_uri)[0]],
     env=env,
     stdout=PIPE,
     stderr=PIPE
   ).returncode == 0
 
 def repository_name(repository_uri : str) -> bool :
-  return basename(repository_uri).removesuffix(".git")  
+  repository, template_path = split_repository_uri(repository_uri)
+  if template_path != None:
+    return basename(template_path)
+  return basename(repository).removesuffix(".git")  
+
+def _clone_template_path(clone_args : List[str], template_path : str, out_dir : str) -> bool :
+  """
+  Runs a sparse clone (clone_args) next to out_dir, checks out template_path only and moves it to out_dir.
+  """
+
+  env = environ.copy()
+  env["GIT_ASKPASS"] = "echo"
+
+  checkout_dir = mkdtemp(prefix=".mimic-", suffix=".tmp", dir=dirname(out_dir))
+  try:
+    if run(clone_args + [checkout_dir], env=env, stdout=PIPE, stderr=PIPE).returncode != 0:
+      return False
+
+    if run(["git", "sparse-checkout", "set", template_path], cwd=checkout_dir, env=env, stdout=PIPE, stderr=PIPE).returncode != 0:
+      return False
+
+    if not isdir(join(checkout_dir, template_path)):
+      return False
+
+    move(join(checkout_dir, template_path), out_dir)
+    return True
+  finally:
+    rmtree(checkout_dir, ignore_errors=True)
 
 def clone_repository(repository_uri : str, out_dir : str) -> bool :
   env = environ.copy()
   env["GIT_ASKPASS"] = "echo"
 
+  repository, template_path = split_repository_uri(repository_uri)
+
+  # Only the latest tree is needed, and blobs outside of the template path are never downloaded
+  if template_path != None:
+    return _clone_template_path(["git", "clone", "--depth", "1", "--filter=blob:none", "--sparse", "--quiet", repository], template_path, out_dir)
+
   return run(
-    ["git", "clone", repository_uri, out_dir],
+    ["git", "clone", "--depth", "1", "--quiet", repository, out_dir],
     env=env,
     stdout=PIPE,
     stderr=PIPE
   ).returncode == 0
 
+def mirror_repository(repository_uri : str, mirror_dir : str) -> bool :
+  env = environ.copy()
+  env["GIT_ASKPASS"] = "echo"
+
+  return run(
+    ["git", "clone", "--mirror", "--depth", "1", "--quiet", split_repository_uri(repository_uri)[0], mirror_dir],
+    env=env,
+    stdout=PIPE,
+    stderr=PIPE
+  ).returncode == 0
+
+def fetch_mirror(mirror_dir : str) -> bool :
+  env = environ.copy()
+  env["GIT_ASKPASS"] = "echo"
+
+  return run(
+    ["git", "fetch", "--prune", "--depth", "1", "--quiet"],
+    cwd=mirror_dir,
+    env=env,
+    stdout=PIPE,
+    stderr=PIPE
+  ).returncode == 0
+
+def clone_mirror(mirror_dir : str, out_dir : str, template_path : Union[str, None] = None) -> bool :
+  # Objects are borrowed from the mirror instead of being copied, the .git folder is removed right after anyway
+  if template_path != None:
+    return _clone_template_path(["git", "clone", "--shared", "--sparse", "--quiet", mirror_dir], template_path, out_dir)
+
+  return run(
+    ["git", "clone", "--shared", "--quiet", mirror_dir, out_dir],
+    stdout=PIPE,
+    stderr=PIPE
+  ).returncode == 0
+
 def remove_git_folder(mimic_template_dir : str) :
   rmtree(f"{mimic_template_dir}{sep}.git/", ignore_errors=True)
 
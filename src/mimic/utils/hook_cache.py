@@ -0,0 +1,186 @@
+from hashlib import sha256
+from json import load, dump
+from os import makedirs, readlink, symlink, chmod, lstat, walk, scandir, sep
+from os.path import join, exists, lexists, isdir, islink, relpath, dirname
+from shutil import rmtree
+from stat import S_IMODE
+from typing import List, Dict, Any, Union
+
+from .fs import GlobMatcher, AtomicFileWriter, scandir_tree, copy_file, hash_file, remove_ignore, normalize_relative_path, is_relative_path_below
+
+# A hook cache holds the outputs of hooks, keyed by their rendered steps, their outputs and the content of their inputs:
+#  <hooks_cache_dir>/entries/<key>.json lists the outputs of a hook run (directories, symlinks and files)
+#  <hooks_cache_dir>/objects/<sha256> holds file contents, shared between every entry
+
+# Bumped whenever the layout of entries changes, keys of older entries are then never looked up again
+hook_cache_entry_version = 2
+
+def _get_input_walk_paths(mimic_dir : str, input_patterns : List[str]) -> Union[List[str], None] :
+  """
+  Returns the paths of mimic_dir to walk to find the files matching input_patterns: the leading directories of the patterns without wildcards.
+  Returns None when the whole mimic_dir must be walked, for patterns starting with "**" or with a wildcard directory.
+  """
+
+  walk_paths : List[str] = []
+  root_names : Union[List[str], None] = None
+  for input_pattern in input_patterns:
+    components = [c for c in input_pattern.replace(sep, "/").split("/") if c not in ("", ".")]
+    literal_components = []
+    for component in components:
+      if any(c in component for c in "*?["):
+        break
+      literal_components.append(component)
+
+    if ".." in literal_components:
+      # Paths outside of mimic_dir are never matched
+      continue
+    if len(literal_components):
+      walk_paths.append("/".join(literal_components))
+    elif len(components) == 1 and components[0] != "**":
+      # Wildcard file names at the root only need the root listing
+      if root_names == None:
+        with scandir(mimic_dir) as it:
+          root_names = [entry.name for entry in it]
+      component_matcher = GlobMatcher(components)
+      walk_paths.extend(name for name in root_names if component_matcher.match(name))
+    elif len(components):
+      return None
+
+  return walk_paths
+
+def normalize_hook_output_path(output_path : str) -> Union[str, None] :
+  """
+  Returns a hook output path normalized relative to the mimic, None for paths that are empty, absolute or outside of the mimic.
+  """
+
+  try:
+    normalized_output_path = normalize_relative_path(output_path, "hook outputs")
+  except Exception:
+    return None
+  return normalized_output_path or None
+
+def get_hook_cache_key(mimic_dir : str, rendered_steps : List[str], input_patterns : List[str], output_paths : List[str]) -> str :
+  """
+  Hashes the rendered steps and output paths of a hook along with the path and content of every file of mimic_dir matching input_patterns.
+  """
+
+  input_matcher = GlobMatcher(input_patterns)
+  input_walk_paths = _get_input_walk_paths(mimic_dir, input_patterns)
+  input_file_paths = sorted(
+    relative_path for entry, relative_path, _ in scandir_tree(GlobMatcher([]), mimic_dir, True, {".git"}, input_walk_paths) if not entry.is_dir() and input_matcher.match(relative_path)
+  )
+
+  digest = sha256(f"version\0{hook_cache_entry_version}\0".encode())
+  for step in rendered_steps:
+    digest.update(f"step\0{step}\0".encode())
+  for output_path in output_paths:
+    digest.update(f"output\0{output_path}\0".encode())
+  for input_file_path in input_file_paths:
+    digest.update(f"input\0{input_file_path}\0{hash_file(join(mimic_dir, input_file_path))}\0".encode())
+
+  return digest.hexdigest()
+
+def _get_entry_path(hooks_cache_dir : str, cache_key : str) -> str :
+  return join(hooks_cache_dir, "entries", f"{cache_key}.json")
+
+def _get_object_path(hooks_cache_dir : str, object_hash : str) -> str :
+  return join(hooks_cache_dir, "objects", object_hash)
+
+def _remove_output(output_path : str) -> None :
+  if isdir(output_path) and not islink(output_path):
+    rmtree(output_path)
+  else:
+    remove_ignore(output_path)
+
+def restore_hook_outputs(hooks_cache_dir : str, cache_key : str, mimic_dir : str) -> bool :
+  """
+  Restores in mimic_dir the outputs cached for cache_key, returns False when nothing is cached for it or when its entry has paths outside of mimic_dir.
+  """
+
+  entry_path = _get_entry_path(hooks_cache_dir, cache_key)
+  if not exists(entry_path):
+    return False
+
+  try:
+    with open(entry_path, "r") as fd:
+      cache_entry = load(fd)
+
+    # Outputs are removed and written in the mimic, entries with paths outside of their outputs are refused
+    output_paths = cache_entry["outputs"]
+    if any(normalize_hook_output_path(output_path) != output_path for output_path in output_paths):
+      return False
+    if not all(is_relative_path_below(normalize_hook_output_path(output["path"]) or "", output_paths) for output in cache_entry["files"]):
+      return False
+
+    for output_path in output_paths:
+      _remove_output(join(mimic_dir, output_path))
+
+    for output in cache_entry["files"]:
+      output_path = join(mimic_dir, output["path"])
+      match output["type"]:
+        case "dir":
+          makedirs(output_path, exist_ok=True)
+        case "symlink":
+          makedirs(dirname(output_path), exist_ok=True)
+          symlink(output["target"], output_path)
+        case "file":
+          makedirs(dirname(output_path), exist_ok=True)
+          copy_file(_get_object_path(hooks_cache_dir, output["hash"]), output_path)
+          chmod(output_path, output["mode"])
+    return True
+  except Exception:
+    return False
+
+def _get_output_files(mimic_dir : str, output_path : str) -> List[Dict[str, Any]] :
+  absolute_output_path = join(mimic_dir, output_path)
+
+  if islink(absolute_output_path):
+    return [{ "type": "symlink", "path": output_path, "target": readlink(absolute_output_path) }]
+
+  if not isdir(absolute_output_path):
+    return [{ "type": "file", "path": output_path, "mode": S_IMODE(lstat(absolute_output_path).st_mode) }]
+
+  output_files = []
+  for dir_path, dir_names, file_names in walk(absolute_output_path):
+    output_files.append({ "type": "dir", "path": relpath(dir_path, mimic_dir) })
+    for name in dir_names + file_names:
+      if islink(join(dir_path, name)):
+        output_files.append({ "type": "symlink", "path": relpath(join(dir_path, name), mimic_dir), "target": readlink(join(dir_path, name)) })
+      elif not name in dir_names:
+        output_files.append({ "type": "file", "path": relpath(join(dir_path, name), mimic_dir), "mode": S_IMODE(lstat(join(dir_path, name)).st_mode) })
+  return output_files
+
+def save_hook_outputs(hooks_cache_dir : str, cache_key : str, mimic_dir : str, output_paths : List[str]) -> bool :
+  """
+  Caches the outputs of a hook run for cache_key, returns False (and caches nothing) when an output is missing, empty, absolute or outside of mimic_dir.
+  """
+
+  if any(normalize_hook_output_path(output_path) != output_path for output_path in output_paths):
+    return False
+  if not all(lexists(join(mimic_dir, output_path)) for output_path in output_paths):
+    return False
+
+  try:
+    makedirs(join(hooks_cache_dir, "entries"), exist_ok=True)
+    makedirs(join(hooks_cache_dir, "objects"), exist_ok=True)
+
+    output_files : List[Dict[str, Any]] = []
+    for output_path in output_paths:
+      output_files.extend(_get_output_files(mimic_dir, output_path))
+
+    for output in output_files:
+      if output["type"] != "file":
+        continue
+      output["hash"] = hash_file(join(mimic_dir, output["path"]))
+      object_path = _get_object_path(hooks_cache_dir, output["hash"])
+      if not exists(object_path):
+        with AtomicFileWriter(object_path, mode="wb") as object_fd, open(join(mimic_dir, output["path"]), "rb") as output_fd:
+          while block := output_fd.read(1 << 16):
+            object_fd.write(block)
+
+    # The entry is written last, an entry is only visible once all of its objects are stored
+    with AtomicFileWriter(_get_entry_path(hooks_cache_dir, cache_key)) as entry_fd:
+      dump({ "outputs": output_paths, "files": output_files }, entry_fd)
+    return True
+  except Exception:
+    return False
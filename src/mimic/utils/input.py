@@ -1,5 +1,5 @@
 from re import match
-from sys import stdout
+import sys
 from typing import Union, Any
 
 from .config import MimicVariable
@@ -34,6 +34,31 @@ def check_valid_variable_input_type(variable : MimicVariable, user_input : str)
       return None
   return None
 
+def _get_variable_answer_input(variable : MimicVariable, answer : Any) -> str :
+  if variable.type == "boolean" and isinstance(answer, bool):
+    return "y" if answer else "n"
+  if variable.type == "choice" and isinstance(answer, str) and answer in variable.item:
+    return str(variable.item.index(answer))
+  return str(answer)
+
+def get_variable_answer(variable : MimicVariable, answer : Any) -> Union[Any, None] :
+  """
+  Parses the value of a variable given in an answers file, the same way get_user_variable_input parses user input.
+  Booleans may be given as true/false and choices by value, a missing or null answer falls back to the variable default.
+  """
+
+  if answer is None:
+    if variable.required:
+      raise Exception(f"{variable.name} is required")
+    return variable.default
+
+  parsed_answer = check_valid_variable_input_type(variable, _get_variable_answer_input(variable, answer).strip())
+
+  if parsed_answer is None:
+    raise Exception(f"invalid value {answer!r} for {variable.type} variable {variable.name}")
+
+  return parsed_answer
+
 def _get_variable_input_prompt(variable : MimicVariable) -> str :
   description = "" if variable.description == None else f", {variable.description}"
   
@@ -82,19 +107,19 @@ def _clean_input_prompt(input_prompt : str, raw_user_input : str) -> None :
   lines = input_prompt.split("\n")
 
   for i in range(len(lines)):
-    stdout.write("\033[F")
-    stdout.write("\r")
-    stdout.write(' ' * len(lines[len(lines) - 1 - i]))
+    sys.stdout.write("\033[F")
+    sys.stdout.write("\r")
+    sys.stdout.write(' ' * len(lines[len(lines) - 1 - i]))
     if i == 0:
-      stdout.write(' ' * len(raw_user_input))
-    stdout.flush()
+      sys.stdout.write(' ' * len(raw_user_input))
+    sys.stdout.flush()
 
-  stdout.write("\r")
-  stdout.flush()
+  sys.stdout.write("\r")
+  sys.stdout.flush()
 
 def _clean_input_invalid_prompt(invalid_input_prompt : str) -> None :
-  stdout.write("\r")
-  stdout.write(' ' * len(invalid_input_prompt))
+  sys.stdout.write("\r")
+  sys.stdout.write(' ' * len(invalid_input_prompt))
 
 def get_user_variable_input(variable : MimicVariable) -> Union[Any, None] :
   input_prompt = _get_variable_input_prompt(variable)
@@ -0,0 +1,89 @@
+from json import load, dump
+from os import makedirs, stat_result
+from os.path import join, dirname
+from typing import Dict, List, Any, Tuple, Union, Iterable
+
+from .config import mimic_cache_dir_name
+from .fs import AtomicFileWriter, hash_file, is_relative_path_below
+
+# Bumped whenever the way variable references are found changes, older caches are then discarded
+lint_cache_version = 2
+
+# (variable name, line, is in file name, (start, end) offsets of its placeholders in the file content)
+MimicLintCacheReference = Tuple[str, int, bool, List[Tuple[int, int]]]
+
+class MimicLintCache:
+  """
+  Variable references found in each file of a mimic template by previous lints, stored in <mimic template>/.mimic-cache/lint.idx.
+  An entry is reused while its file keeps the same size and mtime, or the same content hash when only its mtime changed.
+  Lookups are read only and can be made from several threads, entries are recorded from a single thread.
+  """
+
+  file_path : str
+  entries : Dict[str, Dict[str, Any]]
+  recorded_entries : Dict[str, Dict[str, Any]]
+
+  def __init__(self, mimic_template_dir : str):
+    self.file_path = join(mimic_template_dir, mimic_cache_dir_name, "lint.idx")
+    self.entries = {}
+    self.recorded_entries = {}
+
+    try:
+      with open(self.file_path, "r") as fd:
+        raw_cache = load(fd)
+      if raw_cache.get("version") == lint_cache_version:
+        self.entries = raw_cache["files"]
+    except Exception:
+      pass
+
+  def lookup(self, relative_path : str, file_path : str, file_stat : stat_result, is_raw_file : bool) -> Union[Dict[str, Any], None] :
+    """
+    Returns the up to date entry of a file, or None when the file has to be scanned again.
+    """
+
+    entry = self.entries.get(relative_path)
+    if entry == None or entry["is_raw"] != is_raw_file or entry["size"] != file_stat.st_size:
+      return None
+
+    if entry["mtime_ns"] != file_stat.st_mtime_ns:
+      if hash_file(file_path) != entry["hash"]:
+        return None
+      entry = {**entry, "mtime_ns": file_stat.st_mtime_ns}
+
+    return entry
+
+  @staticmethod
+  def new_entry(file_stat : stat_result, file_hash : str, is_raw_file : bool, references : List[MimicLintCacheReference]) -> Dict[str, Any] :
+    """
+    Builds the entry of a file from its stat and hash taken before it was scanned, so that a file changed during the scan is scanned again next time.
+    """
+
+    return {
+      "size": file_stat.st_size,
+      "mtime_ns": file_stat.st_mtime_ns,
+      "hash": file_hash,
+      "is_raw": is_raw_file,
+      "references": references
+    }
+
+  def record(self, relative_path : str, entry : Dict[str, Any]) -> None :
+    self.recorded_entries[relative_path] = entry
+
+  def save(self, scanned_relative_paths : Union[Iterable[str], None] = None) -> bool :
+    """
+    Writes the entries recorded by the current lint, entries of files that were not seen are dropped.
+    When the lint only scanned scanned_relative_paths (and their content), entries of the other files are kept.
+    """
+
+    files = self.recorded_entries
+    if scanned_relative_paths != None:
+      scanned_relative_paths = list(scanned_relative_paths)
+      files = {p: e for p, e in self.entries.items() if not is_relative_path_below(p, scanned_relative_paths)} | self.recorded_entries
+
+    try:
+      makedirs(dirname(self.file_path), exist_ok=True)
+      with AtomicFileWriter(self.file_path) as fd:
+        dump({ "version": lint_cache_version, "files": files }, fd, separators=(",", ":"))
+      return True
+    except Exception:
+      return False
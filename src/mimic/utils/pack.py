@@ -0,0 +1,248 @@
+import mmap
+from json import loads, dumps, dump
+from os import makedirs, chmod
+from os.path import isfile, join, dirname, abspath
+from shutil import copyfileobj
+from struct import Struct, error as StructError
+from tempfile import TemporaryFile
+from typing import Dict, List, Any, Tuple, Union, IO
+from zlib import compress, decompress
+
+try:
+  from compression import zstd
+except ImportError:
+  zstd = None
+
+from .config import MimicConfig, is_mimic_config_data_well_formed
+from .fs import AtomicFileWriter, normalize_relative_path
+from .template_index import MimicTemplateIndex
+
+# A mimic pack is mimic_pack_magic, the length of its header, its JSON header, then the content of its files
+mimic_pack_magic = b"MIMICPACK\0"
+mimic_pack_version = 1
+# Extension of the mimic packs written by mimic pack, it is not required to clone them
+mimic_pack_extension = ".mimicpack"
+_mimic_pack_header_length = Struct("<Q")
+
+MimicPackCompression = ["zlib", "zstd", "none"]
+
+# (relative path, is directory, permissions, blob of a file content (-1 for directories), is ignored)
+MimicPackPath = Tuple[str, bool, int, int, bool]
+# (offset after the header, stored size, content size, compression)
+MimicPackBlob = Tuple[int, int, int, str]
+
+def is_mimic_pack(file_path : str) -> bool :
+  try:
+    if not isfile(file_path):
+      return False
+    with open(file_path, "rb") as fd:
+      return fd.read(len(mimic_pack_magic)) == mimic_pack_magic
+  except OSError:
+    return False
+
+def compress_blob(content : bytes, compression : str) -> Tuple[bytes, str] :
+  """
+  Returns the content to store for a blob along with its compression, contents that do not shrink are stored as is.
+  """
+
+  if compression == "zlib":
+    compressed_content = compress(content)
+  elif compression == "zstd" and zstd is not None:
+    compressed_content = zstd.compress(content)
+  else:
+    return (content, "none")
+
+  if len(content) <= len(compressed_content):
+    return (content, "none")
+  return (compressed_content, compression)
+
+class MimicPackWriter:
+  """
+  Writes a mimic pack: blobs are appended to a temporary file as they come, the header and the blobs are written to file_path on exit.
+  Blobs are deduplicated by content hash.
+  """
+
+  def __init__(self, file_path : str, mimic_config_file_name : str, mimic_config : MimicConfig):
+    self.file_path = file_path
+    self.mimic_config_file_name = mimic_config_file_name
+    self.mimic_config = mimic_config
+    self.paths : List[MimicPackPath] = []
+    self.blobs : List[MimicPackBlob] = []
+    self.blob_ids : Dict[str, int] = {}
+    self.blobs_size = 0
+    self.mimic_index = MimicTemplateIndex()
+    self._blobs_fd : Union[IO[bytes], None] = None
+
+  def __enter__(self) -> "MimicPackWriter" :
+    # The header is only known once every blob is written, blobs are kept aside until then
+    self._blobs_fd = TemporaryFile(dir=dirname(abspath(self.file_path)), prefix=".mimic-", suffix=".tmp")
+    return self
+
+  def has_blob(self, content_hash : str) -> bool :
+    return content_hash in self.blob_ids
+
+  def add_directory(self, relative_path : str, permissions : int, is_ignored : bool) -> None :
+    self.paths.append((relative_path, True, permissions, -1, is_ignored))
+    if not is_ignored:
+      self.mimic_index.add_path(relative_path)
+
+  def add_file(self, relative_path : str, permissions : int, is_ignored : bool, content_hash : str, stored_content : Union[bytes, None], content_length : int, compression : str, file_entry : Union[Dict[str, Any], None]) -> None :
+    """
+    Adds a file, stored_content is only written when no blob with content_hash was written yet (it may be None otherwise).
+    """
+
+    blob_id = self.blob_ids.get(content_hash)
+    if blob_id == None:
+      blob_id = len(self.blobs)
+      self.blobs.append((self.blobs_size, len(stored_content), content_length, compression))
+      self.blob_ids[content_hash] = blob_id
+      self._blobs_fd.write(stored_content)
+      self.blobs_size += len(stored_content)
+
+    self.paths.append((relative_path, False, permissions, blob_id, is_ignored))
+    if not is_ignored:
+      self.mimic_index.add_path(relative_path, file_entry)
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None :
+    try:
+      if exc_type is not None:
+        return
+
+      header = dumps({
+        "version": mimic_pack_version,
+        "config_file_name": self.mimic_config_file_name,
+        "config": self.mimic_config.validated_raw,
+        "paths": self.paths,
+        "blobs": self.blobs,
+        "index": { "files": self.mimic_index.files, "names": self.mimic_index.names }
+      }, separators=(",", ":")).encode()
+
+      self._blobs_fd.seek(0)
+      with AtomicFileWriter(self.file_path, mode="wb") as pack_fd:
+        pack_fd.write(mimic_pack_magic)
+        pack_fd.write(_mimic_pack_header_length.pack(len(header)))
+        pack_fd.write(header)
+        copyfileobj(self._blobs_fd, pack_fd)
+    finally:
+      self._blobs_fd.close()
+
+def _check_mimic_pack_paths(file_path : str, mimic_config_file_name : str, paths : List[MimicPackPath]) -> None :
+  """
+  Raises unless every path of a mimic pack stays inside the directory it is rendered or extracted to: paths must be normalized relative paths whose parent directory is listed before them.
+  """
+
+  if "/" in mimic_config_file_name or normalize_relative_path(mimic_config_file_name, file_path) != mimic_config_file_name:
+    raise Exception(f"unsafe mimic config file name {mimic_config_file_name} in {file_path}")
+
+  directory_paths = {""}
+  for relative_path, is_directory, _, _, _ in paths:
+    if not relative_path or normalize_relative_path(relative_path, file_path) != relative_path or not relative_path.rpartition("/")[0] in directory_paths:
+      raise Exception(f"unsafe path {relative_path} in {file_path}")
+    if is_directory:
+      directory_paths.add(relative_path)
+
+class MimicPack:
+  """
+  A mimic pack opened for reading, its file is mapped in memory and blobs are read from the mapping.
+  """
+
+  file_path : str
+  mimic_config_file_name : str
+  mimic_config : MimicConfig
+  paths : List[MimicPackPath]
+  blobs : List[MimicPackBlob]
+  mimic_index : MimicTemplateIndex
+
+  def __init__(self, file_path : str):
+    self.file_path = file_path
+    with open(file_path, "rb") as fd:
+      self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+      if self._mmap[:len(mimic_pack_magic)] != mimic_pack_magic:
+        raise Exception(f"{file_path} is not a mimic pack")
+      try:
+        header_length, = _mimic_pack_header_length.unpack_from(self._mmap, len(mimic_pack_magic))
+        header_offset = len(mimic_pack_magic) + _mimic_pack_header_length.size
+        header = loads(self._mmap[header_offset:header_offset + header_length])
+      except (StructError, ValueError):
+        raise Exception(f"{file_path}: broken mimic pack header")
+      if header.get("version") != mimic_pack_version:
+        raise Exception(f"{file_path}: unsupported mimic pack version {header.get('version')}")
+      if not is_mimic_config_data_well_formed(header["config"]):
+        raise Exception(f"{file_path}: broken mimic config")
+      _check_mimic_pack_paths(file_path, header["config_file_name"], header["paths"])
+
+      self.data_offset = header_offset + header_length
+      self.mimic_config_file_name = header["config_file_name"]
+      self.mimic_config = MimicConfig(header["config"])
+      self.paths = header["paths"]
+      self.blobs = header["blobs"]
+      # Placeholders of names are found again in the checked paths, the names of the header are not trusted
+      self.mimic_index = MimicTemplateIndex(header["index"]["files"])
+      for relative_path, _, _, _, is_ignored in self.paths:
+        if not is_ignored:
+          self.mimic_index.add_path(relative_path)
+    except BaseException:
+      self._mmap.close()
+      raise
+
+    # Blobs are mostly read in the order they were written
+    if hasattr(self._mmap, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+      self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+  def read_blob(self, blob_id : int) -> bytes :
+    offset, size, _, compression = self.blobs[blob_id]
+    stored_content = self._mmap[self.data_offset + offset:self.data_offset + offset + size]
+    if compression == "zlib":
+      return decompress(stored_content)
+    if compression == "zstd":
+      if zstd is None:
+        raise Exception(f"{self.file_path}: zstd compressed mimic packs require python 3.14 or later")
+      return zstd.decompress(stored_content)
+    return stored_content
+
+  def blob_offset(self, blob_id : int) -> int :
+    return self.blobs[blob_id][0]
+
+  def blob_length(self, blob_id : int) -> int :
+    return self.blobs[blob_id][2]
+
+  def close(self) -> None :
+    self._mmap.close()
+
+  def __enter__(self) -> "MimicPack" :
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None :
+    self.close()
+
+def extract_mimic_pack(file_path : str, out_dir : str) -> bool :
+  """
+  Extracts a mimic pack as a mimic template in out_dir: its files, its mimic config and its template index (see MimicTemplateIndex).
+  """
+
+  try:
+    with MimicPack(file_path) as mimic_pack:
+      makedirs(out_dir)
+      dir_permissions : List[Tuple[str, int]] = []
+      for relative_path, is_directory, permissions, blob_id, _ in mimic_pack.paths:
+        path = join(out_dir, relative_path)
+        if is_directory:
+          makedirs(path, exist_ok=True)
+          dir_permissions.append((path, permissions))
+        else:
+          with open(path, "wb") as fd:
+            fd.write(mimic_pack.read_blob(blob_id))
+          chmod(path, permissions)
+
+      with open(join(out_dir, mimic_pack.mimic_config_file_name), "w") as fd:
+        dump(mimic_pack.mimic_config.validated_raw, fd, indent=2)
+      is_mimic_index_saved = mimic_pack.mimic_index.save(out_dir)
+
+      # Directories may be read only, their permissions are applied once their content is written, deepest first
+      for dir_path, permissions in reversed(dir_permissions):
+        chmod(dir_path, permissions)
+      return is_mimic_index_saved
+  except Exception:
+    return False
@@ -0,0 +1,100 @@
+from re import compile
+from typing import Dict, Any, IO, Iterable, Tuple
+
+from .config import MimicVariable
+
+extract_variable_name_regex = r"(?<!\{\{)\{\{\s*(?P<variable_name>\w+)\s*\}\}(?!\}\})"
+extract_escaped_variable_name_regex = r"\{\{\{\{\s*(?P<variable_name>\w+)\s*\}\}\}\}"
+
+# Escaped placeholders are tried first so that "{{{{ var }}}}" is never seen as a variable
+placeholder_regex = compile(r"\{\{\{\{\s*(?P<escaped_variable_name>\w+)\s*\}\}\}\}|" + extract_variable_name_regex)
+# Longest text that a placeholder starting with a run of "{" can span
+partial_placeholder_regex = compile(r"\{*\s*\w*\s*\}*")
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+def _safe_render_end(buffer : str) -> int :
+  """
+  Returns the length of the longest prefix of buffer that renders the same whatever text follows it.
+  Placeholders never contain a "{" after their opening braces, so only the last run of "{" can start one that is not complete yet.
+  """
+
+  last_brace_index = buffer.rfind("{")
+  if last_brace_index == -1:
+    return len(buffer)
+
+  brace_run_start = last_brace_index
+  while 0 < brace_run_start and buffer[brace_run_start - 1] == "{":
+    brace_run_start -= 1
+
+  if partial_placeholder_regex.match(buffer, brace_run_start).end() < len(buffer):
+    return len(buffer)
+
+  return brace_run_start
+
+class MimicRenderer:
+  """
+  Substitutes variables and escaped variables of a template in a single pass.
+  Variable values are formatted once when the renderer is built and reused for every render.
+  """
+
+  substitution_table : Dict[str, str]
+
+  def __init__(self, variables : Dict[str, MimicVariable], variables_values : Dict[str, Any]):
+    self.substitution_table = {}
+    for variable_name, variable in variables.items():
+      user_value = variables_values.get(variable_name, "")
+      self.substitution_table[variable_name] = variable.format_variable_value(user_value) if not user_value is None else ""
+
+  def render_placeholder(self, variable_name : str, is_escaped : bool) -> str :
+    if is_escaped:
+      return "{{ " + variable_name + " }}"
+    return self.substitution_table.get(variable_name, "")
+
+  def _replace_placeholder(self, match) -> str :
+    if (escaped_variable_name := match.group("escaped_variable_name")) is not None:
+      return self.render_placeholder(escaped_variable_name, True)
+    return self.render_placeholder(match.group("variable_name"), False)
+
+  def render_spliced(self, template : str, placeholders : Iterable[Tuple[int, int, str, bool]]) -> str :
+    """
+    Renders template from the (start, end, variable name, is escaped) placeholders found in it beforehand, without searching them again.
+    """
+
+    parts = []
+    position = 0
+    for start, end, variable_name, is_escaped in placeholders:
+      parts.append(template[position:start])
+      parts.append(self.render_placeholder(variable_name, is_escaped))
+      position = end
+    parts.append(template[position:])
+    return "".join(parts)
+
+  def render(self, template : str) -> str :
+    if not "{{" in template:
+      return template
+    return placeholder_regex.sub(self._replace_placeholder, template)
+
+  def render_stream(self, source : IO[str], destination : IO[str], chunk_size : int = DEFAULT_CHUNK_SIZE) -> int :
+    """
+    Renders source into destination chunk by chunk and returns the number of rendered placeholders.
+    A placeholder that straddles two chunks is held back until it is complete.
+    """
+
+    rendered_placeholder_count = 0
+    pending = ""
+
+    while chunk := source.read(chunk_size):
+      pending += chunk
+      safe_end = _safe_render_end(pending)
+      if safe_end == 0:
+        continue
+      rendered, placeholder_count = placeholder_regex.subn(self._replace_placeholder, pending[:safe_end])
+      destination.write(rendered)
+      rendered_placeholder_count += placeholder_count
+      pending = pending[safe_end:]
+
+    rendered, placeholder_count = placeholder_regex.subn(self._replace_placeholder, pending)
+    destination.write(rendered)
+
+    return rendered_placeholder_count + placeholder_count
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, Future, FIRST_COMPLETED, wait
+from heapq import heappush, heappop
+from itertools import count
+from os import cpu_count
+from typing import Callable, Iterable, Iterator, Tuple, Dict, List, TypeVar, Union, Any
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+def default_jobs() -> int :
+  return min(32, (cpu_count() or 1) + 4)
+
+def _iter_by_weight(items : Iterable[Item], weight : Union[Callable[[Item], int], None], lookahead : int) -> Iterator[Tuple[int, Item]] :
+  """
+  Yields (weight, item) pairs, heaviest first among the next lookahead items.
+  """
+
+  items_iterator = iter(items)
+  pending : List[Tuple[int, int, Item]] = []
+  pending_order = count()
+  exhausted = False
+
+  while True:
+    while not exhausted and len(pending) < lookahead:
+      try:
+        item = next(items_iterator)
+      except StopIteration:
+        exhausted = True
+        break
+      heappush(pending, (-weight(item) if weight else 0, next(pending_order), item))
+
+    if not pending:
+      return
+
+    negative_item_weight, _, item = heappop(pending)
+    yield (-negative_item_weight, item)
+
+def _run_bounded(executor : Executor, submit : Callable[[Executor], Union[Tuple[Future, Any], None]], max_in_flight : int) -> Iterator[Tuple[Any, Any]] :
+  in_flight : Dict[Future, Any] = {}
+  exhausted = False
+
+  while True:
+    while not exhausted and len(in_flight) < max_in_flight:
+      submitted = submit(executor)
+      if submitted is None:
+        exhausted = True
+        break
+      future, payload = submitted
+      in_flight[future] = payload
+
+    if not in_flight:
+      return
+
+    done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+    for future in done:
+      yield (in_flight.pop(future), future.result())
+
+def schedule(target : Callable[[Item], Result], items : Iterable[Item], jobs : Union[int, None] = None, weight : Union[Callable[[Item], int], None] = None, lookahead : int = 4096) -> Iterator[Tuple[Item, Result]] :
+  """
+  Runs target on every item with a pool of jobs threads and yields (item, result) pairs as they complete.
+  Items are pulled lazily and at most 2 * jobs of them are in flight at once.
+  When weight is given, the heaviest of the next lookahead items is always submitted first.
+  """
+
+  jobs = jobs or default_jobs()
+  ordered_items = _iter_by_weight(items, weight, lookahead)
+
+  def _submit(executor : Executor) -> Union[Tuple[Future, Item], None] :
+    for _, item in ordered_items:
+      return (executor.submit(target, item), item)
+    return None
+
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    yield from _run_bounded(executor, _submit, 2 * jobs)
+
+def schedule_batches(target : Callable[[List[Item]], List[Result]], items : Iterable[Item], initializer : Callable[..., None], initargs : Tuple[Any, ...], jobs : Union[int, None] = None, weight : Union[Callable[[Item], int], None] = None, batch_size : int = 64, batch_weight : int = 1 << 20, lookahead : int = 4096) -> Iterator[Tuple[Item, Result]] :
+  """
+  Runs target on batches of items with a pool of jobs processes and yields (item, result) pairs as batches complete.
+  Every worker process runs initializer(*initargs) once at startup, so shared state is not sent along with each batch.
+  A batch is closed once it holds batch_size items or once the weight of its items reaches batch_weight.
+  """
+
+  jobs = jobs or cpu_count() or 1
+  ordered_items = _iter_by_weight(items, weight, lookahead)
+
+  def _submit(executor : Executor) -> Union[Tuple[Future, List[Item]], None] :
+    batch : List[Item] = []
+    accumulated_weight = 0
+    for item_weight, item in ordered_items:
+      batch.append(item)
+      accumulated_weight += item_weight
+      if batch_size <= len(batch) or batch_weight <= accumulated_weight:
+        break
+    if not batch:
+      return None
+    return (executor.submit(target, batch), batch)
+
+  with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+    for batch, batch_results in _run_bounded(executor, _submit, 2 * jobs):
+      yield from zip(batch, batch_results)
@@ -0,0 +1,162 @@
+from hashlib import sha256
+from json import load, dump
+from os.path import join
+from typing import Dict, List, Any, Tuple, Union, IO, Iterable
+
+from .config import mimic_index_file_name
+from .fs import AtomicFileWriter, check_file_name
+from .render import MimicRenderer, placeholder_regex
+
+# Bumped whenever the layout of the index changes, older indexes are then ignored
+mimic_index_version = 1
+
+# (start, end) offsets of a placeholder, the name of its variable and whether it is escaped ("{{{{ name }}}}")
+MimicIndexPlaceholder = Tuple[int, int, str, bool]
+
+def find_placeholders(template : str) -> List[MimicIndexPlaceholder] :
+  placeholders : List[MimicIndexPlaceholder] = []
+  for match in placeholder_regex.finditer(template):
+    escaped_variable_name = match.group("escaped_variable_name")
+    placeholders.append((match.start(), match.end(), escaped_variable_name if escaped_variable_name is not None else match.group("variable_name"), escaped_variable_name is not None))
+  return placeholders
+
+def _to_byte_offsets(text : str, placeholders : List[MimicIndexPlaceholder]) -> List[MimicIndexPlaceholder] :
+  if text.isascii():
+    return placeholders
+
+  byte_placeholders : List[MimicIndexPlaceholder] = []
+  char_offset = 0
+  byte_offset = 0
+  for start, end, variable_name, is_escaped in placeholders:
+    byte_start = byte_offset + len(text[char_offset:start].encode())
+    byte_offset = byte_start + len(text[start:end].encode())
+    char_offset = end
+    byte_placeholders.append((byte_start, byte_offset, variable_name, is_escaped))
+  return byte_placeholders
+
+def index_content(content : bytes) -> Union[Dict[str, Any], None] :
+  """
+  Returns the index entry of a file content: its sha256 and its placeholders, as byte offsets in the content.
+  Returns None for contents that cannot be rendered by splicing: contents that are not UTF-8, and contents with carriage returns whose line endings the text renderer normalizes.
+  """
+
+  file_entry = { "hash": sha256(content).hexdigest(), "placeholders": [] }
+  # Same sniffing as is_binary_file
+  if not b"{{" in content or b"\x00" in content[:8192]:
+    return file_entry
+
+  try:
+    text = content.decode()
+  except UnicodeDecodeError:
+    return None
+
+  placeholders = find_placeholders(text)
+  if len(placeholders) and b"\r" in content:
+    return None
+
+  file_entry["placeholders"] = _to_byte_offsets(text, placeholders)
+  return file_entry
+
+def index_file(source_file_path : str) -> Union[Dict[str, Any], None] :
+  with open(source_file_path, "rb") as fd:
+    return index_content(fd.read())
+
+def splice_content(content : bytes, placeholders : Iterable[MimicIndexPlaceholder], renderer : MimicRenderer, offset : int = 0) -> bytes :
+  """
+  Renders content from the byte offsets of its placeholders, offset being the offset of content in the indexed file.
+  """
+
+  parts = []
+  position = 0
+  for start, end, variable_name, is_escaped in placeholders:
+    parts.append(content[position:start - offset])
+    parts.append(renderer.render_placeholder(variable_name, is_escaped).encode())
+    position = end - offset
+  parts.append(content[position:])
+  return b"".join(parts)
+
+def render_indexed_file(source : IO[bytes], destination : IO[bytes], file_entry : Dict[str, Any], renderer : MimicRenderer, block_size : int = 1 << 16) -> bool :
+  """
+  Renders source into destination block by block, splicing variables values at the offsets of file_entry placeholders.
+  Returns False when source is not the content file_entry was built from, destination must then be rendered again without the index.
+  """
+
+  digest = sha256()
+  position = 0
+
+  def _copy_until(offset : Union[int, None]) -> None :
+    nonlocal position
+    while offset is None or position < offset:
+      block = source.read(block_size if offset is None else min(block_size, offset - position))
+      if not block:
+        return
+      digest.update(block)
+      destination.write(block)
+      position += len(block)
+
+  for start, end, variable_name, is_escaped in file_entry["placeholders"]:
+    _copy_until(start)
+    placeholder = source.read(end - start)
+    digest.update(placeholder)
+    position += len(placeholder)
+    destination.write(renderer.render_placeholder(variable_name, is_escaped).encode())
+  _copy_until(None)
+
+  return digest.hexdigest() == file_entry["hash"]
+
+class MimicTemplateIndex:
+  """
+  Placeholders of every path of a mimic template, stored in <mimic template>/.mimic.index by mimic index.
+  Names of indexed paths and content of indexed files are rendered by splicing variables values at the recorded offsets.
+  A file entry is only trusted while the file keeps the content hash it was indexed with, paths missing from the index are rendered with regular expressions.
+  """
+
+  files : Dict[str, Dict[str, Any]]
+  names : Dict[str, List[MimicIndexPlaceholder]]
+
+  def __init__(self, files : Union[Dict[str, Dict[str, Any]], None] = None, names : Union[Dict[str, List[MimicIndexPlaceholder]], None] = None):
+    self.files = files if files != None else {}
+    # Placeholders of the last segment of every indexed path, as character offsets
+    self.names = names if names != None else {}
+
+  @staticmethod
+  def load(mimic_template_dir : str) -> Union["MimicTemplateIndex", None] :
+    try:
+      with open(join(mimic_template_dir, mimic_index_file_name), "r") as fd:
+        raw_index = load(fd)
+      if raw_index.get("version") != mimic_index_version:
+        return None
+      return MimicTemplateIndex(raw_index["files"], raw_index["names"])
+    except Exception:
+      return None
+
+  def save(self, mimic_template_dir : str) -> bool :
+    try:
+      with AtomicFileWriter(join(mimic_template_dir, mimic_index_file_name)) as fd:
+        dump({ "version": mimic_index_version, "files": self.files, "names": self.names }, fd, separators=(",", ":"))
+      return True
+    except Exception:
+      return False
+
+  def add_path(self, relative_path : str, file_entry : Union[Dict[str, Any], None] = None) -> None :
+    self.names[relative_path] = find_placeholders(relative_path.rpartition("/")[2])
+    if file_entry != None:
+      self.files[relative_path] = file_entry
+
+  def get_file_entry(self, relative_path : str) -> Union[Dict[str, Any], None] :
+    return self.files.get(relative_path)
+
+  def render_name(self, relative_path : str, name : str, renderer : MimicRenderer) -> str :
+    """
+    Renders the name of relative_path, raises when the rendered name is not the name of a single file or directory.
+    """
+
+    name_placeholders = self.names.get(relative_path)
+    if name_placeholders == None:
+      return check_file_name(renderer.render(name), relative_path)
+    if not len(name_placeholders):
+      return check_file_name(name, relative_path)
+    return check_file_name(renderer.render_spliced(name, name_placeholders), relative_path)
+
+  def placeholder_count(self) -> int :
+    return sum(len(file_entry["placeholders"]) for file_entry in self.files.values()) + sum(len(name_placeholders) for name_placeholders in self.names.values())
@@ -0,0 +1,216 @@
+from contextlib import contextmanager
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from errno import ENOENT, ENOTDIR
+from os import close, fsencode, read, strerror, stat_result
+from os.path import join
+from select import select
+from signal import SIGINT, default_int_handler, signal
+from struct import calcsize, unpack_from
+from sys import platform
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Set, Tuple, Union
+
+from .fs import GlobMatcher, is_relative_path_below, scandir_tree
+
+# Changes are reported once no event happened for watch_debounce_delay seconds, or at most watch_max_delay seconds after the first one
+watch_debounce_delay = 0.2
+watch_max_delay = 2.0
+watch_poll_interval = 1.0
+
+# From <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_inotify_watch_mask = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+_inotify_event_header = "iIII"
+_inotify_event_header_size = calcsize(_inotify_event_header)
+
+class _InotifyWatcher:
+  """
+  Watches every directory of a tree with one inotify watch, directories created later are watched as they appear.
+  """
+
+  def __init__(self, root_dir : str, ignore_matcher : GlobMatcher, excluded_relative_paths : Set[str]):
+    self.root_dir = root_dir
+    self.ignore_matcher = ignore_matcher
+    self.excluded_relative_paths = excluded_relative_paths
+    self.watched_dirs : Dict[int, str] = {}
+
+    self.libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+    self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(get_errno(), strerror(get_errno()))
+
+    try:
+      self._watch_tree("")
+    except BaseException:
+      close(self.fd)
+      raise
+
+  def _watch_dir(self, relative_dir_path : str) -> None :
+    wd = self.libc.inotify_add_watch(self.fd, fsencode(join(self.root_dir, relative_dir_path) if relative_dir_path else self.root_dir), _inotify_watch_mask)
+    if wd < 0:
+      # The directory may already be gone, anything else (eg the watch limit is reached) is fatal
+      if get_errno() in (ENOENT, ENOTDIR):
+        return
+      raise OSError(get_errno(), f"could not watch {join(self.root_dir, relative_dir_path)}: {strerror(get_errno())}")
+    self.watched_dirs[wd] = relative_dir_path
+
+  def _watch_tree(self, relative_dir_path : str) -> None :
+    self._watch_dir(relative_dir_path)
+    for entry, relative_path, _ in scandir_tree(self.ignore_matcher, self.root_dir, True, self.excluded_relative_paths, [relative_dir_path] if relative_dir_path else None):
+      if entry.is_dir(follow_symlinks=False) and relative_path != relative_dir_path and not self.ignore_matcher.match_tree(relative_path):
+        self._watch_dir(relative_path)
+
+  def _unwatch_tree(self, relative_dir_path : str) -> None :
+    for wd, watched_dir_path in list(self.watched_dirs.items()):
+      if is_relative_path_below(watched_dir_path, [relative_dir_path]):
+        self.libc.inotify_rm_watch(self.fd, wd)
+        del self.watched_dirs[wd]
+
+  def read(self, timeout : Union[float, None]) -> Union[Set[str], None] :
+    """
+    Returns the paths changed within timeout seconds (blocks until a change when timeout is None), or None when events were lost.
+    """
+
+    changed_paths : Set[str] = set()
+    readable, _, _ = select([self.fd], [], [], timeout)
+    if not readable:
+      return changed_paths
+
+    try:
+      buffer = read(self.fd, 1 << 16)
+    except BlockingIOError:
+      return changed_paths
+
+    offset = 0
+    while offset < len(buffer):
+      wd, mask, _, name_length = unpack_from(_inotify_event_header, buffer, offset)
+      name = buffer[offset + _inotify_event_header_size:offset + _inotify_event_header_size + name_length].rstrip(b"\0").decode(errors="surrogateescape")
+      offset += _inotify_event_header_size + name_length
+
+      if mask & _IN_Q_OVERFLOW:
+        return None
+      if mask & _IN_IGNORED:
+        self.watched_dirs.pop(wd, None)
+        continue
+      if not wd in self.watched_dirs or not name:
+        continue
+
+      relative_dir_path = self.watched_dirs[wd]
+      relative_path = f"{relative_dir_path}/{name}" if relative_dir_path else name
+      if relative_path in self.excluded_relative_paths:
+        continue
+
+      if mask & _IN_ISDIR:
+        if mask & (_IN_MOVED_FROM | _IN_DELETE):
+          self._unwatch_tree(relative_path)
+        elif mask & (_IN_CREATE | _IN_MOVED_TO) and not self.ignore_matcher.match_tree(relative_path):
+          self._watch_tree(relative_path)
+      changed_paths.add(relative_path)
+
+    return changed_paths
+
+  def close(self) -> None :
+    close(self.fd)
+
+class _PollingWatcher:
+  """
+  Finds changes by comparing the stat of every path of a tree between two walks.
+  """
+
+  def __init__(self, root_dir : str, ignore_matcher : GlobMatcher, excluded_relative_paths : Set[str], poll_interval : float):
+    self.root_dir = root_dir
+    self.ignore_matcher = ignore_matcher
+    self.excluded_relative_paths = excluded_relative_paths
+    self.poll_interval = poll_interval
+    self.snapshot = self._take_snapshot()
+
+  def _take_snapshot(self) -> Dict[str, Tuple[int, int, int, int]] :
+    snapshot : Dict[str, Tuple[int, int, int, int]] = {}
+    for entry, relative_path, _ in scandir_tree(self.ignore_matcher, self.root_dir, True, self.excluded_relative_paths):
+      try:
+        entry_stat : stat_result = entry.stat(follow_symlinks=False)
+      except OSError:
+        continue
+      snapshot[relative_path] = (entry_stat.st_mode, entry_stat.st_ino, entry_stat.st_size, entry_stat.st_mtime_ns)
+    return snapshot
+
+  def read(self, timeout : Union[float, None]) -> Union[Set[str], None] :
+    """
+    Returns the paths changed within timeout seconds (blocks until a change when timeout is None).
+    """
+
+    deadline = None if timeout is None else monotonic() + timeout
+    while True:
+      sleep(self.poll_interval if deadline is None else max(0, min(self.poll_interval, deadline - monotonic())))
+      snapshot = self._take_snapshot()
+      changed_paths = {p for p in snapshot.keys() | self.snapshot.keys() if snapshot.get(p) != self.snapshot.get(p)}
+      self.snapshot = snapshot
+      if len(changed_paths) or (deadline is not None and deadline <= monotonic()):
+        return changed_paths
+
+  def close(self) -> None :
+    pass
+
+def watch_tree(root_dir : str, ignorePatterns : List[str], excluded_relative_paths : Set[str] = set(), poll_interval : float = watch_poll_interval) -> Iterator[Union[Set[str], None]] :
+  """
+  Yields the paths (relative to root_dir, "/" separated) changed since the previous yield, a burst of changes being yielded at once.
+  Yields None when changes were lost and the whole tree has to be considered changed.
+  Uses inotify on Linux and falls back to stat polling every poll_interval seconds elsewhere.
+  Directories whose whole content is ignored (eg "node_modules/**") and excluded paths are not watched.
+  """
+
+  ignore_matcher = GlobMatcher(ignorePatterns)
+  watcher = None
+  if platform.startswith("linux"):
+    try:
+      watcher = _InotifyWatcher(root_dir, ignore_matcher, excluded_relative_paths)
+    except (OSError, AttributeError):
+      watcher = None
+  if watcher is None:
+    watcher = _PollingWatcher(root_dir, ignore_matcher, excluded_relative_paths, poll_interval)
+
+  try:
+    while True:
+      changed_paths = watcher.read(None)
+      first_change_time = monotonic()
+      while True:
+        more_changed_paths = watcher.read(min(watch_debounce_delay, max(0, first_change_time + watch_max_delay - monotonic())))
+        if changed_paths is None or more_changed_paths is None:
+          changed_paths = None
+        else:
+          changed_paths |= more_changed_paths
+        if not more_changed_paths or watch_max_delay <= monotonic() - first_change_time:
+          break
+
+      if changed_paths is None or len(changed_paths):
+        yield changed_paths
+  finally:
+    watcher.close()
+
+@contextmanager
+def interruptible() -> Iterator[None] :
+  """
+  Raises KeyboardInterrupt on Ctrl+C within the context, instead of running the SIGINT handler of the CLI which exits with an error status.
+  Watching commands are only stopped with Ctrl+C, they catch it to exit successfully.
+  """
+
+  previous_handler = signal(SIGINT, default_int_handler)
+  try:
+    yield
+  finally:
+    signal(SIGINT, previous_handler)